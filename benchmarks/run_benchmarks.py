@@ -0,0 +1,247 @@
+"""Benchmark the feature extraction and clustering pipeline on synthetic data.
+
+Every benchmark runs in a fresh spawned process so that its peak RSS is not
+inflated by earlier runs. Results are written as JSON for comparison between
+releases::
+
+    python benchmarks/run_benchmarks.py --sizes 64 256 --workers 1 4 \
+        --output bench_results.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import platform
+import argparse
+import tempfile
+import multiprocessing
+from datetime import datetime, timezone
+from typing import Dict, List
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_data import make_synthetic_images
+from cluster_aware_splitter import logger
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux; children covers pool workers
+    usage_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return (usage_self + usage_children) / 1024.0
+
+
+def _latency_summary(durations) -> Dict[str, float]:
+    durations_ms = np.asarray(durations, dtype=np.float64) * 1000.0
+    return {"mean_ms": float(durations_ms.mean()),
+            "p50_ms": float(np.percentile(durations_ms, 50)),
+            "p95_ms": float(np.percentile(durations_ms, 95)),
+            }
+
+
+def _make_img_property_set(img_paths, max_num_clusters=4):
+    from cluster_aware_splitter.feat import ImgPropertySetReturnType
+    return ImgPropertySetReturnType(img_names=[os.path.basename(img_path) for img_path in img_paths],
+                                    img_paths=list(img_paths), total_num_imgs=len(img_paths),
+                                    max_num_clusters=max_num_clusters
+                                    )
+
+
+def bench_stage_latency(img_paths, batch_size=32, **kwargs) -> Dict:
+    from cluster_aware_splitter.feat import FeatureExtractor, normalize_image_dtype, tf
+    feat_extract = FeatureExtractor(model_family="efficientnet")
+    feature_extractor, preprocess = feat_extract.get_cached_feature_extractor()
+    decode_times, resize_times, decoded = [], [], []
+    for img_path in img_paths:
+        start = time.perf_counter()
+        x = tf.image.decode_image(tf.io.read_file(img_path), channels=3, expand_animations=False)
+        x = normalize_image_dtype(x)
+        decode_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        decoded.append(tf.image.resize(x, feat_extract.image_shape[:2]))
+        resize_times.append(time.perf_counter() - start)
+    forward_times = []
+    for i in range(0, len(decoded), batch_size):
+        batch = tf.stack(decoded[i:i+batch_size])
+        start = time.perf_counter()
+        feature_extractor(preprocess(batch), training=False)
+        forward_times.append((time.perf_counter() - start) / len(batch))
+    return {"stages": {"decode": _latency_summary(decode_times),
+                       "resize": _latency_summary(resize_times),
+                       "forward_pass_per_image": _latency_summary(forward_times),
+                       }}
+
+
+def bench_get_imgs_and_extract_features(img_paths, **kwargs) -> Dict:
+    from cluster_aware_splitter.feat import get_imgs_and_extract_features
+    for img_path in img_paths:
+        get_imgs_and_extract_features(img_path=img_path, img_resize_width=224,
+                                      img_resize_height=224, model_family="efficientnet",
+                                      model_name="EfficientNetB0",
+                                      img_normalization_weight="imagenet", seed=2024
+                                      )
+    return {}
+
+
+def bench_img_feature_extraction_implementor(img_paths, execution_mode="single_process",
+                                             batch_size=32, **kwargs
+                                             ) -> Dict:
+    from cluster_aware_splitter.feat import img_feature_extraction_implementor
+    img_feature_extraction_implementor(_make_img_property_set(img_paths),
+                                       execution_mode=execution_mode,
+                                       batch_size=batch_size
+                                       )
+    return {"execution_mode": execution_mode}
+
+
+def bench_run_multiprocess(img_paths, num_workers=None, batch_size=32, **kwargs) -> Dict:
+    from cluster_aware_splitter.feat import run_multiprocess
+    run_multiprocess(_make_img_property_set(img_paths), num_processes=num_workers,
+                     batch_size=batch_size, clustering_backend="minibatch_kmeans"
+                     )
+    return {}
+
+
+def bench_extract_object_features_per_image(img_paths, coco_annotation_filepath,
+                                            crop_mode="bbox", **kwargs
+                                            ) -> Dict:
+    from cluster_aware_splitter.feat import extract_object_features_per_image
+    extract_object_features_per_image(img_paths, coco_annotation_filepath,
+                                      crop_mode=crop_mode
+                                      )
+    return {"crop_mode": crop_mode}
+
+
+def bench_cluster_features(num_images, feature_dim=1280,
+                           clustering_backend="minibatch_kmeans", **kwargs
+                           ) -> Dict:
+    from cluster_aware_splitter.feat import cluster_features
+    rng = np.random.default_rng(2024)
+    centers = rng.normal(scale=5.0, size=(8, feature_dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), size=num_images)
+    img_property_set = _make_img_property_set([f"img_{i}.jpg" for i in range(num_images)],
+                                              max_num_clusters=10
+                                              )
+    img_property_set.features = centers[labels] + rng.normal(size=(num_images, feature_dim)).astype(np.float32)
+    cluster_features(img_property_set, clustering_backend=clustering_backend)
+    return {"clustering_backend": clustering_backend, "feature_dim": feature_dim}
+
+
+BENCHMARKS = {"stage_latency": bench_stage_latency,
+              "get_imgs_and_extract_features": bench_get_imgs_and_extract_features,
+              "img_feature_extraction_implementor": bench_img_feature_extraction_implementor,
+              "run_multiprocess": bench_run_multiprocess,
+              "extract_object_features_per_image": bench_extract_object_features_per_image,
+              "cluster_features": bench_cluster_features,
+              }
+
+
+def _run_and_measure(benchmark_name, kwargs) -> Dict:
+    start = time.perf_counter()
+    metrics = BENCHMARKS[benchmark_name](**kwargs) or {}
+    seconds = time.perf_counter() - start
+    num_images = kwargs.get("num_images") or len(kwargs.get("img_paths", []))
+    metrics.update({"benchmark": benchmark_name, "num_images": num_images,
+                    "num_workers": kwargs.get("num_workers"),
+                    "seconds": seconds,
+                    "images_per_sec": num_images / seconds if seconds else None,
+                    "peak_rss_mb": _peak_rss_mb(),
+                    })
+    return metrics
+
+
+def run_isolated(benchmark_name, **kwargs) -> Dict:
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_run_and_measure, (benchmark_name, kwargs))
+
+
+def get_metadata() -> Dict:
+    try:
+        from cluster_aware_splitter import __version__
+    except Exception:
+        __version__ = None
+    return {"package_version": __version__, "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            }
+
+
+def run_benchmarks(sizes: List[int], workers: List[int], benchmarks: List[str],
+                   data_dir=None, batch_size=32
+                   ) -> Dict:
+    data_dir = data_dir or tempfile.mkdtemp(prefix="cluster_aware_splitter_bench_")
+    results = []
+    for num_images in sizes:
+        img_dir = os.path.join(data_dir, f"images_{num_images}")
+        img_paths, coco_annotation_filepath = make_synthetic_images(img_dir, num_images=num_images)
+        common = {"img_paths": img_paths, "batch_size": batch_size}
+        runs = []
+        if "stage_latency" in benchmarks:
+            runs.append(("stage_latency", common))
+        if "get_imgs_and_extract_features" in benchmarks:
+            runs.append(("get_imgs_and_extract_features", common))
+        if "img_feature_extraction_implementor" in benchmarks:
+            for execution_mode in ("single_process", "tf_data", "multiprocess"):
+                runs.append(("img_feature_extraction_implementor",
+                             {**common, "execution_mode": execution_mode}
+                             ))
+        if "run_multiprocess" in benchmarks:
+            for num_workers in workers:
+                runs.append(("run_multiprocess", {**common, "num_workers": num_workers}))
+        if "extract_object_features_per_image" in benchmarks:
+            for crop_mode in ("bbox", "mask"):
+                runs.append(("extract_object_features_per_image",
+                             {**common, "coco_annotation_filepath": coco_annotation_filepath,
+                              "crop_mode": crop_mode
+                              }))
+        if "cluster_features" in benchmarks:
+            for clustering_backend in ("clusteval", "minibatch_kmeans"):
+                runs.append(("cluster_features", {"num_images": num_images,
+                                                  "clustering_backend": clustering_backend
+                                                  }))
+        for benchmark_name, kwargs in runs:
+            logger.info(f"Running {benchmark_name} on {num_images} images with {kwargs.get('num_workers')} workers")
+            try:
+                results.append(run_isolated(benchmark_name, **kwargs))
+            except Exception as error:
+                logger.exception(f"{benchmark_name} on {num_images} images failed")
+                results.append({"benchmark": benchmark_name, "num_images": num_images,
+                                "num_workers": kwargs.get("num_workers"), "error": repr(error)
+                                })
+    return {"metadata": get_metadata(), "results": results}
+
+
+def main(argv=None) -> int:
+    """Run the benchmarks, write the report and return 1 if any benchmark failed."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter
+                                     )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 256])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS)
+                        )
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--data-dir", default=None)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+    report = run_benchmarks(sizes=args.sizes, workers=args.workers,
+                            benchmarks=args.benchmarks, data_dir=args.data_dir,
+                            batch_size=args.batch_size
+                            )
+    with open(args.output, "w") as fp:
+        json.dump(report, fp, indent=2)
+    logger.info(f"Wrote {len(report['results'])} benchmark results to {args.output}")
+    failed = [result["benchmark"] for result in report["results"] if "error" in result]
+    if failed:
+        logger.error(f"{len(failed)} of {len(report['results'])} benchmarks failed: {failed}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    sys.exit(main())
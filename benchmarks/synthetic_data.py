@@ -0,0 +1,59 @@
+"""Generate synthetic image folders and COCO annotation files for benchmarking."""
+import os
+import json
+import argparse
+from typing import List, Tuple
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def make_synthetic_images(output_dir, num_images, width=640, height=480,
+                          num_objects=5, seed=2024, file_format="jpg"
+                          ) -> Tuple[List[str], str]:
+    """Write num_images noisy images with random shapes plus a matching COCO file.
+
+    Returns the image paths and the path of the COCO annotation file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    images, annotations, img_paths = [], [], []
+    ann_id = 1
+    for img_id in range(1, num_images + 1):
+        background = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        img = Image.fromarray(background)
+        draw = ImageDraw.Draw(img)
+        for _ in range(num_objects):
+            w, h = rng.integers(width // 16, width // 3), rng.integers(height // 16, height // 3)
+            x, y = rng.integers(0, width - w), rng.integers(0, height - h)
+            polygon = [x, y, x + w, y, x + w, y + h, x, y + h]
+            draw.polygon(polygon, fill=tuple(int(c) for c in rng.integers(0, 256, size=3)))
+            annotations.append({"id": ann_id, "image_id": img_id, "category_id": 1,
+                                "bbox": [int(x), int(y), int(w), int(h)],
+                                "area": int(w * h), "iscrowd": 0,
+                                "segmentation": [[int(v) for v in polygon]],
+                                })
+            ann_id += 1
+        file_name = f"synthetic_{img_id:07d}.{file_format}"
+        img_path = os.path.join(output_dir, file_name)
+        img.save(img_path)
+        img_paths.append(img_path)
+        images.append({"id": img_id, "file_name": file_name, "width": width, "height": height})
+    coco_annotation_filepath = os.path.join(output_dir, "coco_annotation.json")
+    with open(coco_annotation_filepath, "w") as fp:
+        json.dump({"images": images, "annotations": annotations,
+                   "categories": [{"id": 1, "name": "object"}]
+                   }, fp)
+    return img_paths, coco_annotation_filepath
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("output_dir")
+    parser.add_argument("--num-images", type=int, default=100)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--num-objects", type=int, default=5)
+    args = parser.parse_args()
+    make_synthetic_images(args.output_dir, num_images=args.num_images, width=args.width,
+                          height=args.height, num_objects=args.num_objects
+                          )
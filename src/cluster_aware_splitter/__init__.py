@@ -1,16 +1,28 @@
 # read version from installed package
 from importlib.metadata import version
+import importlib
 import logging
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-)
-
+# logging is configured by the application, not on import
 logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
 
 __version__ = version("cluster_aware_splitter")
 __package__ = __name__
 
 logger.info(f"{__package__} version {__version__}.")
 
+# submodules are imported on first attribute access so that importing the
+# package does not pull in pandas, TensorFlow or other heavy dependencies
+_SUBMODULES = ("ann_index", "anno_subproc", "cluster_aware_splitter", "clustering",
+               "coco_index", "compression", "decode", "feat", "feature_store",
+               "inference_backends", "instrumentation", "lazy_import",
+               "multiprocess_img_cluster", "packing", "parallel_extraction",
+               "scheduler", "sharding", "streaming"
+               )
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,211 @@
+from typing import Tuple
+import numpy as np
+from cluster_aware_splitter import logger
+
+ANN_METRICS = ("cosine", "l2")
+
+
+def _prepare_features(features, metric) -> np.ndarray:
+    features = np.asarray(features, dtype=np.float32)
+    if metric == "cosine":
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        features = features / np.maximum(norms, 1e-12)
+    return features
+
+
+def _squared_distances(queries, candidates, candidate_sq_norms) -> np.ndarray:
+    query_sq_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+    distances = query_sq_norms - 2.0 * queries @ candidates.T + candidate_sq_norms[None, :]
+    return np.maximum(distances, 0.0)
+
+
+def _to_metric_distance(squared_distances, metric) -> np.ndarray:
+    # for unit vectors ||a - b||^2 = 2 - 2cos(a, b)
+    if metric == "cosine":
+        return squared_distances / 2.0
+    return np.sqrt(squared_distances)
+
+
+def _top_k(distances, k) -> Tuple[np.ndarray, np.ndarray]:
+    k = min(k, distances.shape[1])
+    top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    top_distances = np.take_along_axis(distances, top, axis=1)
+    order = np.argsort(top_distances, axis=1)
+    return np.take_along_axis(top_distances, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+
+class ANNIndex(object):
+    """k-NN index over a feature matrix. search returns (distances, indices),
+    each (num_queries, k), with -1 indices where fewer than k neighbours exist."""
+    def __init__(self, metric="cosine"):
+        if metric not in ANN_METRICS:
+            raise ValueError(f"metric must be one of {ANN_METRICS}, got {metric}")
+        self.metric = metric
+
+    def build(self, features) -> "ANNIndex":
+        raise NotImplementedError
+
+    def search(self, queries, k=10) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+
+class IVFIndex(ANNIndex):
+    """Inverted-file index in NumPy.
+
+    Vectors are bucketed by their nearest of num_lists k-means centroids, and
+    a query is compared exactly only against the vectors in its nprobe
+    nearest buckets. Queries are processed bucket by bucket so each distance
+    computation is one matrix product.
+    """
+    def __init__(self, metric="cosine", num_lists=None, nprobe=8,
+                 train_size=50000, num_iterations=10, block_size=4096, seed=2024
+                 ):
+        super().__init__(metric=metric)
+        self.num_lists = num_lists
+        self.nprobe = nprobe
+        self.train_size = train_size
+        self.num_iterations = num_iterations
+        self.block_size = block_size
+        self.seed = seed
+
+    def _train_centroids(self, features, num_lists) -> np.ndarray:
+        rng = np.random.default_rng(self.seed)
+        sample = features[rng.choice(len(features), size=min(len(features), self.train_size),
+                                     replace=False
+                                     )]
+        centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)].copy()
+        for _ in range(self.num_iterations):
+            assignments = self._assign(sample, centroids)
+            counts = np.bincount(assignments, minlength=num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        return centroids
+
+    def _assign(self, features, centroids, num_nearest=1) -> np.ndarray:
+        centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+        assignments = []
+        for start in range(0, len(features), self.block_size):
+            distances = _squared_distances(features[start:start+self.block_size], centroids,
+                                           centroid_sq_norms
+                                           )
+            if num_nearest == 1:
+                assignments.append(distances.argmin(axis=1))
+            else:
+                assignments.append(_top_k(distances, num_nearest)[1])
+        return np.concatenate(assignments)
+
+    def build(self, features) -> "IVFIndex":
+        self.features = _prepare_features(features, self.metric)
+        num_items = len(self.features)
+        num_lists = self.num_lists or max(1, int(np.sqrt(num_items)))
+        num_lists = min(num_lists, num_items)
+        self.centroids = self._train_centroids(self.features, num_lists)
+        assignments = self._assign(self.features, self.centroids)
+        self.list_order = np.argsort(assignments, kind="stable")
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments,
+                                                                      minlength=num_lists
+                                                                      ))))
+        self.sq_norms = np.einsum("ij,ij->i", self.features, self.features)
+        logger.info(f"Built IVF index over {num_items} vectors with {num_lists} lists")
+        return self
+
+    def search(self, queries, k=10, nprobe=None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = _prepare_features(queries, self.metric)
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = self._assign(queries, self.centroids, num_nearest=nprobe)
+        if probes.ndim == 1:
+            probes = probes[:, None]
+        best_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        query_ids = np.repeat(np.arange(len(queries)), probes.shape[1])
+        probe_lists = probes.ravel()
+        order = np.argsort(probe_lists, kind="stable")
+        query_ids, probe_lists = query_ids[order], probe_lists[order]
+        boundaries = np.flatnonzero(np.diff(probe_lists)) + 1
+        list_starts = np.concatenate(([0], boundaries))[:len(probe_lists)]
+        for list_queries, list_id in zip(np.split(query_ids, boundaries), probe_lists[list_starts]):
+            members = self.list_order[self.list_offsets[list_id]:self.list_offsets[list_id + 1]]
+            if not len(members):
+                continue
+            candidates = self.features[members]
+            for start in range(0, len(list_queries), self.block_size):
+                block = list_queries[start:start+self.block_size]
+                distances = _squared_distances(queries[block], candidates, self.sq_norms[members])
+                block_distances, block_idx = _top_k(distances, k)
+                merged_distances = np.concatenate([best_distances[block], block_distances], axis=1)
+                merged_indices = np.concatenate([best_indices[block], members[block_idx]], axis=1)
+                merged_distances, top = _top_k(merged_distances, k)
+                best_distances[block] = merged_distances
+                best_indices[block] = np.take_along_axis(merged_indices, top, axis=1)
+        best_distances = _to_metric_distance(best_distances, self.metric)
+        best_indices[~np.isfinite(best_distances)] = -1
+        return best_distances, best_indices
+
+
+class FaissHNSWIndex(ANNIndex):
+    """HNSW index backed by the optional faiss-cpu package."""
+    def __init__(self, metric="cosine", num_neighbors=32, ef_construction=80,
+                 ef_search=64
+                 ):
+        super().__init__(metric=metric)
+        self.num_neighbors = num_neighbors
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+
+    def build(self, features) -> "FaissHNSWIndex":
+        import faiss
+        features = _prepare_features(features, self.metric)
+        self.index = faiss.IndexHNSWFlat(features.shape[1], self.num_neighbors)
+        self.index.hnsw.efConstruction = self.ef_construction
+        self.index.add(features)
+        self.index.hnsw.efSearch = self.ef_search
+        return self
+
+    def search(self, queries, k=10) -> Tuple[np.ndarray, np.ndarray]:
+        squared_distances, indices = self.index.search(_prepare_features(queries, self.metric), k)
+        return _to_metric_distance(np.maximum(squared_distances, 0.0), self.metric), indices
+
+
+def build_ann_index(features, backend="auto", metric="cosine", **kwargs) -> ANNIndex:
+    """Build a FaissHNSWIndex when faiss is installed (or backend="faiss"), else an IVFIndex."""
+    if backend == "auto":
+        try:
+            import faiss  # noqa: F401
+            backend = "faiss"
+        except ImportError:
+            backend = "ivf"
+    if backend == "faiss":
+        return FaissHNSWIndex(metric=metric, **kwargs).build(features)
+    elif backend == "ivf":
+        return IVFIndex(metric=metric, **kwargs).build(features)
+    raise ValueError(f"backend must be auto, faiss or ivf, got {backend}")
+
+
+def near_duplicate_graph(ann_index: ANNIndex, features, threshold=0.02, k=10,
+                         batch_size=65536
+                         ) -> np.ndarray:
+    """(num_edges, 2) array of index pairs i < j whose distance is within threshold."""
+    edges = []
+    for start in range(0, len(features), batch_size):
+        distances, indices = ann_index.search(features[start:start+batch_size], k=k)
+        query_ids = np.arange(start, start + len(indices))[:, None].repeat(indices.shape[1], axis=1)
+        keep = (indices >= 0) & (distances <= threshold) & (indices != query_ids)
+        pairs = np.stack([query_ids[keep], indices[keep]], axis=1)
+        edges.append(np.sort(pairs, axis=1))
+    if not edges:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.unique(np.concatenate(edges, axis=0), axis=0)
+
+
+def near_duplicate_groups(num_items, edges) -> np.ndarray:
+    """Connected-component label per item; items with no near duplicate get their own group."""
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    graph = coo_matrix((np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])),
+                       shape=(num_items, num_items)
+                       )
+    _, labels = connected_components(graph, directed=False)
+    return labels
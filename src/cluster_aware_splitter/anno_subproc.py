@@ -5,14 +5,13 @@ from glob import glob
 import shutil
 from tqdm import tqdm
 import logging
-import uuid
+import hashlib
 import time
+import queue
+import threading
+import multiprocessing
+from cluster_aware_splitter.instrumentation import resolve_instrumentation
 
-logging.basicConfig(level=logging.DEBUG, 
-                    format="%(asctime)s - %(levelname)s - %(message)s",
-                    filename="annonymization.logs",
-                    filemode="a"
-                    )
 logger = logging.getLogger(__name__)
 
 
@@ -25,14 +24,103 @@ def get_cmd(source_target, target_path, model=None,
         cmd = ["python3", "anonymize.py", "-s",f"{source_target}", "-t", f"{target_path}", "-m", f"{model}"]
     return cmd
 
+class ProgressJournal(object):
+    """Append-only JSON-lines record of anonymized images.
+
+    The file name is derived from the source directory and the run config,
+    so a restarted run reopens the same journal and skips what it already
+    processed. Each chunk is one appended line; fsync is batched every
+    fsync_every chunks or fsync_interval seconds, and a line truncated by a
+    crash is ignored on reload. Image paths are stored and compared as
+    absolute paths, so a rerun may spell the source directory differently.
+    """
+    def __init__(self, source_dir, config=None, journal_dir=".", fsync_every=50,
+                 fsync_interval=5.0
+                 ):
+        key_str = json.dumps({"source_dir": os.path.abspath(str(source_dir)), "config": config or {}},
+                             sort_keys=True, default=str
+                             )
+        key = hashlib.blake2b(key_str.encode(), digest_size=8).hexdigest()
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = os.path.join(journal_dir, f"annonymize_{key}.jsonl")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.processed = set()
+        if os.path.exists(self.path):
+            with open(self.path, "r") as fp:
+                for line in fp:
+                    try:
+                        self.processed.update(map(os.path.abspath, json.loads(line)["image_paths"]))
+                    except (ValueError, KeyError):
+                        logger.warning(f"Skipping unreadable line in {self.path}")
+        self._fp = open(self.path, "a")
+        if self._fp.tell() and not self._ends_with_newline():
+            # start a fresh line after a record truncated by a crash
+            self._fp.write("\n")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as fp:
+            fp.seek(-1, os.SEEK_END)
+            return fp.read(1) == b"\n"
+
+    def __contains__(self, img_path):
+        return os.path.abspath(img_path) in self.processed
+
+    def __len__(self):
+        return len(self.processed)
+
+    def pending(self, img_paths):
+        return [img_path for img_path in img_paths if os.path.abspath(img_path) not in self.processed]
+
+    def record(self, img_paths):
+        img_paths = [os.path.abspath(img_path) for img_path in img_paths]
+        self._fp.write(json.dumps({"image_paths": img_paths, "time": time.time()}) + "\n")
+        self._fp.flush()
+        self.processed.update(img_paths)
+        self._unsynced += 1
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._fp.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if not self._fp.closed:
+            self.sync()
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
 def annonymize_in_batches(source_dir, target_dir, 
                           chunk_size=10, model=None,
+                          instrumentation=None, metrics_path=None,
+                          journal_dir=".",
                           **kwargs
                           ):
+    instrumentation = resolve_instrumentation(instrumentation, metrics_path)
     pipeline_start_time = time.time()
-    save_file = f"annonymize_{str(uuid.uuid4())}.json"
+    journal = ProgressJournal(source_dir, config={"target_dir": os.path.abspath(str(target_dir)),
+                                                  "model": model
+                                                  },
+                              journal_dir=journal_dir
+                              )
+    save_file = journal.path
     logger.info(f"Started annonymize_in_batches")
     img_paths = sorted(glob(f"{source_dir}/*"))
+    if len(journal):
+        img_paths = journal.pending(img_paths)
+        logger.info(f"Resuming from {save_file}: {len(journal)} images already annonymized, {len(img_paths)} remaining")
     chunk_dir = "chunk_dir"
     
     cmd = get_cmd(source_target=chunk_dir, target_path=target_dir,
@@ -47,24 +135,20 @@ def annonymize_in_batches(source_dir, target_dir,
         logger.info(f"Batching images for index {i} to {i + chunk_size}")
         batch_imgpaths = img_paths[i:i+chunk_size]
         os.makedirs(chunk_dir, exist_ok=True)
-        for img_path in batch_imgpaths:
-            shutil.copy(img_path, chunk_dir)
+        with instrumentation.stage("stage_chunk"):
+            for img_path in batch_imgpaths:
+                shutil.copy(img_path, chunk_dir)
         
         logger.info(f"Started annonymizing ...")
-        subprocess.run(cmd, check=True)
+        with instrumentation.stage("anonymize"):
+            subprocess.run(cmd, check=True)
         logger.info(f"Finished annonymizing {i} to {i+chunk_size}")
-        if os.path.exists(save_file):
-            logger.info(f"{save_file} already exist hence reading and updating it with the annonymized batched images")
-            with open(save_file, "r") as fp:
-                processed_data = json.load(fp)
-            processed_images = processed_data["image_paths"]
-            processed_images.extend(batch_imgpaths)
-            processed_data["image_paths"] = processed_images
-        else:
-            logger.info(f"{save_file} does not exist hence creating processed_data to be saved in it")
-            processed_data = {"image_paths": batch_imgpaths}
-        with open(save_file, "w") as fp:
-            json.dump(processed_data, fp, indent=4)
+        if instrumentation.enabled:
+            instrumentation.increment("images_processed", len(batch_imgpaths))
+            instrumentation.increment("bytes_read", sum(os.path.getsize(img_path)
+                                                        for img_path in batch_imgpaths
+                                                        ))
+        journal.record(batch_imgpaths)
         logger.info(f"Successfully saved processed data in {save_file}")           
         shutil.rmtree(chunk_dir)
         logger.info(f"Removed {chunk_dir} directory")
@@ -76,9 +160,202 @@ def annonymize_in_batches(source_dir, target_dir,
     pipeline_duration = pipeline_end_time - pipeline_start_time
     pipeline_minutes, pipeline_seconds = divmod(pipeline_duration, 60)
     logger.info(f"Completed Annonymization in {round(pipeline_minutes, 4)} minutes and {round(pipeline_seconds, 4)} seconds")
-    logger.info(f"Finished annonymizing all images in batches of {chunk_size}. Processed data saved in {save_file}")    
-            
+    journal.close()
+    logger.info(f"Finished annonymizing all images in batches of {chunk_size}. Processed data saved in {save_file}")
+    instrumentation.report(metrics_path)
+
+
+LINK_MODES = ("hardlink", "symlink", "copy")
+
+
+def stage_chunk(img_paths, chunk_dir, link_mode="hardlink"):
+    """Make img_paths visible in chunk_dir without copying where possible.
+    Hardlinks fall back to symlinks (e.g. across filesystems), symlinks to copies."""
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"link_mode must be one of {LINK_MODES}, got {link_mode}")
+    os.makedirs(chunk_dir, exist_ok=True)
+    for img_path in img_paths:
+        target = os.path.join(chunk_dir, os.path.basename(img_path))
+        if link_mode == "hardlink":
+            try:
+                os.link(img_path, target)
+                continue
+            except OSError:
+                pass
+        if link_mode in ("hardlink", "symlink"):
+            try:
+                os.symlink(os.path.abspath(img_path), target)
+                continue
+            except OSError:
+                pass
+        shutil.copy(img_path, target)
+    return chunk_dir
+
+
+# process-local anonymizer built once per pool worker by anonymizer_factory
+_ANONYMIZER = [None]
+
+
+def _init_anonymizer_process(anonymizer_factory):
+    _ANONYMIZER[0] = anonymizer_factory()
+
+
+def _run_anonymizer_process(img_paths, target_dir):
+    _ANONYMIZER[0](img_paths, target_dir)
+
+
+def annonymize_pipelined(source_dir, target_dir, chunk_size=10, model=None,
+                         anonymize_fn=None, anonymizer_factory=None,
+                         num_workers=1, prefetch_chunks=2, link_mode="hardlink",
+                         chunk_root="chunk_dir", img_paths=None, on_chunk_done=None,
+                         journal_dir=".", instrumentation=None, metrics_path=None
+                         ):
+    """Anonymize images in chunks with staging overlapped with anonymization.
+
+    A stager thread prepares up to prefetch_chunks chunks ahead of num_workers
+    worker threads. The anonymizer is, in order of preference:
+
+    - anonymize_fn(img_paths, target_dir): called in this process with image
+      paths directly, so the model is loaded once and nothing is staged.
+    - anonymizer_factory(): picklable callable returning such a function; it
+      is called once in each of num_workers long-lived spawned processes.
+    - otherwise ``anonymize.py`` from get_cmd, run on a per-chunk directory of
+      hardlinks (or symlinks) instead of copies.
+
+    Progress goes to the same ProgressJournal as annonymize_in_batches (unless
+    journal_dir is None), so an interrupted run resumes where it stopped.
+    on_chunk_done(img_paths) is called, serialized, after each chunk.
+    Returns the number of images anonymized in this run.
+    """
+    instrumentation = resolve_instrumentation(instrumentation, metrics_path)
+    pipeline_start_time = time.time()
+    if img_paths is None:
+        img_paths = sorted(glob(f"{source_dir}/*"))
+    journal = None
+    if journal_dir is not None:
+        journal = ProgressJournal(source_dir, config={"target_dir": os.path.abspath(str(target_dir)),
+                                                      "model": model
+                                                      },
+                                  journal_dir=journal_dir
+                                  )
+        img_paths = journal.pending(img_paths)
+    os.makedirs(target_dir, exist_ok=True)
+    needs_staging = anonymize_fn is None and anonymizer_factory is None
+    pool = None
+    if anonymizer_factory is not None:
+        ctx = multiprocessing.get_context("spawn")
+        pool = ctx.Pool(num_workers, initializer=_init_anonymizer_process,
+                        initargs=(anonymizer_factory,)
+                        )
+
+    def run_chunk(batch_imgpaths, chunk_dir):
+        if anonymize_fn is not None:
+            anonymize_fn(batch_imgpaths, target_dir)
+        elif pool is not None:
+            pool.apply(_run_anonymizer_process, (batch_imgpaths, target_dir))
+        else:
+            subprocess.run(get_cmd(source_target=chunk_dir, target_path=target_dir, model=model),
+                           check=True
+                           )
+
+    staged = queue.Queue(maxsize=prefetch_chunks)
+    stop = threading.Event()
+    errors = []
+    done_lock = threading.Lock()
+    num_processed = [0]
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                staged.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def stager():
+        try:
+            for i in range(0, len(img_paths), chunk_size):
+                batch_imgpaths = img_paths[i:i+chunk_size]
+                chunk_dir = None
+                if needs_staging:
+                    with instrumentation.stage("stage_chunk"):
+                        chunk_dir = stage_chunk(batch_imgpaths,
+                                                os.path.join(chunk_root, f"chunk_{i:09d}"),
+                                                link_mode=link_mode
+                                                )
+                if not put((i, batch_imgpaths, chunk_dir)):
+                    return
+        except Exception as error:
+            errors.append(error)
+            stop.set()
+        finally:
+            for _ in range(num_workers):
+                put(None)
+
+    def worker():
+        while not stop.is_set():
+            try:
+                item = staged.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is None:
+                return
+            i, batch_imgpaths, chunk_dir = item
+            try:
+                with instrumentation.stage("anonymize"):
+                    run_chunk(batch_imgpaths, chunk_dir)
+            except Exception as error:
+                errors.append(error)
+                stop.set()
+                return
+            finally:
+                if chunk_dir:
+                    shutil.rmtree(chunk_dir, ignore_errors=True)
+            with done_lock:
+                if journal is not None:
+                    journal.record(batch_imgpaths)
+                if on_chunk_done is not None:
+                    on_chunk_done(batch_imgpaths)
+                num_processed[0] += len(batch_imgpaths)
+                if instrumentation.enabled:
+                    instrumentation.increment("images_processed", len(batch_imgpaths))
+                    instrumentation.increment("bytes_read", sum(os.path.getsize(img_path)
+                                                                for img_path in batch_imgpaths
+                                                                ))
+            logger.info(f"Finished annonymizing {i} to {i + len(batch_imgpaths)}")
+
+    threads = [threading.Thread(target=stager, daemon=True)]
+    threads += [threading.Thread(target=worker, daemon=True) for _ in range(num_workers)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if needs_staging:
+            shutil.rmtree(chunk_root, ignore_errors=True)
+        if journal is not None:
+            journal.close()
+    if errors:
+        raise errors[0]
+    pipeline_minutes, pipeline_seconds = divmod(time.time() - pipeline_start_time, 60)
+    logger.info(f"Completed pipelined annonymization of {num_processed[0]} images in "
+                f"{round(pipeline_minutes, 4)} minutes and {round(pipeline_seconds, 4)} seconds"
+                )
+    instrumentation.report(metrics_path)
+    return num_processed[0]
+
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, 
+                        format="%(asctime)s - %(levelname)s - %(message)s",
+                        filename="annonymization.logs",
+                        filemode="a"
+                        )
     human_dir = "/home/lin/codebase/human"
     annonymize_in_batches(source_dir=human_dir, 
                           target_dir="output_annonymized", 
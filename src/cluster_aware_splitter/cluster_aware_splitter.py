@@ -0,0 +1,200 @@
+import os
+import heapq
+from typing import Dict, Tuple
+import numpy as np
+import pandas as pd
+from cluster_aware_splitter import logger
+
+SPLIT_NAMES = ("train", "val", "test")
+
+
+class ClusterAwareSplitter(object):
+    """Split an ``image_names``/``clusters`` DataFrame into train/val/test or folds.
+
+    Every assignment is computed with NumPy over the whole frame: rows are
+    shuffled within their cluster with a seeded generator and then cut at
+    per-cluster boundaries. The default seed matches
+    ``FeatureExtractor.set_seed_consistently``.
+
+    With ``group_col`` (e.g. near-duplicate groups from
+    ``ann_index.near_duplicate_groups``) all rows of a group are assigned
+    to the same split or fold. Rows with a missing group are ungrouped.
+    """
+    def __init__(self, imgclust_df: pd.DataFrame, image_col="image_names",
+                 cluster_col="clusters", seed=2024, group_col=None
+                 ):
+        for col in (image_col, cluster_col, group_col):
+            if col is not None and col not in imgclust_df.columns:
+                raise ValueError(f"{col} column not found in imgclust_df")
+        num_missing = int(imgclust_df[cluster_col].isna().sum())
+        if num_missing:
+            raise ValueError(f"{num_missing} rows have no cluster in {cluster_col}; "
+                             "assign or drop them before splitting"
+                             )
+        self.imgclust_df = imgclust_df.reset_index(drop=True)
+        self.image_col = image_col
+        self.cluster_col = cluster_col
+        self.group_col = group_col
+        self.seed = seed
+
+    @classmethod
+    def from_csv(cls, csv_path, **kwargs) -> "ClusterAwareSplitter":
+        return cls(pd.read_csv(csv_path), **kwargs)
+
+    @classmethod
+    def from_features(cls, image_names, features, clustering_backend=None,
+                      max_num_clusters=None, seed=2024
+                      ) -> "ClusterAwareSplitter":
+        from cluster_aware_splitter.clustering import get_clustering_backend
+        clustering_backend = get_clustering_backend(clustering_backend,
+                                                    max_num_clusters=max_num_clusters
+                                                    )
+        clusters = clustering_backend.fit_predict(features)
+        imgclust_df = pd.DataFrame({"image_names": list(image_names), "clusters": clusters})
+        return cls(imgclust_df, seed=seed)
+
+    @classmethod
+    def from_features_with_near_duplicates(cls, image_names, features, clustering_backend=None,
+                                           max_num_clusters=None, seed=2024, threshold=0.02,
+                                           k=10, ann_backend="auto", **ann_kwargs
+                                           ) -> "ClusterAwareSplitter":
+        """Like from_features, plus a ``near_duplicate_group`` column from an ANN index
+        so that images within threshold cosine distance share a split."""
+        from cluster_aware_splitter.ann_index import (build_ann_index, near_duplicate_graph,
+                                                      near_duplicate_groups
+                                                      )
+        splitter = cls.from_features(image_names, features, clustering_backend=clustering_backend,
+                                     max_num_clusters=max_num_clusters, seed=seed
+                                     )
+        ann_index = build_ann_index(features, backend=ann_backend, **ann_kwargs)
+        edges = near_duplicate_graph(ann_index, features, threshold=threshold, k=k)
+        logger.info(f"Found {len(edges)} near-duplicate pairs")
+        splitter.imgclust_df["near_duplicate_group"] = near_duplicate_groups(len(features), edges)
+        splitter.group_col = "near_duplicate_group"
+        return splitter
+
+    def _get_rng(self, seed=None) -> np.random.Generator:
+        return np.random.default_rng(self.seed if seed is None else seed)
+
+    def _get_cluster_codes(self) -> np.ndarray:
+        codes, _ = pd.factorize(self.imgclust_df[self.cluster_col], sort=True)
+        codes = codes.astype(np.int64)
+        if self.group_col is None:
+            return codes
+        # a group spanning clusters is placed with the cluster of its first row
+        group_codes = self._get_group_codes()
+        _, first_rows = np.unique(group_codes, return_index=True)
+        return codes[first_rows][group_codes]
+
+    def _get_group_codes(self) -> np.ndarray:
+        group_codes, uniques = pd.factorize(self.imgclust_df[self.group_col])
+        group_codes = group_codes.astype(np.int64)
+        # factorize gives every missing group -1; make each of those rows its
+        # own group instead of one group spanning all of them
+        missing = group_codes < 0
+        group_codes[missing] = len(uniques) + np.arange(missing.sum())
+        return group_codes
+
+    def _rank_within_cluster(self, seed=None, return_unit_ordinals=False):
+        """Per-row rank after shuffling within clusters. Rows of one group are
+        shuffled as a unit and share the rank of the group's first position.
+
+        With return_unit_ordinals, also returns each row's group position
+        within its cluster (counting groups, not rows) and the number of
+        groups per cluster.
+        """
+        codes = self._get_cluster_codes()
+        num_rows = len(codes)
+        if self.group_col is None:
+            unit_codes = np.arange(num_rows)
+        else:
+            unit_codes = self._get_group_codes()
+        _, first_rows, unit_sizes = np.unique(unit_codes, return_index=True, return_counts=True)
+        unit_clusters = codes[first_rows]
+        num_units = len(first_rows)
+        shuffle_keys = self._get_rng(seed).random(num_units)
+        order = np.lexsort((shuffle_keys, unit_clusters))
+        counts = np.bincount(codes)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        unit_ranks = np.empty(num_units, dtype=np.int64)
+        unit_ranks[order] = np.cumsum(unit_sizes[order]) - unit_sizes[order] - starts[unit_clusters[order]]
+        if not return_unit_ordinals:
+            return codes, unit_ranks[unit_codes], counts
+        unit_counts = np.bincount(unit_clusters, minlength=len(counts))
+        unit_starts = np.concatenate(([0], np.cumsum(unit_counts)[:-1]))
+        unit_ordinals = np.empty(num_units, dtype=np.int64)
+        unit_ordinals[order] = np.arange(num_units) - unit_starts[unit_clusters[order]]
+        return codes, unit_ranks[unit_codes], counts, unit_ordinals[unit_codes], unit_counts
+
+    def split(self, train_size=0.7, val_size=0.15, test_size=0.15,
+              seed=None
+              ) -> pd.DataFrame:
+        sizes = np.array([train_size, val_size, test_size], dtype=np.float64)
+        if (sizes < 0).any() or sizes.sum() <= 0:
+            raise ValueError(f"split sizes must be non-negative and sum to a positive value, got {sizes}")
+        sizes = sizes / sizes.sum()
+        codes, ranks, counts = self._rank_within_cluster(seed)
+        boundaries = np.round(counts[:, None] * np.cumsum(sizes)[None, :2]).astype(np.int64)
+        row_boundaries = boundaries[codes]
+        split_idx = (ranks >= row_boundaries[:, 0]).astype(np.int64) + (ranks >= row_boundaries[:, 1])
+        split_df = self.imgclust_df.copy()
+        split_df["split"] = np.asarray(SPLIT_NAMES)[split_idx]
+        logger.info(f"Split sizes: {split_df['split'].value_counts().to_dict()}")
+        return split_df
+
+    def kfold(self, n_splits=5, seed=None) -> pd.DataFrame:
+        """Stratified k-fold: every cluster is spread evenly over the folds."""
+        if n_splits < 2:
+            raise ValueError(f"n_splits must be at least 2, got {n_splits}")
+        codes, _, _, unit_ordinals, unit_counts = self._rank_within_cluster(seed, return_unit_ordinals=True)
+        # folds are dealt out per group (per row without group_col); offset each
+        # cluster by where it starts so that clusters with fewer groups than
+        # n_splits do not all land in fold 0
+        unit_starts = np.concatenate(([0], np.cumsum(unit_counts)[:-1]))
+        split_df = self.imgclust_df.copy()
+        split_df["fold"] = (unit_ordinals + unit_starts[codes]) % n_splits
+        return split_df
+
+    def group_kfold(self, n_splits=5, seed=None) -> pd.DataFrame:
+        """Group k-fold: each cluster goes to exactly one fold, balancing fold sizes."""
+        if n_splits < 2:
+            raise ValueError(f"n_splits must be at least 2, got {n_splits}")
+        codes = self._get_cluster_codes()
+        counts = np.bincount(codes)
+        if len(counts) < n_splits:
+            raise ValueError(f"Cannot make {n_splits} group folds from {len(counts)} clusters")
+        tie_breaker = self._get_rng(seed).random(len(counts))
+        cluster_order = np.lexsort((tie_breaker, -counts))
+        cluster_folds = np.empty(len(counts), dtype=np.int64)
+        fold_sizes = [(0, fold) for fold in range(n_splits)]
+        for cluster in cluster_order:
+            fold_size, fold = heapq.heappop(fold_sizes)
+            cluster_folds[cluster] = fold
+            heapq.heappush(fold_sizes, (fold_size + counts[cluster], fold))
+        split_df = self.imgclust_df.copy()
+        split_df["fold"] = cluster_folds[codes]
+        return split_df
+
+    @staticmethod
+    def iter_folds(split_df: pd.DataFrame, fold_col="fold"):
+        folds = split_df[fold_col].to_numpy()
+        for fold in np.unique(folds):
+            yield fold, np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+
+    @staticmethod
+    def write_manifests(split_df: pd.DataFrame, output_dir, split_col="split",
+                        file_format="csv"
+                        ) -> Dict[str, str]:
+        os.makedirs(output_dir, exist_ok=True)
+        manifest_paths = {}
+        for split_name, split_group in split_df.groupby(split_col, sort=True):
+            manifest_path = os.path.join(output_dir, f"{split_col}_{split_name}.{file_format}")
+            if file_format == "csv":
+                split_group.to_csv(manifest_path, index=False)
+            elif file_format == "parquet":
+                split_group.to_parquet(manifest_path, index=False)
+            else:
+                raise ValueError(f"file_format must be csv or parquet, got {file_format}")
+            manifest_paths[str(split_name)] = manifest_path
+        logger.info(f"Wrote {len(manifest_paths)} manifests to {output_dir}")
+        return manifest_paths
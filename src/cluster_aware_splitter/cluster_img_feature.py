@@ -15,9 +15,7 @@ img_names = [os.path.basename(img) for img in img_paths_list]
 img_property_set = ImgPropertySetReturnType(img_paths=img_paths_list, img_names=img_names, total_num_imgs=100, max_num_clusters=4)
 
 
-img_property_set = img_feature_extraction_implementor(img_property_set=img_property_set,
-                                                    use_cropped_imgs=False
-                                                    )
+img_property_set = img_feature_extraction_implementor(img_property_set=img_property_set)
 
 #%%
 if __name__ == "__main__":
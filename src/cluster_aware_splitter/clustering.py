@@ -0,0 +1,290 @@
+import os
+import json
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+from cluster_aware_splitter import logger
+
+
+class ClusteringBackend(object):
+    """Interface for engines that turn an (N, D) feature matrix into N labels."""
+    def fit_predict(self, features) -> np.ndarray:
+        raise NotImplementedError
+
+
+class ClustevalBackend(ClusteringBackend):
+    def __init__(self, **clusteval_kwargs):
+        self.clusteval_kwargs = clusteval_kwargs
+
+    def fit_predict(self, features) -> np.ndarray:
+        from clusteval import clusteval
+        ce = clusteval(**self.clusteval_kwargs)
+        cluster_results = ce.fit(np.asarray(features))
+        self.cluster_results_ = cluster_results
+        return np.asarray(cluster_results["labx"])
+
+
+def make_streaming_kmeans(init_features, num_clusters, batch_size=4096, seed=2024):
+    """MiniBatchKMeans to be fed chunk by chunk through partial_fit.
+
+    Chunks follow input order and may each cover only a few clusters, so the
+    centroids are seeded with k-means++ on init_features (a random sample)
+    and centroids that a single chunk leaves empty are not reassigned.
+    """
+    from sklearn.cluster import MiniBatchKMeans, kmeans_plusplus
+    init_centers, _ = kmeans_plusplus(np.asarray(init_features, dtype=np.float32),
+                                      n_clusters=num_clusters, random_state=seed
+                                      )
+    return MiniBatchKMeans(n_clusters=num_clusters, batch_size=batch_size,
+                           random_state=seed, init=init_centers, n_init=1,
+                           reassignment_ratio=0.0
+                           )
+
+
+class MiniBatchKMeansBackend(ClusteringBackend):
+    """Streaming k-means over chunks of the feature matrix.
+
+    When num_clusters is not given, k is chosen in
+    [min_num_clusters, max_num_clusters] by silhouette score on a random sample,
+    and only the chosen k is fitted over the full matrix.
+    """
+    def __init__(self, max_num_clusters=10, min_num_clusters=2,
+                 num_clusters=None, batch_size=4096, chunk_size=65536,
+                 max_epochs=3, fit_sample_size=100000,
+                 silhouette_sample_size=10000, seed=2024
+                 ):
+        self.max_num_clusters = max_num_clusters
+        self.min_num_clusters = min_num_clusters
+        self.num_clusters = num_clusters
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.max_epochs = max_epochs
+        self.fit_sample_size = fit_sample_size
+        self.silhouette_sample_size = silhouette_sample_size
+        self.seed = seed
+
+    def _iter_chunks(self, features):
+        for start in range(0, len(features), self.chunk_size):
+            yield np.asarray(features[start:start+self.chunk_size], dtype=np.float32)
+
+    def _fit_kmeans(self, features, num_clusters):
+        from sklearn.cluster import MiniBatchKMeans
+        if len(features) <= self.chunk_size:
+            kmeans = MiniBatchKMeans(n_clusters=num_clusters, batch_size=self.batch_size,
+                                     random_state=self.seed, n_init=3
+                                     )
+            return kmeans.fit(np.asarray(features, dtype=np.float32))
+        rng = np.random.default_rng(self.seed)
+        init_idx = np.sort(rng.choice(len(features), size=min(len(features), self.chunk_size),
+                                      replace=False
+                                      ))
+        kmeans = make_streaming_kmeans(features[init_idx], num_clusters,
+                                       batch_size=self.batch_size, seed=self.seed
+                                       )
+        for _ in range(self.max_epochs):
+            for chunk in self._iter_chunks(features):
+                if len(chunk) >= num_clusters:
+                    kmeans.partial_fit(chunk)
+        return kmeans
+
+    def predict(self, features, kmeans=None) -> np.ndarray:
+        if kmeans is None:
+            kmeans = self.kmeans_
+        labels = [kmeans.predict(chunk) for chunk in self._iter_chunks(features)]
+        return np.concatenate(labels) if labels else np.empty(0, dtype=np.int32)
+
+    def select_num_clusters(self, features) -> int:
+        from sklearn.metrics import silhouette_score
+        rng = np.random.default_rng(self.seed)
+        num_samples = len(features)
+        fit_idx = np.sort(rng.choice(num_samples, size=min(num_samples, self.fit_sample_size),
+                                     replace=False
+                                     ))
+        fit_sample = np.asarray(features[fit_idx], dtype=np.float32)
+        score_idx = rng.choice(len(fit_sample), size=min(len(fit_sample), self.silhouette_sample_size),
+                               replace=False
+                               )
+        score_sample = fit_sample[score_idx]
+        max_num_clusters = min(self.max_num_clusters, len(score_sample) - 1)
+        self.silhouette_scores_: Dict[int, float] = {}
+        for num_clusters in range(self.min_num_clusters, max_num_clusters + 1):
+            kmeans = self._fit_kmeans(fit_sample, num_clusters)
+            labels = kmeans.predict(score_sample)
+            if len(np.unique(labels)) < 2:
+                continue
+            self.silhouette_scores_[num_clusters] = float(silhouette_score(score_sample, labels))
+        if not self.silhouette_scores_:
+            return self.min_num_clusters
+        best_num_clusters = max(self.silhouette_scores_, key=self.silhouette_scores_.get)
+        logger.info(f"Selected {best_num_clusters} clusters from silhouette scores {self.silhouette_scores_}")
+        return best_num_clusters
+
+    def fit_predict(self, features) -> np.ndarray:
+        num_clusters = self.num_clusters
+        if not num_clusters:
+            num_clusters = self.select_num_clusters(features)
+        self.num_clusters_ = num_clusters
+        self.kmeans_ = self._fit_kmeans(features, num_clusters)
+        return self.predict(features)
+
+
+CLUSTERING_BACKENDS = {"clusteval": ClustevalBackend,
+                       "minibatch_kmeans": MiniBatchKMeansBackend,
+                       }
+
+
+def get_clustering_backend(clustering_backend: Union[str, ClusteringBackend, None] = None,
+                           max_num_clusters=None, **kwargs
+                           ) -> ClusteringBackend:
+    if clustering_backend is None:
+        return ClustevalBackend(**kwargs)
+    if isinstance(clustering_backend, ClusteringBackend):
+        return clustering_backend
+    if clustering_backend not in CLUSTERING_BACKENDS:
+        raise ValueError(f"clustering_backend must be one of {list(CLUSTERING_BACKENDS)}, got {clustering_backend}")
+    if clustering_backend == "minibatch_kmeans" and max_num_clusters:
+        kwargs.setdefault("max_num_clusters", max_num_clusters)
+    return CLUSTERING_BACKENDS[clustering_backend](**kwargs)
+
+
+# quantile levels of the training nearest-centroid distances kept with a
+# ClusterModel, so drift checks can use any outlier threshold later
+DISTANCE_QUANTILE_LEVELS = np.linspace(0.0, 1.0, 101)
+
+
+def _nearest_centroids(features, centroids, chunk_size=65536) -> Tuple[np.ndarray, np.ndarray]:
+    centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(features), dtype=np.int64)
+    distances = np.empty(len(features), dtype=np.float32)
+    for start in range(0, len(features), chunk_size):
+        chunk = np.asarray(features[start:start+chunk_size], dtype=np.float32)
+        sq_distances = (np.einsum("ij,ij->i", chunk, chunk)[:, None] - 2.0 * chunk @ centroids.T
+                        + centroid_sq_norms[None, :]
+                        )
+        nearest = sq_distances.argmin(axis=1)
+        labels[start:start+len(chunk)] = nearest
+        distances[start:start+len(chunk)] = np.sqrt(np.maximum(sq_distances[np.arange(len(chunk)), nearest], 0.0))
+    return labels, distances
+
+
+class ClusterModel(object):
+    """Persisted cluster prototypes for labelling new images without refitting.
+
+    Centroids are the mean training feature of each cluster, so a model can be
+    built from the labels of any backend, clusteval included. Training
+    nearest-centroid distance quantiles and cluster proportions are kept as
+    the reference for detect_drift.
+    """
+    def __init__(self, centroids, cluster_ids, distance_quantiles, cluster_proportions,
+                 config: Optional[Dict] = None
+                 ):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.cluster_ids = np.asarray(cluster_ids)
+        self.distance_quantiles = np.asarray(distance_quantiles, dtype=np.float32)
+        self.cluster_proportions = np.asarray(cluster_proportions, dtype=np.float64)
+        self.config = dict(config or {})
+
+    @classmethod
+    def from_labels(cls, features, labels, config: Optional[Dict] = None,
+                    chunk_size=65536
+                    ) -> "ClusterModel":
+        cluster_ids, codes = np.unique(np.asarray(labels), return_inverse=True)
+        feature_dim = features.shape[1]
+        sums = np.zeros((len(cluster_ids), feature_dim), dtype=np.float64)
+        for start in range(0, len(features), chunk_size):
+            chunk = np.asarray(features[start:start+chunk_size], dtype=np.float64)
+            np.add.at(sums, codes[start:start+len(chunk)], chunk)
+        counts = np.bincount(codes, minlength=len(cluster_ids))
+        centroids = (sums / counts[:, None]).astype(np.float32)
+        _, distances = _nearest_centroids(features, centroids, chunk_size=chunk_size)
+        return cls(centroids, cluster_ids,
+                   distance_quantiles=np.quantile(distances, DISTANCE_QUANTILE_LEVELS),
+                   cluster_proportions=counts / counts.sum(), config=config
+                   )
+
+    @property
+    def num_clusters(self) -> int:
+        return len(self.centroids)
+
+    def assign_clusters(self, new_features, chunk_size=65536, return_distances=False):
+        """Label new_features with the nearest centroid in O(n * k), chunk by chunk."""
+        if not hasattr(new_features, "shape"):
+            new_features = np.asarray(new_features, dtype=np.float32)
+        if new_features.shape[1] != self.centroids.shape[1]:
+            raise ValueError(f"Feature dimension {new_features.shape[1]} does not match "
+                             f"model dimension {self.centroids.shape[1]}"
+                             )
+        codes, distances = _nearest_centroids(new_features, self.centroids, chunk_size=chunk_size)
+        labels = self.cluster_ids[codes]
+        if return_distances:
+            return labels, distances
+        return labels
+
+    def detect_drift(self, new_features, outlier_quantile=0.95, max_outlier_ratio=2.0,
+                     max_psi=0.2, chunk_size=65536
+                     ) -> Dict:
+        """Compare new_features against the training reference.
+
+        Flags drift when the share of images farther from their centroid than
+        the training outlier_quantile distance exceeds both max_outlier_ratio
+        times the expected share and three binomial standard errors above it,
+        or when the population stability index of the cluster proportions
+        exceeds max_psi.
+        """
+        codes, distances = _nearest_centroids(new_features, self.centroids, chunk_size=chunk_size)
+        threshold = float(np.interp(outlier_quantile, DISTANCE_QUANTILE_LEVELS, self.distance_quantiles))
+        expected_outlier_rate = 1.0 - outlier_quantile
+        outlier_rate = float((distances > threshold).mean()) if len(distances) else 0.0
+        proportions = np.bincount(codes, minlength=self.num_clusters) / max(len(codes), 1)
+        eps = 1e-6
+        reference = np.maximum(self.cluster_proportions, eps)
+        current = np.maximum(proportions, eps)
+        psi = float(((current - reference) * np.log(current / reference)).sum())
+        standard_error = np.sqrt(expected_outlier_rate * (1.0 - expected_outlier_rate) / max(len(codes), 1))
+        reasons = []
+        if outlier_rate > max(max_outlier_ratio * expected_outlier_rate,
+                              expected_outlier_rate + 3.0 * standard_error):
+            reasons.append(f"{outlier_rate:.3f} of images are beyond the training "
+                           f"p{outlier_quantile * 100:g} distance (expected {expected_outlier_rate:.3f})"
+                           )
+        if psi > max_psi:
+            reasons.append(f"cluster proportion PSI {psi:.3f} exceeds {max_psi}")
+        report = {"num_images": len(codes), "outlier_rate": outlier_rate,
+                  "expected_outlier_rate": expected_outlier_rate,
+                  "distance_threshold": threshold,
+                  "median_distance_ratio": float(np.median(distances) / max(self.distance_quantiles[50], eps))
+                  if len(distances) else 0.0,
+                  "psi": psi, "cluster_proportions": proportions.tolist(),
+                  "drifted": bool(reasons), "reasons": reasons,
+                  }
+        if reasons:
+            logger.warning(f"Cluster drift detected, consider refitting: {reasons}")
+        return report
+
+    def save(self, model_dir):
+        """Write cluster_model.npz (arrays) and cluster_model.json (config) to model_dir."""
+        os.makedirs(model_dir, exist_ok=True)
+        npz_path = os.path.join(model_dir, "cluster_model.npz")
+        with open(f"{npz_path}.tmp", "wb") as fp:
+            np.savez(fp, centroids=self.centroids, cluster_ids=self.cluster_ids,
+                     distance_quantiles=self.distance_quantiles,
+                     cluster_proportions=self.cluster_proportions
+                     )
+        os.replace(f"{npz_path}.tmp", npz_path)
+        json_path = os.path.join(model_dir, "cluster_model.json")
+        with open(f"{json_path}.tmp", "w") as fp:
+            json.dump({"num_clusters": self.num_clusters, "feature_dim": int(self.centroids.shape[1]),
+                       "config": self.config
+                       }, fp, indent=2, default=str)
+        os.replace(f"{json_path}.tmp", json_path)
+        logger.info(f"Saved cluster model with {self.num_clusters} clusters to {model_dir}")
+
+    @classmethod
+    def load(cls, model_dir) -> "ClusterModel":
+        with open(os.path.join(model_dir, "cluster_model.json"), "r") as fp:
+            metadata = json.load(fp)
+        with np.load(os.path.join(model_dir, "cluster_model.npz")) as arrays:
+            return cls(arrays["centroids"], arrays["cluster_ids"],
+                       distance_quantiles=arrays["distance_quantiles"],
+                       cluster_proportions=arrays["cluster_proportions"],
+                       config=metadata["config"]
+                       )
@@ -0,0 +1,105 @@
+import json
+import math
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+CROP_MODES = ("bbox", "polygon", "mask")
+
+
+@dataclass
+class CocoIndex:
+    """Plain-dict lookup tables over a COCO annotation file.
+
+    Built once per annotation file and picklable, so it can be handed to pool
+    workers instead of a pycocotools ``COCO`` object.
+    """
+    filename_to_img_id: Dict[str, int]
+    imgs: Dict[int, Dict]
+    anns_by_img_id: Dict[int, List[Dict]]
+    annotation_filepath: Optional[str] = None
+
+    def get_img_id(self, imgname) -> int:
+        try:
+            return self.filename_to_img_id[imgname]
+        except KeyError:
+            raise KeyError(f"{imgname} not found in COCO annotation {self.annotation_filepath}") from None
+
+    def get_img_info(self, imgname) -> Dict:
+        return self.imgs[self.get_img_id(imgname)]
+
+    def get_anns(self, imgname) -> List[Dict]:
+        return self.anns_by_img_id.get(self.get_img_id(imgname), [])
+
+
+def build_coco_index(dataset: Dict, annotation_filepath=None) -> CocoIndex:
+    imgs = {img["id"]: img for img in dataset.get("images", [])}
+    filename_to_img_id = {img["file_name"]: img_id for img_id, img in imgs.items()}
+    anns_by_img_id = defaultdict(list)
+    for ann in dataset.get("annotations", []):
+        anns_by_img_id[ann["image_id"]].append(ann)
+    return CocoIndex(filename_to_img_id=filename_to_img_id, imgs=imgs,
+                     anns_by_img_id=dict(anns_by_img_id),
+                     annotation_filepath=annotation_filepath
+                     )
+
+
+def load_coco_index(coco_annotation_filepath) -> CocoIndex:
+    with open(coco_annotation_filepath, "r") as fp:
+        dataset = json.load(fp)
+    return build_coco_index(dataset, annotation_filepath=str(coco_annotation_filepath))
+
+
+def get_coco_index(coco) -> CocoIndex:
+    """Index for a pycocotools COCO object, built on first use and kept on the object."""
+    coco_index = getattr(coco, "coco_index", None)
+    if coco_index is None:
+        coco_index = build_coco_index(coco.dataset)
+        coco.coco_index = coco_index
+    return coco_index
+
+
+def ann_to_mask(ann, img_info):
+    from pycocotools import mask as mask_utils
+    height, width = img_info["height"], img_info["width"]
+    segmentation = ann["segmentation"]
+    if isinstance(segmentation, list):
+        rle = mask_utils.merge(mask_utils.frPyObjects(segmentation, height, width))
+    elif isinstance(segmentation["counts"], list):
+        rle = mask_utils.frPyObjects(segmentation, height, width)
+    else:
+        rle = segmentation
+    return mask_utils.decode(rle)
+
+
+def _clip_box(x0, y0, x1, y1, img_height, img_width) -> Optional[Tuple[int, int, int, int]]:
+    x0, y0 = max(0, int(math.floor(x0))), max(0, int(math.floor(y0)))
+    x1, y1 = min(img_width, int(math.ceil(x1))), min(img_height, int(math.ceil(y1)))
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+
+def get_ann_crop_boxes(ann, img_height, img_width, crop_mode="bbox") -> List[Tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) crop boxes for an annotation without rasterising its mask.
+
+    "bbox" uses the annotation bbox field. "polygon" returns one box per
+    polygon from its vertices and falls back to the bbox for RLE segmentations.
+    """
+    boxes = []
+    segmentation = ann.get("segmentation")
+    if crop_mode == "polygon" and isinstance(segmentation, list) and segmentation:
+        for polygon in segmentation:
+            vertices = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+            if not len(vertices):
+                continue
+            x0, y0 = vertices.min(axis=0)
+            x1, y1 = vertices.max(axis=0)
+            boxes.append(_clip_box(x0, y0, x1, y1, img_height, img_width))
+    elif crop_mode in ("bbox", "polygon"):
+        x, y, w, h = ann["bbox"]
+        boxes.append(_clip_box(x, y, x + w, y + h, img_height, img_width))
+    else:
+        raise ValueError(f"crop_mode must be bbox or polygon, got {crop_mode}")
+    return [box for box in boxes if box is not None]
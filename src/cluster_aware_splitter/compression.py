@@ -0,0 +1,185 @@
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from cluster_aware_splitter import logger
+
+FEATURE_DTYPES = ("float32", "float16", "int8")
+REDUCERS = ("pca", "random_projection")
+
+
+def quantize_features(features, feature_dtype="float32") -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Cast features for storage. int8 uses symmetric per-row scales, returned
+    as the second element (None for float dtypes)."""
+    if feature_dtype not in FEATURE_DTYPES:
+        raise ValueError(f"feature_dtype must be one of {FEATURE_DTYPES}, got {feature_dtype}")
+    features = np.asarray(features, dtype=np.float32)
+    if feature_dtype != "int8":
+        return features.astype(feature_dtype, copy=False), None
+    scales = np.abs(features).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    values = np.clip(np.rint(features / scales[:, None]), -127, 127).astype(np.int8)
+    return values, scales.astype(np.float32)
+
+
+def dequantize_features(values, scales=None) -> np.ndarray:
+    values = np.asarray(values)
+    if scales is None:
+        return values.astype(np.float32, copy=False)
+    return values.astype(np.float32) * np.asarray(scales, dtype=np.float32)[:, None]
+
+
+def _iter_fit_chunks(num_rows, chunk_size, min_chunk_size):
+    # IncrementalPCA needs every partial_fit batch to hold at least n_components
+    # rows, so a short last chunk is folded into the one before it
+    starts = list(range(0, num_rows, chunk_size))
+    if len(starts) > 1 and num_rows - starts[-1] < min_chunk_size:
+        starts.pop()
+    for i, start in enumerate(starts):
+        yield start, starts[i + 1] if i + 1 < len(starts) else num_rows
+
+
+class FeatureReducer(object):
+    """Dimensionality reduction fitted chunk by chunk so the full matrix is never
+    copied, e.g. when it is a FeatureStore memmap."""
+    def __init__(self, n_components=128, chunk_size=8192):
+        self.n_components = n_components
+        self.chunk_size = chunk_size
+
+    def partial_fit(self, features) -> "FeatureReducer":
+        raise NotImplementedError
+
+    def _transform_chunk(self, features) -> np.ndarray:
+        raise NotImplementedError
+
+    def fit(self, features) -> "FeatureReducer":
+        for start, end in _iter_fit_chunks(len(features), self.chunk_size, self.n_components):
+            self.partial_fit(np.asarray(features[start:end], dtype=np.float32))
+        return self
+
+    def transform(self, features) -> np.ndarray:
+        output = np.empty((len(features), self.n_components), dtype=np.float32)
+        for start in range(0, len(features), self.chunk_size):
+            chunk = np.asarray(features[start:start+self.chunk_size], dtype=np.float32)
+            output[start:start+self.chunk_size] = self._transform_chunk(chunk)
+        return output
+
+    def fit_transform(self, features) -> np.ndarray:
+        return self.fit(features).transform(features)
+
+
+class IncrementalPCAReducer(FeatureReducer):
+    def __init__(self, n_components=128, chunk_size=8192, whiten=False):
+        super().__init__(n_components=n_components, chunk_size=chunk_size)
+        self.whiten = whiten
+        self.pca_ = None
+
+    def partial_fit(self, features) -> "IncrementalPCAReducer":
+        if self.pca_ is None:
+            from sklearn.decomposition import IncrementalPCA
+            self.n_components = min(self.n_components, features.shape[1], len(features))
+            self.pca_ = IncrementalPCA(n_components=self.n_components, whiten=self.whiten)
+        self.pca_.partial_fit(features)
+        return self
+
+    def _transform_chunk(self, features) -> np.ndarray:
+        return self.pca_.transform(features)
+
+    @property
+    def explained_variance_ratio(self) -> float:
+        return float(self.pca_.explained_variance_ratio_.sum())
+
+
+class RandomProjectionReducer(FeatureReducer):
+    """Gaussian random projection; fitting only needs the input dimension."""
+    def __init__(self, n_components=128, chunk_size=8192, seed=2024):
+        super().__init__(n_components=n_components, chunk_size=chunk_size)
+        self.seed = seed
+        self.components_ = None
+
+    def partial_fit(self, features) -> "RandomProjectionReducer":
+        if self.components_ is None:
+            rng = np.random.default_rng(self.seed)
+            self.components_ = (rng.normal(size=(features.shape[1], self.n_components))
+                                / np.sqrt(self.n_components)
+                                ).astype(np.float32)
+        return self
+
+    def fit(self, features) -> "RandomProjectionReducer":
+        return self.partial_fit(features[:1])
+
+    def _transform_chunk(self, features) -> np.ndarray:
+        return features @ self.components_
+
+
+def get_reducer(reducer=None, n_components=128, seed=2024) -> Optional[FeatureReducer]:
+    if reducer is None or isinstance(reducer, FeatureReducer):
+        return reducer
+    if reducer == "pca":
+        return IncrementalPCAReducer(n_components=n_components)
+    elif reducer == "random_projection":
+        return RandomProjectionReducer(n_components=n_components, seed=seed)
+    raise ValueError(f"reducer must be one of {REDUCERS} or a FeatureReducer, got {reducer}")
+
+
+def clustering_agreement(reference_labels, labels) -> Dict[str, float]:
+    """Adjusted Rand index and normalized mutual information between two labelings."""
+    from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+    return {"ari": float(adjusted_rand_score(reference_labels, labels)),
+            "nmi": float(normalized_mutual_info_score(reference_labels, labels)),
+            }
+
+
+DEFAULT_REPRESENTATIONS = ({"feature_dtype": "float16"},
+                           {"feature_dtype": "int8"},
+                           {"reducer": "pca", "n_components": 128},
+                           {"reducer": "random_projection", "n_components": 128},
+                           {"feature_dtype": "int8", "reducer": "pca", "n_components": 128},
+                           )
+
+
+def representation_agreement_report(features, clustering_backend="minibatch_kmeans",
+                                    max_num_clusters=None, representations=DEFAULT_REPRESENTATIONS,
+                                    seed=2024
+                                    ) -> List[Dict]:
+    """Cluster full-precision features and each compressed representation and
+    report size, clustering time and ARI/NMI against the full-precision labels.
+
+    clustering_backend must be a backend name so a fresh backend is fitted per
+    representation.
+    """
+    from cluster_aware_splitter.clustering import get_clustering_backend
+    features = np.asarray(features, dtype=np.float32)
+
+    def _cluster(feats):
+        backend = get_clustering_backend(clustering_backend, max_num_clusters=max_num_clusters)
+        start = time.perf_counter()
+        labels = backend.fit_predict(feats)
+        return labels, time.perf_counter() - start
+
+    reference_labels, reference_seconds = _cluster(features)
+    report = [{"feature_dtype": "float32", "reducer": None, "n_components": features.shape[1],
+               "storage_bytes": features.nbytes, "compression_ratio": 1.0,
+               "clustering_seconds": reference_seconds, "ari": 1.0, "nmi": 1.0,
+               }]
+    for representation in representations:
+        feature_dtype = representation.get("feature_dtype", "float32")
+        values, scales = quantize_features(features, feature_dtype)
+        storage_bytes = values.nbytes + (scales.nbytes if scales is not None else 0)
+        reduced = dequantize_features(values, scales)
+        reducer = get_reducer(representation.get("reducer"),
+                              n_components=representation.get("n_components", 128), seed=seed
+                              )
+        if reducer is not None:
+            reduced = reducer.fit_transform(reduced)
+            values, scales = quantize_features(reduced, feature_dtype)
+            storage_bytes = values.nbytes + (scales.nbytes if scales is not None else 0)
+        labels, seconds = _cluster(reduced)
+        entry = {"feature_dtype": feature_dtype, "reducer": representation.get("reducer"),
+                 "n_components": reduced.shape[1], "storage_bytes": storage_bytes,
+                 "compression_ratio": features.nbytes / storage_bytes,
+                 "clustering_seconds": seconds,
+                 }
+        entry.update(clustering_agreement(reference_labels, labels))
+        logger.info(f"Representation agreement: {entry}")
+        report.append(entry)
+    return report
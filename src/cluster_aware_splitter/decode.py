@@ -0,0 +1,132 @@
+import os
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from cluster_aware_splitter import logger
+from cluster_aware_splitter.lazy_import import lazy_import
+
+Image = lazy_import("PIL.Image")
+tifffile = lazy_import("tifffile")
+
+# scale factors libjpeg can apply while decoding in the DCT domain
+JPEG_SCALE_RATIOS = (1, 2, 4, 8)
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+
+def decode_jpeg_reduced(contents, img_shape):
+    """Decode JPEG bytes at the largest DCT scale that still covers img_shape.
+    Works eagerly and inside tf.data graphs."""
+    from cluster_aware_splitter.feat import tf
+    shape = tf.image.extract_jpeg_shape(contents)
+    height, width = shape[0], shape[1]
+    # ratios are nested (a usable 1/4 implies a usable 1/2), so the number of
+    # usable ratios above 1 indexes the largest one
+    branch_index = tf.add_n([tf.cast(tf.logical_and((height + ratio - 1) // ratio >= img_shape[0],
+                                                    (width + ratio - 1) // ratio >= img_shape[1]
+                                                    ), tf.int32)
+                             for ratio in JPEG_SCALE_RATIOS[1:]
+                             ])
+    branches = [lambda ratio=ratio: tf.image.decode_jpeg(contents, channels=3, ratio=ratio)
+                for ratio in JPEG_SCALE_RATIOS
+                ]
+    return tf.switch_case(branch_index, branches)
+
+
+def _tiff_spatial_shape(shape, axes):
+    if axes in ("YX", "YXS"):
+        return shape[0], shape[1]
+    return None
+
+
+def block_mean_downsample(data, factor, rows_per_chunk=64) -> np.ndarray:
+    """Area-downsample the first two axes of data by an integer factor.
+
+    Each output pixel is the mean of a factor x factor block (trailing rows
+    and columns that do not fill a block are dropped), so fine detail is
+    averaged rather than aliased. data may be a memmap; it is read in chunks
+    of rows_per_chunk output rows. Integer dtypes are rounded and kept.
+    """
+    out_height, out_width = data.shape[0] // factor, data.shape[1] // factor
+    channel_shape = data.shape[2:]
+    out = np.empty((out_height, out_width) + channel_shape, dtype=data.dtype)
+    for start in range(0, out_height, rows_per_chunk):
+        stop = min(start + rows_per_chunk, out_height)
+        block = np.asarray(data[start * factor:stop * factor, :out_width * factor], dtype=np.float32)
+        block = block.reshape((stop - start, factor, out_width, factor) + channel_shape).mean(axis=(1, 3))
+        out[start:stop] = np.rint(block) if np.issubdtype(data.dtype, np.integer) else block
+    return out
+
+
+def read_tiff_reduced(img_path, target_height, target_width) -> Optional[np.ndarray]:
+    """Read a TIFF close to the target size without decoding it at full resolution.
+
+    Uses the smallest pyramid level that covers the target, or a block-mean
+    downsample of a memory-mapped uncompressed image. Returns None when
+    neither applies (or tifffile is not installed), so the caller falls back
+    to a full decode.
+    """
+    try:
+        with tifffile.TiffFile(img_path) as tif:
+            series = tif.series[0]
+            levels = list(getattr(series, "levels", None) or [series])
+            for level in reversed(levels[1:]):
+                spatial = _tiff_spatial_shape(level.shape, level.axes)
+                if spatial and spatial[0] >= target_height and spatial[1] >= target_width:
+                    return level.asarray()
+            spatial = _tiff_spatial_shape(series.shape, series.axes)
+            if not spatial:
+                return None
+            step = min(spatial[0] // target_height, spatial[1] // target_width)
+            if step < 2:
+                return None
+        # only uncompressed, contiguous images can be memory-mapped
+        data = tifffile.memmap(img_path, mode="r")
+    except ImportError:
+        return None
+    except (ValueError, OSError) as error:
+        logger.debug(f"No reduced read for {img_path}: {error}")
+        return None
+    return block_mean_downsample(data, step)
+
+
+def open_image_reduced(img_path, width, height):
+    """PIL image of img_path decoded close to (width, height) where the format allows."""
+    ext = os.path.splitext(str(img_path))[1].lower()
+    if ext in TIFF_EXTENSIONS:
+        data = read_tiff_reduced(img_path, height, width)
+        if data is not None and data.dtype == np.uint8:
+            return Image.fromarray(data)
+    img = Image.open(img_path)
+    if img.format == "JPEG":
+        # draft picks the largest DCT scale that keeps the image at least this big
+        img.draft(img.mode, (width, height))
+    return img
+
+
+def compare_reduced_decode(img_paths: List[str], full_decode_fn: Callable,
+                           reduced_decode_fn: Callable, feature_fn: Optional[Callable] = None,
+                           max_mean_abs_error=0.02, min_cosine=0.99
+                           ) -> Dict:
+    """Check reduced decoding against the full path on sample images.
+
+    Both decode functions map a path to an (H, W, 3) array in [0, 1] at the
+    model input size. feature_fn, when given, maps a stacked batch of such
+    arrays to (N, D) features for a cosine-similarity check.
+    """
+    full = np.stack([np.asarray(full_decode_fn(img_path), dtype=np.float32) for img_path in img_paths])
+    reduced = np.stack([np.asarray(reduced_decode_fn(img_path), dtype=np.float32) for img_path in img_paths])
+    mean_abs_errors = np.abs(full - reduced).reshape(len(img_paths), -1).mean(axis=1)
+    report = {"num_images": len(img_paths), "max_mean_abs_error": float(mean_abs_errors.max()),
+              "mean_abs_error": float(mean_abs_errors.mean()),
+              }
+    passed = report["max_mean_abs_error"] <= max_mean_abs_error
+    if feature_fn is not None:
+        full_features = np.asarray(feature_fn(full), dtype=np.float32)
+        reduced_features = np.asarray(feature_fn(reduced), dtype=np.float32)
+        cosine = (full_features * reduced_features).sum(axis=1) / np.maximum(
+            np.linalg.norm(full_features, axis=1) * np.linalg.norm(reduced_features, axis=1), 1e-12
+        )
+        report["min_cosine_similarity"] = float(cosine.min())
+        passed = passed and report["min_cosine_similarity"] >= min_cosine
+    report["passed"] = passed
+    return report
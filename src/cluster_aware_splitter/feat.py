@@ -1,9 +1,7 @@
-
 #%%
 from typing import NamedTuple, Union, Tuple, List
-import tensorflow as tf
-import torch
-from PIL import Image
+from collections.abc import Sequence
+import sys
 import random
 import numpy as np
 import multiprocessing
@@ -12,18 +10,41 @@ from typing import List
 from glob import glob
 import os
 from multiprocessing import Process, Lock
-from tensorflow.keras.layers import Add
-import cv2
-from pycocotools.coco import COCO
-from tensorflow.keras.layers import Add
-from clusteval import clusteval
 import pandas as pd
 from pathlib import Path
-import tensorflow_io as tfio
 from tqdm import tqdm
 from cluster_aware_splitter import logger
+from cluster_aware_splitter.lazy_import import lazy_import
+from cluster_aware_splitter.instrumentation import (get_instrumentation, resolve_instrumentation,
+                                                    set_instrumentation
+                                                    )
+from cluster_aware_splitter.clustering import ClusterModel, get_clustering_backend
+from cluster_aware_splitter.compression import get_reducer
+from cluster_aware_splitter.feature_store import get_model_config
+from cluster_aware_splitter.decode import (JPEG_EXTENSIONS, TIFF_EXTENSIONS,
+                                           decode_jpeg_reduced, open_image_reduced,
+                                           read_tiff_reduced
+                                           )
+from cluster_aware_splitter.coco_index import (CROP_MODES, ann_to_mask,
+                                               get_ann_crop_boxes, get_coco_index,
+                                               load_coco_index
+                                               )
+
+
+def _hide_gpus(tf_module):
+    try:
+        tf_module.config.set_visible_devices([], 'GPU')
+    except RuntimeError as error:
+        # raised once devices are initialized, e.g. when tensorflow was already
+        # used through another import; GPUs stay visible in that case
+        logger.warning(f"Could not hide GPUs from tensorflow: {error}")
 
-tf.config.set_visible_devices([], 'GPU')
+# heavy backends are only imported when first used so that importing this
+# module (and every spawned worker) stays cheap
+tf = lazy_import("tensorflow", on_import=_hide_gpus)
+tfio = lazy_import("tensorflow_io")
+cv2 = lazy_import("cv2")
+Image = lazy_import("PIL.Image")
 
 class ModelPreprocessReturn(NamedTuple):
     model: str
@@ -45,13 +66,191 @@ def load_model_and_preprocess(input_shape, model_family, model_name, weight
     model_preprocess_result = ModelPreprocessReturn(model=model, preprocess=preprocess)
     return model_preprocess_result
 
+def normalize_image_dtype(x):
+    if x.dtype == tf.uint16:
+        x = tf.cast(x, tf.float32) / 65535.0
+    elif x.dtype == tf.uint8:
+        x = tf.cast(x, tf.float32) / 255.0
+    return x
+
+
+def decode_image_for_inference(image_path, img_shape, reduced_decode=False, contents=None):
+    """Graph-compatible counterpart of FeatureExtractor.load_image_for_inference.
+
+    With reduced_decode JPEGs are decoded at a DCT scale close to img_shape;
+    TIFFs are always fully decoded here. contents, when given, are the already
+    read image bytes and image_path is only used for its extension.
+    """
+    image = tf.io.read_file(image_path) if contents is None else contents
+    lower_path = tf.strings.lower(image_path)
+    is_tiff = tf.strings.regex_full_match(lower_path, r".*\.tiff?")
+
+    def _decode_tiff():
+        x = normalize_image_dtype(tfio.experimental.image.decode_tiff(image))
+        return x[..., :3]
+
+    def _decode_other():
+        x = tf.image.decode_image(image, channels=img_shape[2], expand_animations=False)
+        return normalize_image_dtype(x)[..., :3]
+
+    def _decode_jpeg_reduced():
+        return normalize_image_dtype(decode_jpeg_reduced(image, img_shape))
+
+    if reduced_decode:
+        is_jpeg = tf.strings.regex_full_match(lower_path, r".*\.jpe?g")
+        x = tf.case([(is_tiff, _decode_tiff), (is_jpeg, _decode_jpeg_reduced)],
+                    default=_decode_other
+                    )
+    else:
+        x = tf.cond(is_tiff, _decode_tiff, _decode_other)
+    x = tf.image.resize(x, (img_shape[0], img_shape[1]))
+    x.set_shape((img_shape[0], img_shape[1], 3))
+    return x
+
+
+def make_inference_dataset(img_paths, img_shape, batch_size=32, reduced_decode=False):
+    autotune = tf.data.AUTOTUNE
+    dataset = tf.data.Dataset.from_tensor_slices(list(img_paths))
+    dataset = dataset.map(lambda image_path: decode_image_for_inference(image_path, img_shape,
+                                                                        reduced_decode=reduced_decode
+                                                                        ),
+                          num_parallel_calls=autotune, deterministic=True
+                          )
+    return dataset.batch(batch_size).prefetch(autotune)
+
+
+def make_packed_inference_dataset(shard_paths, img_shape, batch_size=32, reduced_decode=False,
+                                  img_paths=None
+                                  ):
+    """Like make_inference_dataset but streams images out of packed tar shards.
+
+    img_paths, when a list, is filled with each image's original path in
+    dataset order as the shards are read.
+    """
+    from cluster_aware_splitter.packing import iter_packed_images
+    autotune = tf.data.AUTOTUNE
+
+    def _generate():
+        for metadata, contents in iter_packed_images(shard_paths):
+            if img_paths is not None:
+                img_paths.append(metadata["path"])
+            yield metadata["file_name"], contents
+
+    dataset = tf.data.Dataset.from_generator(_generate,
+                                             output_signature=(tf.TensorSpec((), tf.string),
+                                                               tf.TensorSpec((), tf.string)
+                                                               )
+                                             )
+    dataset = dataset.map(lambda file_name, contents: decode_image_for_inference(file_name, img_shape,
+                                                                                 reduced_decode=reduced_decode,
+                                                                                 contents=contents
+                                                                                 ),
+                          num_parallel_calls=autotune, deterministic=True
+                          )
+    return dataset.batch(batch_size).prefetch(autotune)
+
+
+class LazyThumbnails(Sequence):
+    """Resized PIL images that are only decoded when indexed."""
+    def __init__(self, img_paths, width=224, height=224):
+        self.img_paths = list(img_paths)
+        self.width = width
+        self.height = height
+        
+    def __len__(self):
+        return len(self.img_paths)
+    
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return LazyThumbnails(self.img_paths[index], self.width, self.height)
+        return Image.open(self.img_paths[index]).resize((self.width, self.height))
+
+
+# process-local registry of built feature extractors keyed by (model_family,
+# model_name, input_shape, weight, inference backend). Each pool worker fills it
+# once through init_model_registry and reuses it for every image it handles.
+_MODEL_REGISTRY = {}
+
+
+def get_model_registry_key(input_shape, model_family, model_name, weight,
+                           inference_backend="keras", inference_options=None
+                           ):
+    return (model_family, model_name, tuple(input_shape), weight,
+            inference_backend, tuple(sorted((inference_options or {}).items()))
+            )
+
+
+def get_registered_feature_extractor(input_shape, model_family, model_name,
+                                     weight, inference_backend="keras",
+                                     inference_options=None
+                                     ) -> ModelPreprocessReturn:
+    """Build (once per process) the backbone+GAP extractor and its preprocess
+    function. inference_backend other than "keras" wraps the model with
+    inference_backends.build_inference_backend(**inference_options)."""
+    key = get_model_registry_key(input_shape=input_shape,
+                                 model_family=model_family,
+                                 model_name=model_name, weight=weight,
+                                 inference_backend=inference_backend,
+                                 inference_options=inference_options
+                                 )
+    if key not in _MODEL_REGISTRY:
+        logger.info(f"Building feature extractor for {key} in process {os.getpid()}")
+        model, preprocess = load_model_and_preprocess(input_shape=input_shape,
+                                                      model_family=model_family,
+                                                      model_name=model_name,
+                                                      weight=weight
+                                                      )
+        inputs = model.inputs
+        x = model(inputs)
+        outputs = tf.keras.layers.GlobalAveragePooling2D()(x)
+        feature_extractor = tf.keras.Model(inputs=inputs, outputs=outputs,
+                                           name="feature_extractor"
+                                           )
+        if inference_backend != "keras":
+            from cluster_aware_splitter.inference_backends import build_inference_backend
+            feature_extractor = build_inference_backend(inference_backend, feature_extractor,
+                                                        input_shape, **(inference_options or {})
+                                                        )
+        _MODEL_REGISTRY[key] = ModelPreprocessReturn(model=feature_extractor,
+                                                     preprocess=preprocess
+                                                     )
+    return _MODEL_REGISTRY[key]
+
+
+def clear_model_registry():
+    _MODEL_REGISTRY.clear()
+
+
+def init_model_registry(img_resize_width, img_resize_height, model_family,
+                        model_name, img_normalization_weight, seed,
+                        inference_backend="keras", inference_options=None
+                        ):
+    """Pool initializer: seed the worker and build its feature extractor once."""
+    feat_extract = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
+                                    img_resize_height=img_resize_height,
+                                    model_family=model_family,
+                                    model_name=model_name,
+                                    img_normalization_weight=img_normalization_weight,
+                                    inference_backend=inference_backend,
+                                    inference_options=inference_options
+                                    )
+    feat_extract.set_seed_consistently()
+    feat_extract.get_cached_feature_extractor()
+
+
 class FeatureExtractor(object):
     def __init__(self, seed=2024, img_resize_width=224,
                  img_resize_height=224, model_family="efficient",
                  model_name="EfficientNetB0",
-                 img_normalization_weight="imagenet"
+                 img_normalization_weight="imagenet",
+                 inference_backend="keras",
+                 inference_options=None,
+                 reduced_decode=False
                  ):
         self.seed=seed
+        self.reduced_decode=reduced_decode
+        self.inference_backend=inference_backend
+        self.inference_options=inference_options
         self.img_resize_width=img_resize_width
         self.img_resize_height=img_resize_height
         self.model_family=model_family
@@ -63,7 +262,10 @@ class FeatureExtractor(object):
         if seed:
             self.seed=seed
         random.seed(self.seed)
-        torch.manual_seed(self.seed)
+        # torch is only seeded for callers that already use it; importing it
+        # here just to seed it would cost every worker seconds at startup
+        if "torch" in sys.modules:
+            sys.modules["torch"].manual_seed(self.seed)
         np.random.seed(self.seed)
         
     def load_and_resize_image(self, img_path, width=None, height=None):
@@ -72,8 +274,11 @@ class FeatureExtractor(object):
         
         if not height:
             height = self.img_resize_height
-            
-        img = Image.open(img_path).resize((width, height))
+        
+        if self.reduced_decode:
+            img = open_image_reduced(img_path, width, height).resize((width, height))
+        else:
+            img = Image.open(img_path).resize((width, height))
         return img
     
     def load_model_and_preprocess_func(self, input_shape=None,
@@ -117,6 +322,15 @@ class FeatureExtractor(object):
                                                 )
         return self.feature_extractor
     
+    def get_cached_feature_extractor(self) -> ModelPreprocessReturn:
+        return get_registered_feature_extractor(input_shape=self.image_shape,
+                                                model_family=self.model_family,
+                                                model_name=self.model_name,
+                                                weight=self.img_normalization_weight,
+                                                inference_backend=self.inference_backend,
+                                                inference_options=self.inference_options
+                                                )
+    
     def extract_features(self, inputs, model=None, preprocess=None):
         if not model or not preprocess:
             model, preprocess = self._check_model_preprocess_exist()
@@ -124,19 +338,47 @@ class FeatureExtractor(object):
         preds = model(x)
         return preds[0]
     
+    def extract_features_batch(self, img_paths, batch_size=32,
+                               feature_extractor=None, preprocess=None
+                               ) -> np.ndarray:
+        """Run one forward pass per batch of images and return an (N, D) float32 array."""
+        if not feature_extractor or not preprocess:
+            feature_extractor, preprocess = self.get_cached_feature_extractor()
+        instrumentation = get_instrumentation()
+        batch_features = []
+        for i in range(0, len(img_paths), batch_size):
+            batch_paths = img_paths[i:i+batch_size]
+            with instrumentation.stage("decode"):
+                batch = tf.concat([self.load_image_for_inference(img_path, self.image_shape)
+                                   for img_path in batch_paths
+                                   ], axis=0
+                                  )
+            with instrumentation.stage("preprocess"):
+                x = preprocess(batch)
+            with instrumentation.stage("inference"):
+                preds = feature_extractor(x, training=False)
+                batch_features.append(np.asarray(preds, dtype=np.float32))
+            if instrumentation.enabled:
+                instrumentation.increment("images_processed", len(batch_paths))
+                instrumentation.increment("bytes_read", sum(os.path.getsize(img_path)
+                                                            for img_path in batch_paths
+                                                            ))
+        if not batch_features:
+            return np.empty((0, feature_extractor.output_shape[-1]), dtype=np.float32)
+        return np.concatenate(batch_features, axis=0)
+    
     def load_image_for_inference(self, image_path, img_shape=None):
         if not img_shape:
             img_shape = self.image_shape
-        image = tf.io.read_file(image_path)
         ext = Path(image_path).suffix.lower()
-        if ext in [".tif", ".tiff"]:
-            x = tfio.experimental.image.decode_tiff(image)
-        else:
-            x = tf.image.decode_image(image, channels=img_shape[2])
-        if x.dtype == tf.uint16:
-            x = tf.cast(x, tf.float32) / 65535.0
-        elif x.dtype == tf.uint8:
-            x = tf.cast(x, tf.float32) / 255.0
+        x = self._decode_reduced(image_path, img_shape, ext) if self.reduced_decode else None
+        if x is None:
+            image = tf.io.read_file(image_path)
+            if ext in [".tif", ".tiff"]:
+                x = tfio.experimental.image.decode_tiff(image)
+            else:
+                x = tf.image.decode_image(image, channels=img_shape[2])
+        x = normalize_image_dtype(x)
         
         x = tf.image.resize(x, (img_shape[0], img_shape[1]))
         x = tf.expand_dims(x, axis=0)
@@ -145,6 +387,74 @@ class FeatureExtractor(object):
             x = x[..., :3]
         return x
     
+    def _decode_reduced(self, image_path, img_shape, ext):
+        """Decode close to img_shape, or None when the format needs a full decode."""
+        if ext in JPEG_EXTENSIONS:
+            return decode_jpeg_reduced(tf.io.read_file(image_path), img_shape)
+        if ext in TIFF_EXTENSIONS:
+            data = read_tiff_reduced(image_path, img_shape[0], img_shape[1])
+            if data is not None:
+                x = tf.convert_to_tensor(data)
+                return tf.repeat(x[..., None], 3, axis=-1) if x.shape.rank == 2 else x
+        return None
+    
+    def make_inference_dataset(self, img_paths, batch_size=32, img_shape=None):
+        if not img_shape:
+            img_shape = self.image_shape
+        return make_inference_dataset(img_paths=img_paths, img_shape=img_shape,
+                                      batch_size=batch_size,
+                                      reduced_decode=self.reduced_decode
+                                      )
+    
+    def extract_features_tf_data(self, img_paths, batch_size=32,
+                                 feature_extractor=None, preprocess=None
+                                 ) -> np.ndarray:
+        """Stream images through a tf.data pipeline so decoding overlaps inference."""
+        if not feature_extractor or not preprocess:
+            feature_extractor, preprocess = self.get_cached_feature_extractor()
+        dataset = self.make_inference_dataset(img_paths, batch_size=batch_size)
+        return self._extract_dataset_features(dataset, feature_extractor, preprocess)
+    
+    def extract_features_packed(self, shard_paths, batch_size=32,
+                                feature_extractor=None, preprocess=None
+                                ) -> Tuple[List[str], np.ndarray]:
+        """Extract features from packed tar shards (see packing.pack_images).
+
+        Each shard is read sequentially instead of opening one file per image.
+        Returns the original image paths in row order and the features.
+        """
+        if not feature_extractor or not preprocess:
+            feature_extractor, preprocess = self.get_cached_feature_extractor()
+        img_paths = []
+        dataset = make_packed_inference_dataset(shard_paths, img_shape=self.image_shape,
+                                                batch_size=batch_size,
+                                                reduced_decode=self.reduced_decode,
+                                                img_paths=img_paths
+                                                )
+        features = self._extract_dataset_features(dataset, feature_extractor, preprocess)
+        return img_paths[:len(features)], features
+    
+    def _extract_dataset_features(self, dataset, feature_extractor, preprocess) -> np.ndarray:
+        instrumentation = get_instrumentation()
+        batch_features = []
+        # decoding runs inside the tf.data pipeline, so only the time spent
+        # waiting for the next batch is visible here
+        dataset_iter = iter(dataset)
+        while True:
+            with instrumentation.stage("decode_wait"):
+                batch = next(dataset_iter, None)
+            if batch is None:
+                break
+            with instrumentation.stage("preprocess"):
+                x = preprocess(batch)
+            with instrumentation.stage("inference"):
+                preds = feature_extractor(x, training=False)
+                batch_features.append(np.asarray(preds, dtype=np.float32))
+            instrumentation.increment("images_processed", len(batch_features[-1]))
+        if not batch_features:
+            return np.empty((0, feature_extractor.output_shape[-1]), dtype=np.float32)
+        return np.concatenate(batch_features, axis=0)
+    
     def get_images_features(self, img_property_set, feature_extractor=None,
                             preprocess=None,
                             use_cropped_imgs=False,
@@ -180,20 +490,26 @@ class FeatureExtractor(object):
         img_property_set.features = features
         
         
-def get_objects(imgname, coco, img_dir):
-    val = [obj for obj in coco.imgs.values() if obj["file_name"] == imgname][0]
-    img_id = val['id']
-    img_info = coco.loadImgs(img_id)[0]
+def get_objects(imgname, coco, img_dir, coco_index=None, crop_mode="bbox"):
+    if crop_mode not in CROP_MODES:
+        raise ValueError(f"crop_mode must be one of {CROP_MODES}, got {crop_mode}")
+    if coco_index is None:
+        coco_index = get_coco_index(coco)
+    img_info = coco_index.get_img_info(imgname)
     img_path = os.path.join(img_dir, imgname)
     image = cv2.imread(img_path)
 
-    # Get annotation IDs for the image
-    ann_ids = coco.getAnnIds(imgIds=img_id)
-    anns = coco.loadAnns(ann_ids)
+    anns = coco_index.get_anns(imgname)
     img_obj = []
+    if crop_mode != "mask":
+        img_height, img_width = image.shape[:2]
+        for ann in anns:
+            for x0, y0, x1, y1 in get_ann_crop_boxes(ann, img_height, img_width, crop_mode):
+                img_obj.append(image[y0:y1, x0:x1])
+        return img_obj
+    
     for ann in anns:
-        segmentation = ann['segmentation']
-        mask = coco.annToMask(ann)
+        mask = ann_to_mask(ann, img_info)
 
         # Find contours
         contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -204,40 +520,81 @@ def get_objects(imgname, coco, img_dir):
     return img_obj
 
 
+OBJECT_FEATURE_REDUCTIONS = ("sum", "mean", "max", "gem")
+EMPTY_OBJECT_FALLBACKS = ("image", "zeros", "raise")
+
+def aggregate_object_features(features, reduction="sum", gem_power=3.0) -> np.ndarray:
+    features = np.asarray(features, dtype=np.float32)
+    if reduction == "sum":
+        return features.sum(axis=0)
+    elif reduction == "mean":
+        return features.mean(axis=0)
+    elif reduction == "max":
+        return features.max(axis=0)
+    elif reduction == "gem":
+        # generalized mean pooling: mean at p=1, approaches max as p grows
+        clipped = np.clip(features, 1e-6, None)
+        return np.power(np.mean(np.power(clipped, gem_power), axis=0), 1.0 / gem_power)
+    raise ValueError(f"reduction must be one of {OBJECT_FEATURE_REDUCTIONS}, got {reduction}")
+
+
 def get_object_features(obj_imgs, 
                         img_resize_width,
                         img_resize_height,
                         model_family, model_name,
                         img_normalization_weight,
-                        seed, #images_list, features_list, 
-                        #model_artefacts_dict, #lock
-                        ):
+                        seed, reduction="sum",
+                        empty_fallback="image", img_path=None,
+                        batch_size=64
+                        ) -> np.ndarray:
+    if reduction not in OBJECT_FEATURE_REDUCTIONS:
+        raise ValueError(f"reduction must be one of {OBJECT_FEATURE_REDUCTIONS}, got {reduction}")
+    if empty_fallback not in EMPTY_OBJECT_FALLBACKS:
+        raise ValueError(f"empty_fallback must be one of {EMPTY_OBJECT_FALLBACKS}, got {empty_fallback}")
+    if not len(obj_imgs) and empty_fallback == "raise":
+        raise ValueError(f"No objects to extract features from for {img_path}")
+    if not len(obj_imgs) and empty_fallback == "image" and not img_path:
+        raise ValueError("empty_fallback='image' needs img_path to read the whole image from")
     feat_extract = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
                                     img_resize_height=img_resize_height, 
                                     model_family=model_family,
                                     model_name=model_name,
                                     img_normalization_weight=img_normalization_weight
                                     )
-    feature_list = []
-    for obj_img in obj_imgs:
-        channels = obj_img.shape[2]
-        #Image.fromarray(obj_img).show()
-        img_tensor = tf.convert_to_tensor(obj_img)
-        img_resized = tf.image.resize_with_pad(image=img_tensor, target_height=img_resize_height, target_width=img_resize_width)
-        img_for_infer = tf.expand_dims(img_resized, axis=0)
-        feat_extract.set_seed_consistently()
-        model, preprocess = feat_extract.load_model_and_preprocess_func()
-        feature_extractor = feat_extract.get_feature_extractor(model)
-        feature = feat_extract.extract_features(img_for_infer, feature_extractor, preprocess)
-        feature_list.append(feature)
-    
-    if len(feature_list) > 1:
-        print(f"len(feature_list): {len(feature_list)}")
-        logger.info(f"len(feature_list): {len(feature_list)}")
-        feature = Add()(feature_list)#/len(feature_list)
-    else:
-        feature = feature_list[0]
-    return feature
+    feat_extract.set_seed_consistently()
+    feature_extractor, preprocess = feat_extract.get_cached_feature_extractor()
+    if not len(obj_imgs):
+        if empty_fallback == "zeros":
+            return np.zeros(feature_extractor.output_shape[-1], dtype=np.float32)
+        logger.info(f"No objects found in {img_path}, using whole image features")
+        # read like get_objects so the row matches object rows in color order and scale
+        return get_crop_features([cv2.imread(img_path)], feature_extractor, preprocess,
+                                 img_resize_width, img_resize_height, batch_size=batch_size
+                                 )[0]
+    features = get_crop_features(obj_imgs, feature_extractor, preprocess, img_resize_width,
+                                 img_resize_height, batch_size=batch_size
+                                 )
+    with get_instrumentation().stage("aggregation"):
+        return aggregate_object_features(features, reduction=reduction)
+
+
+def get_crop_features(obj_imgs, feature_extractor, preprocess, img_resize_width,
+                      img_resize_height, batch_size=64
+                      ) -> np.ndarray:
+    """(len(obj_imgs), D) features of cv2 crops, each padded to the model input size."""
+    instrumentation = get_instrumentation()
+    batch_features = []
+    for i in range(0, len(obj_imgs), batch_size):
+        crops = tf.stack([tf.image.resize_with_pad(image=tf.convert_to_tensor(obj_img),
+                                                   target_height=img_resize_height,
+                                                   target_width=img_resize_width
+                                                   )
+                          for obj_img in obj_imgs[i:i+batch_size]
+                          ])
+        with instrumentation.stage("inference"):
+            preds = feature_extractor(preprocess(crops), training=False)
+            batch_features.append(np.asarray(preds, dtype=np.float32))
+    return np.concatenate(batch_features, axis=0)
 
 
 def get_imgs_and_extract_features(img_path, img_resize_width,
@@ -246,16 +603,20 @@ def get_imgs_and_extract_features(img_path, img_resize_width,
                                 img_normalization_weight,
                                 seed, return_img_path=False,#images_list, features_list, 
                                 #model_artefacts_dict, #lock
+                                inference_backend="keras", inference_options=None,
+                                reduced_decode=False
                                 ):
     feat_extract = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
                                     img_resize_height=img_resize_height, 
                                     model_family=model_family,
                                     model_name=model_name,
-                                    img_normalization_weight=img_normalization_weight
+                                    img_normalization_weight=img_normalization_weight,
+                                    inference_backend=inference_backend,
+                                    inference_options=inference_options,
+                                    reduced_decode=reduced_decode
                                     )
     feat_extract.set_seed_consistently()
-    model, preprocess = feat_extract.load_model_and_preprocess_func()
-    feature_extractor = feat_extract.get_feature_extractor(model)
+    feature_extractor, preprocess = feat_extract.get_cached_feature_extractor()
     img = feat_extract.load_and_resize_image(img_path, img_resize_width, img_resize_height)
     img_for_infer = feat_extract.load_image_for_inference(img_path, feat_extract.image_shape)
     feature = feat_extract.extract_features(img_for_infer, feature_extractor, preprocess)
@@ -267,53 +628,102 @@ def get_imgs_and_extract_features(img_path, img_resize_width,
 def get_imgs_and_extract_features_wrapper(args):
     img, feature, img_path = get_imgs_and_extract_features(**args)
     return img, feature, img_path
+
+
+def extract_features_only(img_path, img_resize_width, img_resize_height,
+                          model_family, model_name, img_normalization_weight,
+                          seed, inference_backend="keras", inference_options=None,
+                          reduced_decode=False
+                          ):
+    feat_extract = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
+                                    img_resize_height=img_resize_height, 
+                                    model_family=model_family,
+                                    model_name=model_name,
+                                    img_normalization_weight=img_normalization_weight,
+                                    inference_backend=inference_backend,
+                                    inference_options=inference_options,
+                                    reduced_decode=reduced_decode
+                                    )
+    feat_extract.set_seed_consistently()
+    feature_extractor, preprocess = feat_extract.get_cached_feature_extractor()
+    img_for_infer = feat_extract.load_image_for_inference(img_path, feat_extract.image_shape)
+    feature = feat_extract.extract_features(img_for_infer, feature_extractor, preprocess)
+    return np.asarray(feature, dtype=np.float32), img_path
+
+
+def extract_features_only_wrapper(args):
+    return extract_features_only(**args)
+
+
+def get_imgs_and_extract_features_batch(img_paths, img_resize_width,
+                                        img_resize_height,
+                                        model_family, model_name,
+                                        img_normalization_weight,
+                                        seed, batch_size=32, return_imgs=True,
+                                        inference_backend="keras", inference_options=None,
+                                        reduced_decode=False
+                                        ):
+    feat_extract = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
+                                    img_resize_height=img_resize_height, 
+                                    model_family=model_family,
+                                    model_name=model_name,
+                                    img_normalization_weight=img_normalization_weight,
+                                    inference_backend=inference_backend,
+                                    inference_options=inference_options,
+                                    reduced_decode=reduced_decode
+                                    )
+    feat_extract.set_seed_consistently()
+    imgs = None
+    if return_imgs:
+        imgs = [feat_extract.load_and_resize_image(img_path, img_resize_width, img_resize_height)
+                for img_path in img_paths
+                ]
+    features = feat_extract.extract_features_batch(img_paths, batch_size=batch_size)
+    return imgs, features, img_paths
+
+
+def get_imgs_and_extract_features_batch_wrapper(args):
+    imgs, features, img_paths = get_imgs_and_extract_features_batch(**args)
+    return imgs, features, img_paths
+
+
+def make_batch_args(img_paths, batch_size, **kwargs):
+    return [{"img_paths": img_paths[i:i+batch_size], "batch_size": batch_size,
+             **kwargs
+             } for i in range(0, len(img_paths), batch_size)
+            ]
     
     
     
-def extract_object_features_per_image(img_paths, coco_annotation_filepath)->Tuple[List, List]:
-    coco = COCO(coco_annotation_filepath)
+def extract_object_features_per_image(img_paths, coco_annotation_filepath,
+                                      coco_index=None, crop_mode="bbox",
+                                      reduction="sum", empty_fallback="image"
+                                      )->Tuple[List, List]:
+    if coco_index is None:
+        coco_index = load_coco_index(coco_annotation_filepath)
     obj_featlist = []
     imgname_list = []
     for img in img_paths:
         imgname = os.path.basename(img)
-        objects = get_objects(imgname=imgname, coco=coco, img_dir=img_dirs)
+        objects = get_objects(imgname=imgname, coco=None, img_dir=os.path.dirname(img),
+                              coco_index=coco_index, crop_mode=crop_mode
+                              )
         features = get_object_features(obj_imgs=objects, seed=2024, img_resize_width=224,
                                         img_resize_height=224,
                                         model_family="efficientnet",
                                         model_name="EfficientNetB0",
                                         img_normalization_weight="imagenet",
+                                        reduction=reduction,
+                                        empty_fallback=empty_fallback,
+                                        img_path=img
                                         )
         obj_featlist.append(features)
         imgname_list.append(imgname)
     return imgname_list, obj_featlist
 
-def get_imgs_and_extract_features_multiprocess(img_path, img_resize_width,
-                                               img_resize_height,
-                                               model_family, model_name,
-                                               img_normalization_weight,
-                                               seed, images_list, features_list
-                                               ):
-    feat_extract = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
-                                    img_resize_height=img_resize_height, 
-                                    model_family=model_family,
-                                    model_name=model_name,
-                                    img_normalization_weight=img_normalization_weight
-                                    )
-    feat_extract.set_seed_consistently()
-    model, preprocess = feat_extract.load_model_and_preprocess_func()
-    feature_extractor = feat_extract.get_feature_extractor(model)
-    img = feat_extract.load_and_resize_image(img_path, img_resize_width, img_resize_height)
-    img_for_infer = feat_extract.load_image_for_inference(img_path, feat_extract.image_shape)
-    feature = feat_extract.extract_features(img_for_infer, feature_extractor, preprocess)
-    images_list.append(img)
-    features_list.append(feature)
-    print(f"total imgs processed {len(images_list)}")
-    print(f"total features processed {len(features_list)}")
-    logger.info(f"total imgs processed {len(images_list)}")
-    logger.info(f"total features processed {len(features_list)}")
-    return images_list, features_list
-
 #%%
+EXECUTION_MODES = ("single_process", "multiprocess", "tf_data")
+
 def img_feature_extraction_implementor(img_property_set,
                                        feature_extractor_class = None,
                                        seed=2024, img_resize_width=224,
@@ -321,62 +731,157 @@ def img_feature_extraction_implementor(img_property_set,
                                        model_family="efficientnet",
                                        model_name="EfficientNetB0",
                                        img_normalization_weight="imagenet",
-                                       use_cropped_imgs=True,
-                                       multiprocess = False
+                                       multiprocess = False,
+                                       batch_size=32,
+                                       execution_mode=None,
+                                       load_imgs=False,
+                                       feature_store=None,
+                                       inference_backend="keras",
+                                       inference_options=None,
+                                       reduced_decode=False
                                        ):
+    if not execution_mode:
+        execution_mode = "multiprocess" if multiprocess else "single_process"
+    if execution_mode not in EXECUTION_MODES:
+        raise ValueError(f"execution_mode must be one of {EXECUTION_MODES}, got {execution_mode}")
     
     img_paths = sorted(img_property_set.img_paths)
-    if multiprocess:
-        manager = multiprocessing.Manager()
-        images_list = manager.list()
-        features_list = manager.list()
-        image_shape=(img_resize_height, img_resize_width, 3)
-        args_for_multiprocess = [(img_path, img_resize_width, img_resize_height,
-                                model_family, model_name, 
-                                img_normalization_weight, seed, images_list,
-                                features_list,
-                                )
-                                for img_path in img_paths
-                                ]
-        num_processes = multiprocessing.cpu_count()
-        
-        with multiprocessing.Pool(num_processes) as pool:
-            print("waiting for multiprocess to finish")
-            results = pool.starmap(get_imgs_and_extract_features_multiprocess, args_for_multiprocess)
-        print(f"results: {len(list(results))}")
-        images_list_re, features_list_re = results
-        
-        img_property_set.imgs = list(images_list_re)
-        img_property_set.features = list(features_list_re)
-        
-        print(f"num of images: {len(img_property_set.imgs)}")
-        print(f"num of features: {len(img_property_set.features)}")
+    if feature_store is not None:
+        feature_store.check_model_config(get_model_config(model_family=model_family, model_name=model_name,
+                                                          img_resize_width=img_resize_width,
+                                                          img_resize_height=img_resize_height,
+                                                          img_normalization_weight=img_normalization_weight
+                                                          ))
+        def _extract_missing(missing_paths):
+            missing_set = ImgPropertySetReturnType(img_names=[os.path.basename(img_path)
+                                                              for img_path in missing_paths
+                                                              ],
+                                                   img_paths=missing_paths,
+                                                   total_num_imgs=len(missing_paths),
+                                                   max_num_clusters=img_property_set.max_num_clusters
+                                                   )
+            missing_set = img_feature_extraction_implementor(missing_set, seed=seed,
+                                                             img_resize_width=img_resize_width,
+                                                             img_resize_height=img_resize_height,
+                                                             model_family=model_family,
+                                                             model_name=model_name,
+                                                             img_normalization_weight=img_normalization_weight,
+                                                             batch_size=batch_size,
+                                                             execution_mode=execution_mode,
+                                                             inference_backend=inference_backend,
+                                                             inference_options=inference_options,
+                                                             reduced_decode=reduced_decode
+                                                             )
+            return missing_set.img_paths, missing_set.features
         
+        img_property_set.features = feature_store.get_or_extract(img_paths, _extract_missing)
+        img_property_set.imgs = LazyThumbnails(img_paths, img_resize_width, img_resize_height)
+        if load_imgs:
+            img_property_set.imgs = list(img_property_set.imgs)
+        img_property_set.img_paths = img_paths
+        return img_property_set
+    
+    if execution_mode == "tf_data":
+        feat_extract = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
+                                        img_resize_height=img_resize_height,
+                                        model_family=model_family,
+                                        model_name=model_name,
+                                        img_normalization_weight=img_normalization_weight,
+                                        inference_backend=inference_backend,
+                                        inference_options=inference_options,
+                                        reduced_decode=reduced_decode
+                                        )
+        feat_extract.set_seed_consistently()
+        img_property_set.features = feat_extract.extract_features_tf_data(img_paths,
+                                                                          batch_size=batch_size
+                                                                          )
+        img_property_set.imgs = LazyThumbnails(img_paths, img_resize_width, img_resize_height)
+        if load_imgs:
+            img_property_set.imgs = list(img_property_set.imgs)
+        img_property_set.img_paths = img_paths
         return img_property_set
+    
+    if execution_mode == "multiprocess":
+        _, features = extract_features_multiprocess(img_paths, seed=seed,
+                                                    img_resize_width=img_resize_width,
+                                                    img_resize_height=img_resize_height,
+                                                    model_family=model_family,
+                                                    model_name=model_name,
+                                                    img_normalization_weight=img_normalization_weight,
+                                                    batch_size=batch_size,
+                                                    inference_backend=inference_backend,
+                                                    inference_options=inference_options,
+                                                    reduced_decode=reduced_decode
+                                                    )
+        imgs = list(LazyThumbnails(img_paths, img_resize_width, img_resize_height)) if load_imgs else None
+        results = [(imgs, features, img_paths)]
     else:
-        extracted_img_path, img_list, feature_list = [], [], []
-        for img_path in tqdm(img_paths, desc="Extracting features from images",
-                             total=len(img_paths)
-                             ):
-            logger.info(f"Single Process Feature extraction for image: {img_path}")
-            img, feature = get_imgs_and_extract_features(img_path=img_path, 
-                                                         img_resize_height=img_resize_height,
-                                                        img_resize_width=img_resize_width,
-                                                        model_family=model_family, 
-                                                        model_name=model_name,
-                                                        img_normalization_weight=img_normalization_weight,
-                                                        seed=seed
-                                                        )
-            img_list.append(img)
-            feature_list.append(feature)
-            extracted_img_path.append(img_path)
+        batch_args = make_batch_args(img_paths, batch_size=batch_size,
+                                     img_resize_width=img_resize_width,
+                                     img_resize_height=img_resize_height,
+                                     model_family=model_family, model_name=model_name,
+                                     img_normalization_weight=img_normalization_weight,
+                                     seed=seed, return_imgs=load_imgs,
+                                     inference_backend=inference_backend,
+                                     inference_options=inference_options,
+                                     reduced_decode=reduced_decode
+                                     )
+        results = []
+        for args in tqdm(batch_args, desc="Extracting features from image batches",
+                         total=len(batch_args)
+                         ):
+            logger.info(f"Single Process Feature extraction for {len(args['img_paths'])} images")
+            results.append(get_imgs_and_extract_features_batch_wrapper(args))
             
-        img_property_set.imgs = img_list
-        img_property_set.features = feature_list
-        img_property_set.img_paths = extracted_img_path
-        return img_property_set
+    extracted_img_path, img_list, feature_batches = [], [], []
+    for imgs, features, paths in results:
+        if load_imgs:
+            img_list.extend(imgs)
+        feature_batches.append(features)
+        extracted_img_path.extend(paths)
+        
+    if not load_imgs:
+        img_list = LazyThumbnails(extracted_img_path, img_resize_width, img_resize_height)
+    img_property_set.imgs = img_list
+    img_property_set.features = (np.concatenate(feature_batches, axis=0)
+                                 if feature_batches else np.empty((0, 0), dtype=np.float32)
+                                 )
+    img_property_set.img_paths = extracted_img_path
+    logger.info(f"num of images: {len(img_property_set.imgs)}")
+    logger.info(f"num of features: {len(img_property_set.features)}")
+    return img_property_set
 
 #%%       
+def extract_features_multiprocess(img_paths, seed=2024, img_resize_width=224,
+                                  img_resize_height=224,
+                                  model_family="efficientnet",
+                                  model_name="EfficientNetB0",
+                                  img_normalization_weight="imagenet",
+                                  batch_size=None, num_processes=None,
+                                  execution_plan=None, probe=False,
+                                  inference_backend="keras", inference_options=None,
+                                  reduced_decode=False
+                                  ) -> Tuple[List, np.ndarray]:
+    from cluster_aware_splitter.parallel_extraction import extract_features_shared_memory
+    img_paths = list(img_paths)
+    featarray = extract_features_shared_memory(img_paths, seed=seed,
+                                               img_resize_width=img_resize_width,
+                                               img_resize_height=img_resize_height,
+                                               model_family=model_family,
+                                               model_name=model_name,
+                                               img_normalization_weight=img_normalization_weight,
+                                               batch_size=batch_size,
+                                               num_processes=num_processes,
+                                               execution_plan=execution_plan,
+                                               probe=probe,
+                                               inference_backend=inference_backend,
+                                               inference_options=inference_options,
+                                               reduced_decode=reduced_decode
+                                               )
+    logger.info("multiprocess of imaged feature extration completed")
+    return img_paths, featarray
+
+
 def run_multiprocess(img_property_set,
                     feature_extractor_class = None,
                     seed=2024, img_resize_width=224,
@@ -384,59 +889,139 @@ def run_multiprocess(img_property_set,
                     model_family="efficientnet",
                     model_name="EfficientNetB0",
                     img_normalization_weight="imagenet",
+                    batch_size=None,
+                    feature_store=None,
+                    clustering_backend=None,
+                    num_processes=None,
+                    probe=False,
+                    instrumentation=None,
+                    metrics_path=None,
+                    reducer=None,
+                    n_components=128,
+                    inference_backend="keras",
+                    inference_options=None,
+                    reduced_decode=False,
+                    cluster_model_dir=None
                     ):
+    # keep whatever instrumentation is already active unless one is passed in;
+    # a metrics_path on its own turns instrumentation on for this run
+    instrumentation = resolve_instrumentation(instrumentation, metrics_path)
+    previous_instrumentation = set_instrumentation(instrumentation)
+    try:
+        return _run_multiprocess(img_property_set, seed=seed, img_resize_width=img_resize_width,
+                                 img_resize_height=img_resize_height,
+                                 model_family=model_family, model_name=model_name,
+                                 img_normalization_weight=img_normalization_weight,
+                                 batch_size=batch_size, feature_store=feature_store,
+                                 clustering_backend=clustering_backend,
+                                 num_processes=num_processes, probe=probe,
+                                 reducer=reducer, n_components=n_components,
+                                 inference_backend=inference_backend,
+                                 inference_options=inference_options,
+                                 reduced_decode=reduced_decode,
+                                 cluster_model_dir=cluster_model_dir
+                                 )
+    finally:
+        instrumentation.report(metrics_path)
+        set_instrumentation(previous_instrumentation)
+
+
+def _run_multiprocess(img_property_set, seed, img_resize_width, img_resize_height,
+                      model_family, model_name, img_normalization_weight,
+                      batch_size, feature_store, clustering_backend,
+                      num_processes, probe, reducer=None, n_components=128,
+                      inference_backend="keras", inference_options=None,
+                      reduced_decode=False, cluster_model_dir=None
+                      ) -> pd.DataFrame:
     img_paths = sorted(img_property_set.img_paths)
-    args = [{"img_path": img_path, "img_resize_width": img_resize_width,
-                 "img_resize_height": img_resize_height, "model_family": model_family,
-                 "model_name":model_name, 
-                 "img_normalization_weight": img_normalization_weight,
-                 "seed": seed, "return_img_path": True
-                 } for img_path in img_paths
-                ]
-    chunksize = max(1, len(args) // 10)
-    num_processes = multiprocessing.cpu_count()
-    from tqdm import tqdm
-    with multiprocessing.Pool(num_processes) as p:
-        results = list(
-                    tqdm(
-                        p.imap_unordered(
-                            get_imgs_and_extract_features_wrapper, args, chunksize=chunksize
-                        ),
-                        total=len(img_paths),
-                    )
-                )
-    print("multiprocess of imaged feature extration completed")
-    images_read = []
-    features = []
-    image_names = []
-    print(f"started clustering")
-    for res in results:
-        images_read.append(res[0])
-        features.append(res[1])
-        image_names.append(os.path.basename(res[2]))
-    featarray = np.array(features)
-    ce = clusteval()
-    cluster_results = ce.fit(featarray)
-    clusters = cluster_results["labx"]
+    extraction_kwargs = dict(seed=seed, img_resize_width=img_resize_width,
+                             img_resize_height=img_resize_height,
+                             model_family=model_family, model_name=model_name,
+                             img_normalization_weight=img_normalization_weight,
+                             batch_size=batch_size, num_processes=num_processes,
+                             probe=probe, inference_backend=inference_backend,
+                             inference_options=inference_options,
+                             reduced_decode=reduced_decode
+                             )
+    if feature_store is not None:
+        feature_store.check_model_config(get_model_config(model_family=model_family, model_name=model_name,
+                                                          img_resize_width=img_resize_width,
+                                                          img_resize_height=img_resize_height,
+                                                          img_normalization_weight=img_normalization_weight
+                                                          ))
+        featarray = feature_store.get_or_extract(img_paths,
+                                                 lambda missing_paths: extract_features_multiprocess(missing_paths,
+                                                                                                     **extraction_kwargs
+                                                                                                     )
+                                                 )
+        extracted_img_paths = img_paths
+    else:
+        extracted_img_paths, featarray = extract_features_multiprocess(img_paths, **extraction_kwargs)
+    image_names = [os.path.basename(img_path) for img_path in extracted_img_paths]
+    logger.info("started clustering")
+    clustering_backend = get_clustering_backend(clustering_backend,
+                                                max_num_clusters=img_property_set.max_num_clusters
+                                                )
+    clustering_featarray = reduce_features(featarray, reducer=reducer, n_components=n_components, seed=seed)
+    with get_instrumentation().stage("clustering"):
+        clusters = clustering_backend.fit_predict(clustering_featarray)
+    if cluster_model_dir:
+        save_cluster_model(featarray, clusters, cluster_model_dir,
+                           config={"model_family": model_family, "model_name": model_name,
+                                   "img_resize_width": img_resize_width,
+                                   "img_resize_height": img_resize_height,
+                                   "img_normalization_weight": img_normalization_weight,
+                                   "reducer": reducer if isinstance(reducer, str) else None,
+                                   }
+                           )
     imgcluster_dict = {"image_names":image_names, "clusters": clusters}
     imgclust_df = pd.DataFrame.from_dict(imgcluster_dict)
-    print("completed clustering")
+    logger.info("completed clustering")
     return imgclust_df
 
 
-def cluster_features(img_property_set) -> pd.DataFrame:
-    ce = clusteval()
-    featarray = np.array(img_property_set.features)
-    cluster_results = ce.fit(featarray)
-    clusters = cluster_results["labx"]
+def reduce_features(featarray, reducer=None, n_components=128, seed=2024) -> np.ndarray:
+    """Fit reducer ("pca", "random_projection" or a FeatureReducer) on featarray
+    in chunks and return the projected features; featarray unchanged if None."""
+    reducer = get_reducer(reducer, n_components=n_components, seed=seed)
+    if reducer is None:
+        return featarray
+    with get_instrumentation().stage("dimensionality_reduction"):
+        return reducer.fit_transform(featarray)
+
+
+def save_cluster_model(featarray, clusters, cluster_model_dir, config=None) -> ClusterModel:
+    """Persist centroids of clusters in the unreduced feature space, so new
+    images can be labelled with ClusterModel.assign_clusters on raw features."""
+    cluster_model = ClusterModel.from_labels(featarray, clusters, config=config)
+    cluster_model.save(cluster_model_dir)
+    return cluster_model
+
+
+def cluster_features(img_property_set, clustering_backend=None, reducer=None,
+                     n_components=128, cluster_model_dir=None
+                     ) -> pd.DataFrame:
+    clustering_backend = get_clustering_backend(clustering_backend,
+                                                max_num_clusters=img_property_set.max_num_clusters
+                                                )
+    featarray = np.asarray(img_property_set.features)
+    clustering_featarray = reduce_features(featarray, reducer=reducer, n_components=n_components)
+    with get_instrumentation().stage("clustering"):
+        clusters = clustering_backend.fit_predict(clustering_featarray)
+    if cluster_model_dir:
+        save_cluster_model(featarray, clusters, cluster_model_dir,
+                           config={"reducer": reducer if isinstance(reducer, str) else None}
+                           )
     imgcluster_dict = {"image_names":img_property_set.img_paths, 
                        "clusters": clusters
                        }
     imgclust_df = pd.DataFrame.from_dict(imgcluster_dict)
-    print("completed clustering")
+    logger.info("completed clustering")
     return imgclust_df
 #%%
 if __name__ == '__main__':
+    from clusteval import clusteval
+    from pycocotools.coco import COCO
     img_dir = "field_crop_with_disease"
     img_dir = "/home/lin/codebase/__cv_with_roboflow_data/field_crop_with_disease"
     img_paths_list = sorted(glob(f"{img_dir}/*"))
@@ -471,6 +1056,7 @@ if __name__ == '__main__':
                             model_family="efficientnet",
                             model_name="EfficientNetB0",
                             img_normalization_weight="imagenet",
+                            img_path=img
                             )
         obj_featlist.append(features)
         
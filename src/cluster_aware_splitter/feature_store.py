@@ -0,0 +1,248 @@
+import os
+import json
+import hashlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from cluster_aware_splitter import logger
+from cluster_aware_splitter.compression import (FEATURE_DTYPES, dequantize_features,
+                                                quantize_features
+                                                )
+
+
+def get_model_config(model_family="efficientnet", model_name="EfficientNetB0",
+                     img_resize_width=224, img_resize_height=224,
+                     img_normalization_weight="imagenet", **kwargs
+                     ) -> Dict:
+    model_config = {"model_family": model_family, "model_name": model_name,
+                    "img_resize_width": img_resize_width,
+                    "img_resize_height": img_resize_height,
+                    "img_normalization_weight": img_normalization_weight,
+                    }
+    model_config.update(kwargs)
+    return model_config
+
+
+def hash_file_content(path, chunk_size=1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FeatureStore(object):
+    """On-disk feature matrix keyed by image content hash and model config.
+
+    Features are kept in append-only chunk files ``features_{k}.npy`` that are
+    opened memory-mapped, with ``index.json`` mapping content hashes to rows
+    and recording where each chunk starts. Adding rows writes one new chunk
+    and never rewrites the existing ones. Files whose size and mtime are
+    unchanged are not rehashed.
+
+    ``feature_dtype`` of float16 or int8 shrinks the matrix 2x or 4x; int8
+    rows are stored with per-row scales in ``scales_{k}.npy`` and dequantized
+    by ``load_features``.
+    """
+    def __init__(self, store_dir, model_config: Dict, feature_dtype="float32"):
+        if feature_dtype not in FEATURE_DTYPES:
+            raise ValueError(f"feature_dtype must be one of {FEATURE_DTYPES}, got {feature_dtype}")
+        self.model_config = model_config
+        self.feature_dtype = feature_dtype
+        key_config = dict(model_config)
+        if feature_dtype != "float32":
+            key_config["feature_dtype"] = feature_dtype
+        config_str = json.dumps(key_config, sort_keys=True, default=str)
+        self.config_key = hashlib.blake2b(config_str.encode(), digest_size=8).hexdigest()
+        self.store_dir = Path(store_dir) / self.config_key
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.store_dir / "index.json"
+        self._load_index()
+
+    def get_chunk_path(self, chunk, prefix="features") -> Path:
+        return self.store_dir / f"{prefix}_{chunk:05d}.npy"
+
+    def _load_index(self):
+        if self.index_path.exists():
+            with open(self.index_path, "r") as fp:
+                index = json.load(fp)
+        else:
+            index = {"model_config": self.model_config, "hashes": [],
+                     "paths": [], "stat_cache": {}, "chunk_offsets": [0]
+                     }
+        self.hashes: List[str] = index["hashes"]
+        self.paths: List[str] = index["paths"]
+        self.stat_cache: Dict[str, List] = index["stat_cache"]
+        self.chunk_offsets: List[int] = index.get("chunk_offsets") or self._migrate_single_file()
+        self.hash_to_row = {content_hash: row for row, content_hash in enumerate(self.hashes)}
+
+    def _migrate_single_file(self) -> List[int]:
+        # stores written before chunking kept everything in features.npy/scales.npy
+        for prefix in ("features", "scales"):
+            legacy_path = self.store_dir / f"{prefix}.npy"
+            if legacy_path.exists():
+                os.replace(legacy_path, self.get_chunk_path(0, prefix=prefix))
+        return [0, len(self.hashes)] if self.hashes else [0]
+
+    def _save_index(self):
+        index = {"model_config": self.model_config, "hashes": self.hashes,
+                 "paths": self.paths, "stat_cache": self.stat_cache,
+                 "chunk_offsets": self.chunk_offsets
+                 }
+        tmp_path = self.index_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w") as fp:
+            json.dump(index, fp)
+        os.replace(tmp_path, self.index_path)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, img_path):
+        return self.hash_file(img_path) in self.hash_to_row
+
+    @property
+    def num_chunks(self) -> int:
+        return len(self.chunk_offsets) - 1
+
+    def _load_chunk(self, chunk, prefix="features") -> np.ndarray:
+        return np.load(self.get_chunk_path(chunk, prefix=prefix), mmap_mode="r")
+
+    @property
+    def features(self) -> np.ndarray:
+        """The whole matrix; a memmap when the store has a single chunk,
+        otherwise the chunks concatenated in memory."""
+        if not self.num_chunks:
+            return np.empty((0, 0), dtype=self.feature_dtype)
+        if self.num_chunks == 1:
+            return self._load_chunk(0)
+        return np.concatenate([self._load_chunk(chunk) for chunk in range(self.num_chunks)])
+
+    @property
+    def scales(self) -> Optional[np.ndarray]:
+        if self.feature_dtype != "int8" or not self.num_chunks:
+            return None
+        return np.concatenate([self._load_chunk(chunk, prefix="scales")
+                               for chunk in range(self.num_chunks)
+                               ])
+
+    @property
+    def feature_dim(self) -> Optional[int]:
+        return self._load_chunk(0).shape[1] if self.num_chunks else None
+
+    def check_model_config(self, model_config: Dict):
+        """Raise if model_config disagrees with the config the store was opened
+        with on any key the store records."""
+        mismatched = {key: (self.model_config[key], value) for key, value in model_config.items()
+                      if key in self.model_config and self.model_config[key] != value
+                      }
+        if mismatched:
+            details = ", ".join(f"{key}: store has {stored!r}, run uses {value!r}"
+                                for key, (stored, value) in sorted(mismatched.items())
+                                )
+            raise ValueError(f"Feature store {self.store_dir} was built for a different model ({details})")
+
+    def hash_file(self, img_path) -> str:
+        img_path = str(img_path)
+        stat = os.stat(img_path)
+        cached = self.stat_cache.get(img_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        content_hash = hash_file_content(img_path)
+        self.stat_cache[img_path] = [stat.st_size, stat.st_mtime_ns, content_hash]
+        return content_hash
+
+    def missing(self, img_paths) -> List[str]:
+        missing_paths, seen = [], set()
+        for img_path in img_paths:
+            content_hash = self.hash_file(img_path)
+            if content_hash not in self.hash_to_row and content_hash not in seen:
+                missing_paths.append(img_path)
+                seen.add(content_hash)
+        return missing_paths
+
+    def _write_chunk(self, chunk, data, prefix="features"):
+        tmp_path = self.store_dir / f"{prefix}.tmp.npy"
+        np.save(tmp_path, data)
+        os.replace(tmp_path, self.get_chunk_path(chunk, prefix=prefix))
+
+    def add(self, img_paths, features):
+        features = np.asarray(features, dtype=np.float32)
+        if len(img_paths) != len(features):
+            raise ValueError(f"Got {len(img_paths)} paths but {len(features)} feature rows")
+        new_hashes, new_paths, new_rows = [], [], []
+        seen = set()
+        for row, img_path in enumerate(img_paths):
+            content_hash = self.hash_file(img_path)
+            if content_hash in self.hash_to_row or content_hash in seen:
+                continue
+            seen.add(content_hash)
+            new_hashes.append(content_hash)
+            new_paths.append(str(img_path))
+            new_rows.append(row)
+        if not new_rows:
+            self._save_index()
+            return
+        new_features, new_scales = quantize_features(features[new_rows], self.feature_dtype)
+        feature_dim = self.feature_dim
+        if feature_dim is not None and feature_dim != new_features.shape[1]:
+            raise ValueError(f"Feature dimension {new_features.shape[1]} does not match "
+                             f"store dimension {feature_dim}"
+                             )
+        # the chunk files land before the index references them, so an
+        # interrupted add leaves an unreferenced chunk that the next add overwrites
+        chunk = self.num_chunks
+        self._write_chunk(chunk, new_features)
+        if new_scales is not None:
+            self._write_chunk(chunk, new_scales, prefix="scales")
+
+        for content_hash, img_path in zip(new_hashes, new_paths):
+            self.hash_to_row[content_hash] = len(self.hashes)
+            self.hashes.append(content_hash)
+            self.paths.append(img_path)
+        self.chunk_offsets.append(len(self.hashes))
+        self._save_index()
+        logger.info(f"Added {len(new_rows)} feature rows to {self.get_chunk_path(chunk)}, "
+                    f"total {len(self.hashes)} in {self.num_chunks} chunks"
+                    )
+
+    def get_rows(self, img_paths) -> np.ndarray:
+        return np.array([self.hash_to_row[self.hash_file(img_path)] for img_path in img_paths],
+                        dtype=np.int64
+                        )
+
+    def _gather(self, rows, prefix="features") -> np.ndarray:
+        chunk_ids = np.searchsorted(self.chunk_offsets, rows, side="right") - 1
+        gathered = None
+        for chunk in np.unique(chunk_ids):
+            chunk_data = self._load_chunk(int(chunk), prefix=prefix)
+            if gathered is None:
+                gathered = np.empty((len(rows),) + chunk_data.shape[1:], dtype=chunk_data.dtype)
+            mask = chunk_ids == chunk
+            gathered[mask] = chunk_data[rows[mask] - self.chunk_offsets[chunk]]
+        return gathered
+
+    def load_features(self, img_paths) -> np.ndarray:
+        """Features for img_paths in order; a zero-copy mmap view when rows are
+        contiguous within one chunk and the store is not int8."""
+        rows = self.get_rows(img_paths)
+        if not len(rows):
+            dtype = np.float32 if self.feature_dtype == "int8" else self.feature_dtype
+            return np.empty((0, self.feature_dim or 0), dtype=dtype)
+        if self.feature_dtype == "int8":
+            return dequantize_features(self._gather(rows), self._gather(rows, prefix="scales"))
+        chunk = int(np.searchsorted(self.chunk_offsets, rows[0], side="right") - 1)
+        start = rows[0] - self.chunk_offsets[chunk]
+        if (rows[-1] < self.chunk_offsets[chunk + 1]
+                and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows)))):
+            return self._load_chunk(chunk)[start:start + len(rows)]
+        return self._gather(rows)
+
+    def get_or_extract(self, img_paths, extract_fn: Callable) -> np.ndarray:
+        missing_paths = self.missing(img_paths)
+        logger.info(f"{len(img_paths) - len(missing_paths)} of {len(img_paths)} images found in feature store")
+        if missing_paths:
+            extracted_paths, features = extract_fn(missing_paths)
+            self.add(extracted_paths, features)
+        else:
+            self._save_index()
+        return self.load_features(img_paths)
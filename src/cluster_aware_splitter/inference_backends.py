@@ -0,0 +1,299 @@
+import os
+import time
+import json
+import shutil
+import hashlib
+import weakref
+import tempfile
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from cluster_aware_splitter import logger
+from cluster_aware_splitter.feat import tf
+
+INFERENCE_BACKENDS = ("keras", "tf_function", "saved_model", "tflite", "auto")
+DEFAULT_AUTO_CANDIDATES = ("keras", "tf_function", "tflite")
+# backends that are written to disk once and loaded by every process using them
+EXPORTED_BACKENDS = ("saved_model", "tflite")
+
+
+class InferenceBackend(object):
+    """Callable wrapper around the backbone+GAP feature extractor.
+
+    Backends take a preprocessed (N, H, W, C) float32 batch and return an
+    (N, D) float32 array. They keep the ``model(x, training=False)`` call
+    signature and ``output_shape`` of the Keras model they replace.
+    """
+    name = None
+
+    def __init__(self, output_dim):
+        self.output_dim = int(output_dim)
+
+    @property
+    def output_shape(self) -> Tuple:
+        return (None, self.output_dim)
+
+    def predict_batch(self, x) -> np.ndarray:
+        raise NotImplementedError
+
+    def __call__(self, x, training=False) -> np.ndarray:
+        return self.predict_batch(x)
+
+
+class KerasBackend(InferenceBackend):
+    name = "keras"
+
+    def __init__(self, model):
+        super().__init__(model.output_shape[-1])
+        self.model = model
+
+    def predict_batch(self, x) -> np.ndarray:
+        return np.asarray(self.model(x, training=False), dtype=np.float32)
+
+
+def _make_serving_function(model, input_shape, jit_compile=True):
+    return tf.function(lambda x: model(x, training=False), jit_compile=jit_compile,
+                       input_signature=[tf.TensorSpec((None,) + tuple(input_shape), tf.float32)]
+                       )
+
+
+class TFFunctionBackend(InferenceBackend):
+    """The Keras model traced once into a graph, XLA-compiled when jit_compile."""
+    name = "tf_function"
+
+    def __init__(self, model, input_shape, jit_compile=True):
+        super().__init__(model.output_shape[-1])
+        self._fn = _make_serving_function(model, input_shape, jit_compile=jit_compile)
+
+    def predict_batch(self, x) -> np.ndarray:
+        return self._fn(tf.convert_to_tensor(x, dtype=tf.float32)).numpy()
+
+
+class SavedModelBackend(InferenceBackend):
+    name = "saved_model"
+
+    def __init__(self, export_dir):
+        self.loaded = tf.saved_model.load(export_dir)
+        self._fn = self.loaded.serve
+        super().__init__(self._fn.get_concrete_function().structured_outputs.shape[-1])
+
+    @staticmethod
+    def export(model, input_shape, export_dir, jit_compile=True) -> str:
+        """Save model with a ``serve`` signature; an existing export is reused."""
+        if os.path.exists(os.path.join(export_dir, "saved_model.pb")):
+            return export_dir
+        module = tf.Module()
+        module.model = model
+        module.serve = _make_serving_function(model, input_shape, jit_compile=jit_compile)
+        # export next to the target and rename so concurrent workers never
+        # load a half-written model
+        tmp_dir = tempfile.mkdtemp(prefix=".saved_model_", dir=os.path.dirname(os.path.abspath(export_dir)))
+        tf.saved_model.save(module, tmp_dir, signatures={"serving_default": module.serve})
+        try:
+            os.replace(tmp_dir, export_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return export_dir
+
+    def predict_batch(self, x) -> np.ndarray:
+        return self._fn(tf.convert_to_tensor(x, dtype=tf.float32)).numpy()
+
+
+class TFLiteBackend(InferenceBackend):
+    """TFLite interpreter; the input tensor is resized whenever the batch shape changes."""
+    name = "tflite"
+
+    def __init__(self, model_path, num_threads=None):
+        self.model_path = model_path
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._input_shape = tuple(self._input["shape"])
+        super().__init__(self._output["shape"][-1])
+
+    @staticmethod
+    def export(model, model_path, quantize=None) -> str:
+        """Convert model to TFLite, with dynamic-range int8 weights when quantize="dynamic"."""
+        if os.path.exists(model_path):
+            return model_path
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        if quantize == "dynamic":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        elif quantize is not None:
+            raise ValueError(f"quantize must be None or dynamic, got {quantize}")
+        tmp_path = f"{model_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(converter.convert())
+        os.replace(tmp_path, model_path)
+        return model_path
+
+    def predict_batch(self, x) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float32)
+        if x.shape != self._input_shape:
+            self.interpreter.resize_tensor_input(self._input["index"], x.shape)
+            self.interpreter.allocate_tensors()
+            self._input_shape = x.shape
+        self.interpreter.set_tensor(self._input["index"], x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output["index"]).copy()
+
+
+def get_export_fingerprint(model, input_shape, **export_options) -> str:
+    """Hash of everything an export depends on: input shape, export options,
+    and the model's weight shapes and values (which also tell architectures
+    and weight files apart)."""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(json.dumps({"input_shape": list(input_shape), "export_options": export_options},
+                             sort_keys=True, default=str
+                             ).encode())
+    for weight in model.weights:
+        value = np.ascontiguousarray(weight.numpy())
+        digest.update(str(value.shape).encode())
+        digest.update(value.tobytes())
+    return digest.hexdigest()
+
+
+def _random_inputs(input_shape, batch_size=1, seed=2024) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.uniform(0, 255, size=(batch_size,) + tuple(input_shape)).astype(np.float32)
+
+
+def build_inference_backend(inference_backend, model, input_shape, export_dir=None,
+                            jit_compile=True, quantize=None, num_threads=None,
+                            verify_parity=True, min_cosine=0.999
+                            ) -> InferenceBackend:
+    """Wrap or export model for inference_backend.
+
+    Exports go to a subdirectory of export_dir named after
+    get_export_fingerprint, so an export is only reused for the same model,
+    input shape and options. Without export_dir they go to a temporary
+    directory that is removed once the returned backend is garbage collected.
+    With verify_parity an exported backend must match Keras on a random batch
+    (by cosine similarity, plus atol=1e-3 when not quantized) or ValueError
+    is raised.
+    """
+    if inference_backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"inference_backend must be one of {INFERENCE_BACKENDS}, got {inference_backend}")
+    if inference_backend == "keras":
+        return KerasBackend(model)
+    elif inference_backend == "tf_function":
+        return TFFunctionBackend(model, input_shape, jit_compile=jit_compile)
+    elif inference_backend == "auto":
+        return select_fastest_backend(model, input_shape, export_dir=export_dir,
+                                      quantize=quantize, num_threads=num_threads
+                                      )[0]
+    tmp_export_dir = None
+    if not export_dir:
+        export_dir = tmp_export_dir = tempfile.mkdtemp(prefix="cluster_aware_splitter_export_")
+    os.makedirs(export_dir, exist_ok=True)
+    try:
+        if inference_backend == "saved_model":
+            fingerprint = get_export_fingerprint(model, input_shape, jit_compile=jit_compile)
+            backend = SavedModelBackend(SavedModelBackend.export(model, input_shape,
+                                                                 os.path.join(export_dir, f"{model.name}_{fingerprint}"),
+                                                                 jit_compile=jit_compile
+                                                                 ))
+        else:
+            fingerprint = get_export_fingerprint(model, input_shape, quantize=quantize)
+            model_path = TFLiteBackend.export(model, os.path.join(export_dir, f"{model.name}_{fingerprint}.tflite"),
+                                              quantize=quantize
+                                              )
+            backend = TFLiteBackend(model_path, num_threads=num_threads)
+        if verify_parity:
+            parity = check_parity(KerasBackend(model), backend, _random_inputs(input_shape),
+                                  atol=None if quantize else 1e-3, min_cosine=min_cosine
+                                  )
+            if not parity["passed"]:
+                raise ValueError(f"{inference_backend} export does not match the Keras model: {parity}")
+    except Exception:
+        if tmp_export_dir:
+            shutil.rmtree(tmp_export_dir, ignore_errors=True)
+        raise
+    if tmp_export_dir:
+        weakref.finalize(backend, shutil.rmtree, tmp_export_dir, True)
+    return backend
+
+
+def prepare_inference_backend(inference_backend, model, input_shape, export_dir,
+                              jit_compile=True, quantize=None, num_threads=None
+                              ) -> str:
+    """Resolve "auto" and write any export to export_dir once, ahead of a pool.
+
+    Returns the concrete backend name. Workers calling build_inference_backend
+    with that name and the same options then only load the export, so they
+    never race on export_dir or disagree on the backend.
+    """
+    if inference_backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"inference_backend must be one of {INFERENCE_BACKENDS}, got {inference_backend}")
+    if inference_backend == "auto":
+        return select_fastest_backend(model, input_shape, export_dir=export_dir,
+                                      quantize=quantize, num_threads=num_threads
+                                      )[0].name
+    if inference_backend in EXPORTED_BACKENDS:
+        build_inference_backend(inference_backend, model, input_shape, export_dir=export_dir,
+                                jit_compile=jit_compile, quantize=quantize,
+                                num_threads=num_threads
+                                )
+    return inference_backend
+
+
+def check_parity(reference: InferenceBackend, candidate: InferenceBackend, x,
+                 atol=1e-3, min_cosine=0.999
+                 ) -> Dict:
+    """Compare candidate to reference on batch x. Quantized backends usually need
+    atol=None and a cosine threshold instead."""
+    expected = reference(x)
+    actual = candidate(x)
+    max_abs_error = float(np.abs(expected - actual).max())
+    cosine = (expected * actual).sum(axis=1) / np.maximum(np.linalg.norm(expected, axis=1)
+                                                           * np.linalg.norm(actual, axis=1), 1e-12
+                                                           )
+    min_cosine_similarity = float(cosine.min())
+    passed = min_cosine_similarity >= min_cosine and (atol is None or max_abs_error <= atol)
+    return {"backend": candidate.name, "max_abs_error": max_abs_error,
+            "min_cosine_similarity": min_cosine_similarity, "passed": passed
+            }
+
+
+def time_backend(backend: InferenceBackend, x, num_runs=10, num_warmup=2) -> float:
+    """Median seconds per call; warmup runs absorb tracing and compilation."""
+    for _ in range(num_warmup):
+        backend(x)
+    durations = []
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        backend(x)
+        durations.append(time.perf_counter() - start)
+    return float(np.median(durations))
+
+
+def select_fastest_backend(model, input_shape, candidates=DEFAULT_AUTO_CANDIDATES,
+                           batch_size=1, num_runs=10, export_dir=None, quantize=None,
+                           num_threads=None, atol=None, min_cosine=0.999,
+                           sample_inputs=None, seed=2024
+                           ) -> Tuple[InferenceBackend, List[Dict]]:
+    """Build each candidate, drop those that fail to build or fail the parity
+    check against Keras, and return the fastest with a per-candidate report."""
+    if sample_inputs is None:
+        sample_inputs = _random_inputs(input_shape, batch_size=batch_size, seed=seed)
+    reference = KerasBackend(model)
+    report, best, best_seconds = [], reference, None
+    for name in candidates:
+        try:
+            backend = reference if name == "keras" else build_inference_backend(name, model, input_shape,
+                                                                                export_dir=export_dir,
+                                                                                quantize=quantize,
+                                                                                num_threads=num_threads,
+                                                                                verify_parity=False
+                                                                                )
+        except Exception as error:
+            logger.warning(f"Skipping {name} inference backend: {error!r}")
+            report.append({"backend": name, "error": repr(error)})
+            continue
+        entry = check_parity(reference, backend, sample_inputs, atol=atol, min_cosine=min_cosine)
+        entry["seconds_per_batch"] = time_backend(backend, sample_inputs, num_runs=num_runs)
+        report.append(entry)
+        if entry["passed"] and (best_seconds is None or entry["seconds_per_batch"] < best_seconds):
+            best, best_seconds = backend, entry["seconds_per_batch"]
+    logger.info(f"Selected {best.name} inference backend: {report}")
+    return best, report
@@ -0,0 +1,204 @@
+import os
+import time
+import bisect
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from cluster_aware_splitter import logger
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+                   )
+
+
+class Histogram(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, state: Dict):
+        for i, count in enumerate(state["counts"]):
+            self.counts[i] += count
+        self.sum += state["sum"]
+        self.count += state["count"]
+
+    def state(self) -> Dict:
+        return {"counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+
+class _Stage(object):
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation(object):
+    """Per-stage duration histograms and counters for one pipeline run.
+
+    Use ``with instrumentation.stage("decode"):`` around a stage and
+    ``increment("images_processed", n)`` for counters. Callbacks receive
+    ``(stage_name, seconds)`` for every observation.
+    """
+    enabled = True
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, callbacks: Optional[List[Callable]] = None):
+        self.buckets = tuple(buckets)
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = defaultdict(float)
+        self.callbacks = list(callbacks or [])
+        self.start_time = time.time()
+
+    def stage(self, name) -> _Stage:
+        return _Stage(self, name)
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        for callback in self.callbacks:
+            callback(name, seconds)
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+
+    def add_callback(self, callback: Callable):
+        self.callbacks.append(callback)
+
+    def state(self) -> Dict:
+        return {"histograms": {name: histogram.state() for name, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+                }
+
+    def pop_state(self) -> Dict:
+        """Return and reset the recorded state, e.g. to ship a worker's metrics to the parent."""
+        state = self.state()
+        self.histograms = {}
+        self.counters = defaultdict(float)
+        return state
+
+    def merge(self, state: Optional[Dict]):
+        if not state:
+            return
+        for name, histogram_state in state["histograms"].items():
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(self.buckets)
+            self.histograms[name].merge(histogram_state)
+        for name, value in state["counters"].items():
+            self.counters[name] += value
+
+    def summary(self) -> Dict:
+        elapsed = time.time() - self.start_time
+        stages = {name: {"count": histogram.count, "total_seconds": histogram.sum,
+                         "mean_seconds": histogram.sum / histogram.count if histogram.count else 0.0
+                         }
+                  for name, histogram in self.histograms.items()
+                  }
+        summary = {"elapsed_seconds": elapsed, "stages": stages, "counters": dict(self.counters)}
+        if self.counters.get("images_processed") and elapsed:
+            summary["images_per_sec"] = self.counters["images_processed"] / elapsed
+        return summary
+
+    def to_prometheus(self, prefix="cluster_aware_splitter") -> str:
+        lines = [f"# TYPE {prefix}_stage_duration_seconds histogram"]
+        for name, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bucket, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="{bucket}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{name}"}} {histogram.sum}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{name}"}} {histogram.count}')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_textfile(self, path, prefix="cluster_aware_splitter"):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as fp:
+            fp.write(self.to_prometheus(prefix=prefix))
+        os.replace(tmp_path, path)
+
+    def report(self, metrics_path=None):
+        logger.info(f"Pipeline metrics: {self.summary()}")
+        if metrics_path:
+            self.write_prometheus_textfile(metrics_path)
+            logger.info(f"Wrote pipeline metrics to {metrics_path}")
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullInstrumentation(Instrumentation):
+    """Disabled instrumentation: every call is a no-op."""
+    enabled = False
+    _null_stage = _NullStage()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def observe(self, name, seconds):
+        pass
+
+    def increment(self, name, value=1):
+        pass
+
+    def report(self, metrics_path=None):
+        pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+# process-local active instrumentation, read by the extraction code so that it
+# does not have to be threaded through every call
+_ACTIVE_INSTRUMENTATION = [NULL_INSTRUMENTATION]
+
+
+def get_instrumentation() -> Instrumentation:
+    return _ACTIVE_INSTRUMENTATION[0]
+
+
+def set_instrumentation(instrumentation: Optional[Instrumentation]) -> Instrumentation:
+    previous = _ACTIVE_INSTRUMENTATION[0]
+    _ACTIVE_INSTRUMENTATION[0] = instrumentation or NULL_INSTRUMENTATION
+    return previous
+
+
+def resolve_instrumentation(instrumentation: Optional[Instrumentation] = None,
+                            metrics_path=None
+                            ) -> Instrumentation:
+    """The instrumentation a pipeline entry point should use.
+
+    An explicit instrumentation wins, then the active one. A new
+    Instrumentation is created when metrics_path is given but neither is
+    enabled, so asking for a metrics file always produces one.
+    """
+    if instrumentation is not None:
+        return instrumentation
+    if get_instrumentation().enabled or not metrics_path:
+        return get_instrumentation()
+    return Instrumentation()
@@ -0,0 +1,36 @@
+import importlib
+import types
+from typing import Callable, Optional
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy that imports the real module on first attribute access."""
+    def __init__(self, name, on_import: Optional[Callable] = None):
+        super().__init__(name)
+        self.__dict__["_on_import"] = on_import
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            # cache only after on_import succeeds so a failing hook is not
+            # silently skipped on every later access
+            on_import = self.__dict__["_on_import"]
+            if on_import is not None:
+                on_import(module)
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __reduce__(self):
+        return (lazy_import, (self.__name__, self.__dict__["_on_import"]))
+
+
+def lazy_import(name, on_import: Optional[Callable] = None) -> LazyModule:
+    return LazyModule(name, on_import=on_import)
@@ -1,60 +1,8 @@
 
 #%%
-from tqdm import tqdm
-import multiprocessing
-from .feat import get_imgs_and_extract_features_wrapper, ImgPropertySetReturnType
-import numpy as np
-from clusteval import clusteval
 import os
-import pandas as pd
 from glob import glob
-
-def run_multiprocess(img_property_set,
-                    feature_extractor_class = None,
-                    seed=2024, img_resize_width=224,
-                    img_resize_height=224,
-                    model_family="efficientnet",
-                    model_name="EfficientNetB0",
-                    img_normalization_weight="imagenet",
-                    ):
-    img_paths = sorted(img_property_set.img_paths)
-    args = [{"img_path": img_path, "img_resize_width": img_resize_width,
-                 "img_resize_height": img_resize_height, "model_family": model_family,
-                 "model_name":model_name, 
-                 "img_normalization_weight": img_normalization_weight,
-                 "seed": seed, "return_img_path": True
-                 } for img_path in img_paths
-                ]
-    
-    num_processes = multiprocessing.cpu_count()
-    chunksize = max(1, len(args) // num_processes)
-    from tqdm import tqdm
-    with multiprocessing.Pool(num_processes) as p:
-        results = list(
-                    tqdm(
-                        p.imap_unordered(get_imgs_and_extract_features_wrapper, 
-                                         args, chunksize=chunksize
-                                        ),
-                        total=len(img_paths),
-                    )
-                )
-    print("multiprocess of imaged feature extration completed")
-    images_read = []
-    features = []
-    image_names = []
-    print(f"started clustering")
-    for res in results:
-        images_read.append(res[0])
-        features.append(res[1])
-        image_names.append(os.path.basename(res[2]))
-    featarray = np.array(features)
-    ce = clusteval()
-    cluster_results = ce.fit(featarray)
-    clusters = cluster_results["labx"]
-    imgcluster_dict = {"image_names":image_names, "clusters": clusters}
-    imgclust_df = pd.DataFrame.from_dict(imgcluster_dict)
-    print("completed clustering")
-    return imgclust_df
+from .feat import ImgPropertySetReturnType, run_multiprocess
 
 #%%
 if __name__ == '__main__':
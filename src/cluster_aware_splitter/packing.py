@@ -0,0 +1,150 @@
+"""Pack many small images into large sequential tar shards and stream them back.
+
+Each image is stored as ``<key>.<ext>`` followed by ``<key>.json`` with its
+original path, file name and (optionally) its COCO image record and
+annotations. Shards are plain uncompressed tar files, readable with any tar
+tool, and an ``index.json`` lists the shards and their image counts::
+
+    python -m cluster_aware_splitter.packing pack --img-dir imgs --output-dir packed \\
+        --coco-annotation annotations.json --shard-size-mb 1024
+"""
+import io
+import os
+import json
+import tarfile
+import argparse
+from glob import glob
+from typing import Dict, Iterator, List, Optional, Tuple
+from cluster_aware_splitter import logger
+from cluster_aware_splitter.coco_index import load_coco_index
+
+PACKED_INDEX_NAME = "index.json"
+
+
+def get_packed_shard_path(output_dir, shard_index, prefix="images") -> str:
+    return os.path.join(output_dir, f"{prefix}_{shard_index:05d}.tar")
+
+
+def _add_bytes(tar, name, data: bytes, mtime=0):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = mtime
+    tar.addfile(info, io.BytesIO(data))
+
+
+def pack_images(img_paths, output_dir, shard_size_bytes=1 << 30, max_images_per_shard=None,
+                coco_annotation_filepath=None, prefix="images"
+                ) -> List[str]:
+    """Write img_paths into tar shards of about shard_size_bytes each.
+
+    Images are read and written sequentially in the given order, so a shard's
+    members keep that order. Returns the shard paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    coco_index = load_coco_index(coco_annotation_filepath) if coco_annotation_filepath else None
+    shard_paths, shard_counts = [], []
+    tar, shard_bytes = None, 0
+    try:
+        for key, img_path in enumerate(img_paths):
+            if tar is None or shard_bytes >= shard_size_bytes or (
+                    max_images_per_shard and shard_counts[-1] >= max_images_per_shard):
+                if tar is not None:
+                    tar.close()
+                shard_paths.append(get_packed_shard_path(output_dir, len(shard_paths), prefix=prefix))
+                shard_counts.append(0)
+                tar, shard_bytes = tarfile.open(shard_paths[-1], mode="w"), 0
+            with open(img_path, "rb") as fp:
+                data = fp.read()
+            file_name = os.path.basename(img_path)
+            metadata = {"key": f"{key:09d}", "path": str(img_path), "file_name": file_name,
+                        "size": len(data)
+                        }
+            if coco_index is not None and file_name in coco_index.filename_to_img_id:
+                metadata["coco_image"] = coco_index.get_img_info(file_name)
+                metadata["coco_annotations"] = coco_index.get_anns(file_name)
+            ext = os.path.splitext(file_name)[1].lower() or ".bin"
+            _add_bytes(tar, f"{key:09d}{ext}", data)
+            _add_bytes(tar, f"{key:09d}.json", json.dumps(metadata).encode())
+            shard_bytes += len(data)
+            shard_counts[-1] += 1
+    finally:
+        if tar is not None:
+            tar.close()
+    index = {"shards": [{"path": os.path.basename(shard_path), "num_images": count}
+                        for shard_path, count in zip(shard_paths, shard_counts)
+                        ],
+             "num_images": sum(shard_counts),
+             "coco_annotation_filepath": coco_annotation_filepath,
+             }
+    with open(os.path.join(output_dir, PACKED_INDEX_NAME), "w") as fp:
+        json.dump(index, fp, indent=2)
+    logger.info(f"Packed {index['num_images']} images into {len(shard_paths)} shards in {output_dir}")
+    return shard_paths
+
+
+def get_packed_shard_paths(packed_dir) -> List[str]:
+    index_path = os.path.join(packed_dir, PACKED_INDEX_NAME)
+    if os.path.exists(index_path):
+        with open(index_path, "r") as fp:
+            return [os.path.join(packed_dir, shard["path"]) for shard in json.load(fp)["shards"]]
+    return sorted(glob(os.path.join(packed_dir, "*.tar")))
+
+
+def iter_packed_images(shard_paths) -> Iterator[Tuple[Dict, bytes]]:
+    """Yield (metadata, image bytes) for every image in shard_paths, in order.
+
+    Shards are opened in streaming mode, so each is read front to back with
+    large sequential reads and no per-image seek, open or stat.
+    """
+    if isinstance(shard_paths, (str, os.PathLike)):
+        shard_paths = [shard_paths]
+    for shard_path in shard_paths:
+        with tarfile.open(shard_path, mode="r|") as tar:
+            key, image_bytes, metadata = None, None, None
+            for member in tar:
+                if not member.isfile():
+                    continue
+                member_key, ext = os.path.splitext(member.name)
+                data = tar.extractfile(member).read()
+                if member_key != key:
+                    key, image_bytes, metadata = member_key, None, None
+                if ext == ".json":
+                    metadata = json.loads(data)
+                else:
+                    image_bytes = data
+                if image_bytes is not None and metadata is not None:
+                    yield metadata, image_bytes
+                    key = None
+
+
+def count_packed_images(packed_dir) -> Optional[int]:
+    index_path = os.path.join(packed_dir, PACKED_INDEX_NAME)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r") as fp:
+        return json.load(fp)["num_images"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter
+                                     )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack")
+    pack_parser.add_argument("--img-dir", required=True)
+    pack_parser.add_argument("--output-dir", required=True)
+    pack_parser.add_argument("--coco-annotation", default=None)
+    pack_parser.add_argument("--shard-size-mb", type=int, default=1024)
+    pack_parser.add_argument("--max-images-per-shard", type=int, default=None)
+    list_parser = subparsers.add_parser("list")
+    list_parser.add_argument("packed_dir")
+    args = parser.parse_args()
+    if args.command == "pack":
+        pack_images(sorted(glob(f"{args.img_dir}/*")), args.output_dir,
+                    shard_size_bytes=args.shard_size_mb << 20,
+                    max_images_per_shard=args.max_images_per_shard,
+                    coco_annotation_filepath=args.coco_annotation
+                    )
+    else:
+        for metadata, image_bytes in iter_packed_images(get_packed_shard_paths(args.packed_dir)):
+            print(f"{metadata['key']}\t{len(image_bytes)}\t{metadata['path']}")
@@ -0,0 +1,262 @@
+import shutil
+import tempfile
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Tuple
+import numpy as np
+from tqdm import tqdm
+from cluster_aware_splitter import logger
+from cluster_aware_splitter.feat import (FeatureExtractor, get_registered_feature_extractor,
+                                         init_model_registry, load_model_and_preprocess
+                                         )
+from cluster_aware_splitter.instrumentation import (Instrumentation, get_instrumentation,
+                                                    set_instrumentation
+                                                    )
+from cluster_aware_splitter.scheduler import (configure_worker_threads, get_available_cpus,
+                                              get_threads_per_process, plan_execution,
+                                              probe_batch_sizes
+                                              )
+
+# per-worker state filled by _init_shared_worker: the attached shared memory
+# block, a NumPy view over it and the image paths to index into
+_WORKER_STATE = {}
+
+# pooled output width of common keras.applications backbones; it does not
+# depend on the input size or weights, so no model has to be built for these
+KNOWN_FEATURE_DIMS = {"EfficientNetB0": 1280, "EfficientNetB1": 1280, "EfficientNetB2": 1408,
+                      "EfficientNetB3": 1536, "EfficientNetB4": 1792, "EfficientNetB5": 2048,
+                      "EfficientNetB6": 2304, "EfficientNetB7": 2560, "ResNet50": 2048,
+                      "ResNet101": 2048, "ResNet152": 2048, "VGG16": 512, "VGG19": 512,
+                      "MobileNetV2": 1280, "DenseNet121": 1024, "InceptionV3": 2048,
+                      "Xception": 2048
+                      }
+
+
+def _compute_feature_dim(img_resize_width, img_resize_height, model_family, model_name) -> int:
+    # output width does not depend on the weights, so skip loading them
+    model, _ = load_model_and_preprocess(input_shape=(img_resize_height, img_resize_width, 3),
+                                         model_family=model_family,
+                                         model_name=model_name, weight=None
+                                         )
+    return int(model.output_shape[-1])
+
+
+def get_feature_dim(img_resize_width=224, img_resize_height=224,
+                    model_family="efficientnet", model_name="EfficientNetB0"
+                    ) -> int:
+    if model_name in KNOWN_FEATURE_DIMS:
+        return KNOWN_FEATURE_DIMS[model_name]
+    # build the model in a throwaway worker so TensorFlow never starts in the
+    # parent, which later starts the extraction pool
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        return pool.apply(_compute_feature_dim, (img_resize_width, img_resize_height,
+                                                 model_family, model_name
+                                                 ))
+
+
+def _prepare_inference_backend(inference_backend, inference_options, img_resize_width,
+                               img_resize_height, model_family, model_name,
+                               img_normalization_weight
+                               ) -> str:
+    from cluster_aware_splitter.inference_backends import prepare_inference_backend
+    input_shape = (img_resize_height, img_resize_width, 3)
+    feature_extractor, _ = get_registered_feature_extractor(input_shape=input_shape,
+                                                            model_family=model_family,
+                                                            model_name=model_name,
+                                                            weight=img_normalization_weight
+                                                            )
+    return prepare_inference_backend(inference_backend, feature_extractor, input_shape,
+                                     **inference_options
+                                     )
+
+
+@contextmanager
+def pool_inference_backend(inference_backend="keras", inference_options=None,
+                           img_resize_width=224, img_resize_height=224,
+                           model_family="efficientnet", model_name="EfficientNetB0",
+                           img_normalization_weight="imagenet"
+                           ):
+    """Choose and export the inference backend once before starting a pool.
+
+    Yields the (inference_backend, inference_options) to hand to every pool
+    worker: "auto" is resolved to one concrete backend and exported backends
+    are already written to inference_options["export_dir"], so workers only
+    load them. Without an export_dir a temporary one is used and removed on
+    exit.
+    """
+    if inference_backend in ("keras", "tf_function"):
+        yield inference_backend, inference_options
+        return
+    inference_options = dict(inference_options or {})
+    tmp_export_dir = None
+    if not inference_options.get("export_dir"):
+        inference_options["export_dir"] = tmp_export_dir = tempfile.mkdtemp(prefix="cluster_aware_splitter_export_")
+    try:
+        # selection and export run in a throwaway worker so TensorFlow never
+        # starts in the parent
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(1) as pool:
+            inference_backend = pool.apply(_prepare_inference_backend,
+                                           (inference_backend, inference_options, img_resize_width,
+                                            img_resize_height, model_family, model_name,
+                                            img_normalization_weight
+                                            ))
+        logger.info(f"Workers will use the {inference_backend} inference backend from "
+                    f"{inference_options['export_dir']}"
+                    )
+        yield inference_backend, inference_options
+    finally:
+        if tmp_export_dir:
+            shutil.rmtree(tmp_export_dir, ignore_errors=True)
+
+
+def _init_shared_worker(shm_name, shape, img_paths, img_resize_width,
+                        img_resize_height, model_family, model_name,
+                        img_normalization_weight, seed, intra_op_threads=None,
+                        inter_op_threads=1, collect_metrics=False,
+                        inference_backend="keras", inference_options=None,
+                        reduced_decode=False, extract_fn=None
+                        ):
+    if collect_metrics:
+        set_instrumentation(Instrumentation())
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _WORKER_STATE["shm"] = shm
+    _WORKER_STATE["features"] = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+    _WORKER_STATE["img_paths"] = img_paths
+    _WORKER_STATE["extract_fn"] = extract_fn
+    if extract_fn is not None:
+        return
+    if intra_op_threads:
+        configure_worker_threads(intra_op_threads, inter_op_threads)
+    init_model_registry(img_resize_width, img_resize_height, model_family,
+                        model_name, img_normalization_weight, seed,
+                        inference_backend=inference_backend,
+                        inference_options=inference_options
+                        )
+    _WORKER_STATE["feat_extract"] = FeatureExtractor(seed=seed, img_resize_width=img_resize_width,
+                                                     img_resize_height=img_resize_height,
+                                                     model_family=model_family,
+                                                     model_name=model_name,
+                                                     img_normalization_weight=img_normalization_weight,
+                                                     inference_backend=inference_backend,
+                                                     inference_options=inference_options,
+                                                     reduced_decode=reduced_decode
+                                                     )
+
+
+def _extract_range_into_shared_memory(task: Tuple[int, int, int]) -> Tuple[int, Optional[Dict]]:
+    start, end, batch_size = task
+    img_paths = _WORKER_STATE["img_paths"][start:end]
+    if _WORKER_STATE["extract_fn"] is not None:
+        _WORKER_STATE["features"][start:end] = _WORKER_STATE["extract_fn"](img_paths, batch_size)
+    else:
+        feat_extract = _WORKER_STATE["feat_extract"]
+        _WORKER_STATE["features"][start:end] = feat_extract.extract_features_batch(img_paths,
+                                                                                   batch_size=batch_size
+                                                                                   )
+    instrumentation = get_instrumentation()
+    return end - start, instrumentation.pop_state() if instrumentation.enabled else None
+
+
+def make_index_ranges(num_items, range_size) -> List[Tuple[int, int]]:
+    return [(start, min(start + range_size, num_items))
+            for start in range(0, num_items, range_size)
+            ]
+
+
+def extract_features_shared_memory(img_paths, seed=2024, img_resize_width=224,
+                                   img_resize_height=224,
+                                   model_family="efficientnet",
+                                   model_name="EfficientNetB0",
+                                   img_normalization_weight="imagenet",
+                                   batch_size=None, num_processes=None,
+                                   feature_dim=None, execution_plan=None,
+                                   probe=False, inference_backend="keras",
+                                   inference_options=None, reduced_decode=False,
+                                   extract_fn: Optional[Callable] = None
+                                   ) -> np.ndarray:
+    """Extract features in a process pool straight into a shared (N, D) matrix.
+
+    Row i always holds the features of img_paths[i], whatever order the
+    workers finish in, and workers only send back a row count. Processes,
+    TF threads per process and batch size come from execution_plan, or from
+    plan_execution (optionally informed by a warm-up probe) when not given.
+    The inference backend is chosen and exported once (see
+    pool_inference_backend) and every worker loads that same export.
+    extract_fn(img_paths, batch_size) -> (n, feature_dim) array, when given,
+    replaces the model in the workers; it must be picklable and needs
+    feature_dim.
+    """
+    img_paths = list(img_paths)
+    instrumentation = get_instrumentation()
+    if execution_plan is None:
+        probe_results = None
+        if probe and batch_size:
+            raise ValueError(f"probe picks the batch size, so batch_size must be None, got {batch_size}")
+        if probe:
+            probe_results = probe_batch_sizes(intra_op_threads=get_threads_per_process(get_available_cpus()),
+                                              img_resize_width=img_resize_width,
+                                              img_resize_height=img_resize_height,
+                                              model_family=model_family,
+                                              model_name=model_name,
+                                              img_normalization_weight=img_normalization_weight
+                                              )
+        execution_plan = plan_execution(len(img_paths), batch_size=batch_size,
+                                        num_processes=num_processes,
+                                        probe_results=probe_results
+                                        )
+    if extract_fn is not None and not feature_dim:
+        raise ValueError("feature_dim is required with extract_fn")
+    if not feature_dim:
+        feature_dim = get_feature_dim(img_resize_width=img_resize_width,
+                                      img_resize_height=img_resize_height,
+                                      model_family=model_family, model_name=model_name
+                                      )
+    shape = (len(img_paths), feature_dim)
+    if not img_paths:
+        return np.empty(shape, dtype=np.float32)
+    nbytes = max(1, int(np.prod(shape)) * np.dtype(np.float32).itemsize)
+    shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    try:
+        features = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        # small tasks handed out one at a time, so faster workers simply take more
+        tasks = [(start, end, execution_plan.batch_size)
+                 for start, end in make_index_ranges(len(img_paths), execution_plan.task_size)
+                 ]
+        if extract_fn is not None:
+            inference_backend = "keras"
+        with pool_inference_backend(inference_backend, inference_options,
+                                    img_resize_width=img_resize_width,
+                                    img_resize_height=img_resize_height,
+                                    model_family=model_family, model_name=model_name,
+                                    img_normalization_weight=img_normalization_weight
+                                    ) as (worker_backend, worker_options):
+            initargs = (shm.name, shape, img_paths, img_resize_width, img_resize_height,
+                        model_family, model_name, img_normalization_weight, seed,
+                        execution_plan.intra_op_threads, execution_plan.inter_op_threads,
+                        instrumentation.enabled, worker_backend, worker_options,
+                        reduced_decode, extract_fn
+                        )
+            logger.info(f"Extracting {len(img_paths)} images in {len(tasks)} tasks on "
+                        f"{execution_plan.num_processes} processes"
+                        )
+            # spawn gives each worker a fresh TF runtime, so its thread limits apply
+            # and nothing initialised in the parent is forked
+            ctx = multiprocessing.get_context("spawn")
+            with ctx.Pool(execution_plan.num_processes, initializer=_init_shared_worker,
+                          initargs=initargs
+                          ) as pool:
+                for _, worker_metrics in tqdm(pool.imap_unordered(_extract_range_into_shared_memory,
+                                                                  tasks, chunksize=1
+                                                                  ),
+                                              total=len(tasks), desc="Extracting features"
+                                              ):
+                    instrumentation.merge(worker_metrics)
+        result = features.copy()
+        del features
+    finally:
+        shm.close()
+        shm.unlink()
+    return result
@@ -0,0 +1,130 @@
+import os
+import time
+import multiprocessing
+from dataclasses import dataclass
+from typing import Dict, Optional, Sequence
+import numpy as np
+from cluster_aware_splitter import logger
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                   "TF_NUM_INTRAOP_THREADS", "TF_NUM_INTEROP_THREADS"
+                   )
+
+
+@dataclass
+class ExecutionPlan:
+    num_processes: int
+    intra_op_threads: int
+    inter_op_threads: int
+    batch_size: int
+    task_size: int
+
+
+def get_available_cpus() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return multiprocessing.cpu_count()
+
+
+def get_threads_per_process(num_cpus) -> int:
+    # a few intra-op threads per process keep per-batch latency down without
+    # the oversubscription of every process spawning one thread per core
+    if num_cpus >= 64:
+        return 4
+    if num_cpus >= 16:
+        return 2
+    return 1
+
+
+def get_task_size(num_images, num_processes, batch_size, tasks_per_process=4,
+                  max_batches_per_task=8
+                  ) -> int:
+    """Images per pool task: several tasks per process so idle workers can pick up more."""
+    batches_per_task = num_images // max(1, batch_size * num_processes * tasks_per_process)
+    return batch_size * max(1, min(max_batches_per_task, batches_per_task))
+
+
+def plan_execution(num_images, num_cpus=None, batch_size=None,
+                   num_processes=None, intra_op_threads=None,
+                   probe_results: Optional[Dict[int, float]] = None,
+                   default_batch_size=32
+                   ) -> ExecutionPlan:
+    if not num_cpus:
+        num_cpus = get_available_cpus()
+    if not intra_op_threads:
+        if num_processes:
+            intra_op_threads = max(1, num_cpus // num_processes)
+        else:
+            intra_op_threads = get_threads_per_process(num_cpus)
+    if not batch_size:
+        if probe_results:
+            batch_size = max(probe_results, key=probe_results.get)
+        else:
+            batch_size = default_batch_size
+    if not num_processes:
+        num_processes = max(1, num_cpus // intra_op_threads)
+    num_processes = max(1, min(num_processes, -(-num_images // batch_size)))
+    execution_plan = ExecutionPlan(num_processes=num_processes,
+                                   intra_op_threads=intra_op_threads,
+                                   inter_op_threads=1,
+                                   batch_size=batch_size,
+                                   task_size=get_task_size(num_images, num_processes, batch_size)
+                                   )
+    logger.info(f"Execution plan for {num_images} images on {num_cpus} cpus: {execution_plan}")
+    return execution_plan
+
+
+def configure_worker_threads(intra_op_threads, inter_op_threads=1):
+    """Limit a worker's thread pools; call before TensorFlow creates its runtime."""
+    for env_var in THREAD_ENV_VARS:
+        num_threads = inter_op_threads if env_var == "TF_NUM_INTEROP_THREADS" else intra_op_threads
+        os.environ[env_var] = str(num_threads)
+    from cluster_aware_splitter.feat import tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    except RuntimeError:
+        logger.warning("TensorFlow runtime already initialised, thread limits not applied")
+
+
+def _probe_batch_sizes(candidate_batch_sizes, intra_op_threads, img_resize_width,
+                       img_resize_height, model_family, model_name,
+                       img_normalization_weight, num_batches
+                       ) -> Dict[int, float]:
+    configure_worker_threads(intra_op_threads)
+    from cluster_aware_splitter.feat import get_registered_feature_extractor
+    feature_extractor, preprocess = get_registered_feature_extractor(input_shape=(img_resize_height,
+                                                                                  img_resize_width, 3),
+                                                                     model_family=model_family,
+                                                                     model_name=model_name,
+                                                                     weight=img_normalization_weight
+                                                                     )
+    rng = np.random.default_rng(0)
+    throughput = {}
+    for batch_size in candidate_batch_sizes:
+        batch = rng.random((batch_size, img_resize_height, img_resize_width, 3), dtype=np.float32)
+        feature_extractor(preprocess(batch), training=False)
+        start = time.perf_counter()
+        for _ in range(num_batches):
+            feature_extractor(preprocess(batch), training=False)
+        throughput[batch_size] = batch_size * num_batches / (time.perf_counter() - start)
+    return throughput
+
+
+def probe_batch_sizes(candidate_batch_sizes: Sequence[int] = (8, 16, 32, 64),
+                      intra_op_threads=1, img_resize_width=224,
+                      img_resize_height=224, model_family="efficientnet",
+                      model_name="EfficientNetB0",
+                      img_normalization_weight="imagenet", num_batches=2
+                      ) -> Dict[int, float]:
+    """Images/sec per batch size, measured on synthetic input in one worker
+    configured like a pool worker."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        throughput = pool.apply(_probe_batch_sizes, (tuple(candidate_batch_sizes), intra_op_threads,
+                                                     img_resize_width, img_resize_height,
+                                                     model_family, model_name,
+                                                     img_normalization_weight, num_batches
+                                                     ))
+    logger.info(f"Warm-up probe throughput (images/sec) by batch size: {throughput}")
+    return throughput
@@ -0,0 +1,191 @@
+"""Split extraction over independent shards and merge the results.
+
+Each image belongs to the shard given by a hash of its path, so any node can
+compute its share without coordination::
+
+    python -m cluster_aware_splitter.sharding extract --img-dir imgs --shard 3/16 --output-dir feats
+    python -m cluster_aware_splitter.sharding merge --img-dir imgs --num-shards 16 \\
+        --output-dir feats --output features.npy --cluster-output clusters.csv
+"""
+import os
+import json
+import hashlib
+import argparse
+from functools import partial
+from glob import glob
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+from cluster_aware_splitter import logger
+
+
+def parse_shard_spec(shard_spec) -> Tuple[int, int]:
+    """Parse "i/N" into (i, N) with 0 <= i < N."""
+    try:
+        shard_index, num_shards = (int(part) for part in str(shard_spec).split("/"))
+    except ValueError:
+        raise ValueError(f"shard must look like i/N, got {shard_spec}")
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard index must be in [0, {num_shards}), got {shard_spec}")
+    return shard_index, num_shards
+
+
+def shard_for_path(img_path, num_shards) -> int:
+    # a content-independent, process-independent hash (unlike hash()) so every
+    # node agrees on the assignment as long as it sees the same path strings
+    digest = hashlib.blake2b(str(img_path).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+
+def select_shard(img_paths, shard_index, num_shards) -> List[str]:
+    return [img_path for img_path in img_paths if shard_for_path(img_path, num_shards) == shard_index]
+
+
+def get_shard_path(output_dir, shard_index, num_shards) -> str:
+    return os.path.join(output_dir, f"features_shard_{shard_index:05d}_of_{num_shards:05d}.npz")
+
+
+def extract_shard(img_paths, shard_index, num_shards, output_dir,
+                  extract_fn: Optional[Callable] = None, overwrite=False, **extraction_kwargs
+                  ) -> str:
+    """Extract features for one shard of img_paths into its .npz shard file.
+
+    extract_fn(paths) -> (paths, features) defaults to
+    feat.extract_features_multiprocess with extraction_kwargs. An existing
+    shard file is kept unless overwrite, so a failed batch job can be rerun.
+    """
+    shard_path = get_shard_path(output_dir, shard_index, num_shards)
+    if os.path.exists(shard_path) and not overwrite:
+        logger.info(f"{shard_path} already exists, skipping shard {shard_index}/{num_shards}")
+        return shard_path
+    if extract_fn is None:
+        from cluster_aware_splitter.feat import extract_features_multiprocess
+        extract_fn = partial(extract_features_multiprocess, **extraction_kwargs)
+    shard_img_paths = select_shard(img_paths, shard_index, num_shards)
+    logger.info(f"Extracting shard {shard_index}/{num_shards}: {len(shard_img_paths)} of {len(img_paths)} images")
+    if shard_img_paths:
+        extracted_paths, features = extract_fn(shard_img_paths)
+    else:
+        extracted_paths, features = [], np.empty((0, 0), dtype=np.float32)
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = f"{shard_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fp:
+        np.savez(fp, features=np.asarray(features, dtype=np.float32),
+                 img_paths=np.asarray([str(img_path) for img_path in extracted_paths], dtype=str),
+                 metadata=json.dumps({"shard_index": shard_index, "num_shards": num_shards,
+                                      "extraction_kwargs": extraction_kwargs
+                                      }, default=str)
+                 )
+    os.replace(tmp_path, shard_path)
+    return shard_path
+
+
+def merge_shards(output_dir, num_shards, img_paths=None, output_path=None
+                 ) -> Tuple[List[str], np.ndarray]:
+    """Combine all shard files into one feature matrix.
+
+    Rows follow img_paths when given (every path must be present in some
+    shard), otherwise sorted path order. With output_path the matrix is
+    written as a memory-mapped .npy instead of being held in memory.
+    """
+    shard_paths = [get_shard_path(output_dir, shard_index, num_shards) for shard_index in range(num_shards)]
+    missing_shards = [shard_path for shard_path in shard_paths if not os.path.exists(shard_path)]
+    if missing_shards:
+        raise ValueError(f"{len(missing_shards)} of {num_shards} shards are missing, e.g. {missing_shards[0]}")
+    shard_img_paths = []
+    feature_dim = 0
+    for shard_path in shard_paths:
+        with np.load(shard_path) as shard:
+            shard_img_paths.append(list(shard["img_paths"]))
+            feature_dim = max(feature_dim, shard["features"].shape[1])
+    all_paths = [img_path for paths in shard_img_paths for img_path in paths]
+    if img_paths is None:
+        ordered_paths = sorted(all_paths)
+    else:
+        ordered_paths = [str(img_path) for img_path in img_paths]
+        unextracted = set(ordered_paths).difference(all_paths)
+        if unextracted:
+            raise ValueError(f"{len(unextracted)} images are not in any shard, e.g. {next(iter(unextracted))}")
+    row_for_path = {img_path: row for row, img_path in enumerate(ordered_paths)}
+    shape = (len(ordered_paths), feature_dim)
+    if output_path:
+        merged = np.lib.format.open_memmap(output_path, mode="w+", dtype=np.float32, shape=shape)
+    else:
+        merged = np.empty(shape, dtype=np.float32)
+    for shard_path, paths in zip(shard_paths, shard_img_paths):
+        keep = [i for i, img_path in enumerate(paths) if img_path in row_for_path]
+        if not keep:
+            continue
+        with np.load(shard_path) as shard:
+            merged[[row_for_path[paths[i]] for i in keep]] = shard["features"][keep]
+    if output_path:
+        merged.flush()
+    logger.info(f"Merged {num_shards} shards into a {shape} feature matrix")
+    return ordered_paths, merged
+
+
+def cluster_shards(img_property_set, output_dir, num_shards, clustering_backend=None,
+                   reducer=None, n_components=128, output_path=None,
+                   cluster_model_dir=None
+                   ):
+    """Merge the shards for img_property_set and cluster them once."""
+    from cluster_aware_splitter.feat import cluster_features
+    img_property_set.img_paths, img_property_set.features = merge_shards(output_dir, num_shards,
+                                                                         img_paths=sorted(img_property_set.img_paths),
+                                                                         output_path=output_path
+                                                                         )
+    return cluster_features(img_property_set, clustering_backend=clustering_backend,
+                            reducer=reducer, n_components=n_components,
+                            cluster_model_dir=cluster_model_dir
+                            )
+
+
+def _get_img_paths(args) -> List[str]:
+    if args.img_list:
+        with open(args.img_list, "r") as fp:
+            return [line.strip() for line in fp if line.strip()]
+    return sorted(glob(f"{args.img_dir}/*"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter
+                                     )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("extract", "merge"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("--img-dir")
+        subparser.add_argument("--img-list", help="file with one image path per line")
+        subparser.add_argument("--output-dir", required=True)
+    extract_parser = subparsers.choices["extract"]
+    extract_parser.add_argument("--shard", required=True, help="i/N")
+    extract_parser.add_argument("--batch-size", type=int, default=32)
+    extract_parser.add_argument("--num-processes", type=int, default=None)
+    extract_parser.add_argument("--overwrite", action="store_true")
+    merge_parser = subparsers.choices["merge"]
+    merge_parser.add_argument("--num-shards", type=int, required=True)
+    merge_parser.add_argument("--output", default=None, help="write the merged matrix to this .npy")
+    merge_parser.add_argument("--cluster-output", default=None, help="cluster and write a csv here")
+    merge_parser.add_argument("--clustering-backend", default=None)
+    merge_parser.add_argument("--max-num-clusters", type=int, default=10)
+    args = parser.parse_args()
+    if not args.img_dir and not args.img_list:
+        parser.error("one of --img-dir or --img-list is required")
+    img_paths = _get_img_paths(args)
+    if args.command == "extract":
+        shard_index, num_shards = parse_shard_spec(args.shard)
+        extract_shard(img_paths, shard_index, num_shards, args.output_dir, overwrite=args.overwrite,
+                      batch_size=args.batch_size, num_processes=args.num_processes
+                      )
+    elif args.cluster_output:
+        from cluster_aware_splitter.feat import ImgPropertySetReturnType
+        img_property_set = ImgPropertySetReturnType(img_names=[os.path.basename(img_path) for img_path in img_paths],
+                                                    img_paths=img_paths, total_num_imgs=len(img_paths),
+                                                    max_num_clusters=args.max_num_clusters
+                                                    )
+        imgclust_df = cluster_shards(img_property_set, args.output_dir, args.num_shards,
+                                     clustering_backend=args.clustering_backend,
+                                     output_path=args.output
+                                     )
+        imgclust_df.to_csv(args.cluster_output, index=False)
+    else:
+        merge_shards(args.output_dir, args.num_shards, img_paths=img_paths, output_path=args.output)
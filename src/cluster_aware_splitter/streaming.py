@@ -0,0 +1,287 @@
+import os
+import multiprocessing
+from collections import deque
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+from cluster_aware_splitter import logger
+from cluster_aware_splitter.feat import FeatureExtractor, init_model_registry
+from cluster_aware_splitter.parallel_extraction import pool_inference_backend
+from cluster_aware_splitter.scheduler import configure_worker_threads, plan_execution
+
+
+def _init_streaming_worker(img_resize_width, img_resize_height, model_family,
+                           model_name, img_normalization_weight, seed,
+                           intra_op_threads, inference_backend="keras",
+                           inference_options=None
+                           ):
+    configure_worker_threads(intra_op_threads)
+    init_model_registry(img_resize_width, img_resize_height, model_family,
+                        model_name, img_normalization_weight, seed,
+                        inference_backend=inference_backend,
+                        inference_options=inference_options
+                        )
+
+
+def _extract_batch(args) -> Tuple[List[str], np.ndarray]:
+    img_paths, feature_extractor_kwargs, batch_size = args
+    feat_extract = FeatureExtractor(**feature_extractor_kwargs)
+    return img_paths, feat_extract.extract_features_batch(img_paths, batch_size=batch_size)
+
+
+def iter_features(img_paths, batch_size=32, num_processes=1, max_in_flight=None,
+                  seed=2024, img_resize_width=224, img_resize_height=224,
+                  model_family="efficientnet", model_name="EfficientNetB0",
+                  img_normalization_weight="imagenet", inference_backend="keras",
+                  inference_options=None, reduced_decode=False
+                  ) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Yield (paths, (len(paths), D) feature array) batches in input order.
+
+    With num_processes > 1 batches are extracted in a pool, but at most
+    max_in_flight batches (default 2 per process) are submitted and not yet
+    consumed at any time, so memory stays bounded by the window rather than
+    by the dataset size.
+    """
+    img_paths = list(img_paths)
+    feature_extractor_kwargs = dict(seed=seed, img_resize_width=img_resize_width,
+                                    img_resize_height=img_resize_height,
+                                    model_family=model_family, model_name=model_name,
+                                    img_normalization_weight=img_normalization_weight,
+                                    inference_backend=inference_backend,
+                                    inference_options=inference_options,
+                                    reduced_decode=reduced_decode
+                                    )
+    batches = (img_paths[i:i+batch_size] for i in range(0, len(img_paths), batch_size))
+    if not num_processes or num_processes <= 1:
+        feat_extract = FeatureExtractor(**feature_extractor_kwargs)
+        feat_extract.set_seed_consistently()
+        for batch_paths in batches:
+            yield batch_paths, feat_extract.extract_features_batch(batch_paths, batch_size=batch_size)
+        return
+
+    execution_plan = plan_execution(len(img_paths), batch_size=batch_size,
+                                    num_processes=num_processes
+                                    )
+    if not max_in_flight:
+        max_in_flight = 2 * execution_plan.num_processes
+    with pool_inference_backend(inference_backend, inference_options,
+                                img_resize_width=img_resize_width,
+                                img_resize_height=img_resize_height,
+                                model_family=model_family, model_name=model_name,
+                                img_normalization_weight=img_normalization_weight
+                                ) as (worker_backend, worker_options):
+        feature_extractor_kwargs.update(inference_backend=worker_backend,
+                                        inference_options=worker_options
+                                        )
+        initargs = (img_resize_width, img_resize_height, model_family, model_name,
+                    img_normalization_weight, seed, execution_plan.intra_op_threads,
+                    worker_backend, worker_options
+                    )
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(execution_plan.num_processes, initializer=_init_streaming_worker,
+                      initargs=initargs
+                      ) as pool:
+            in_flight = deque()
+            for batch_paths in batches:
+                in_flight.append(pool.apply_async(_extract_batch,
+                                                  ((batch_paths, feature_extractor_kwargs, batch_size),)
+                                                  ))
+                if len(in_flight) >= max_in_flight:
+                    yield in_flight.popleft().get()
+            while in_flight:
+                yield in_flight.popleft().get()
+
+
+class FeatureSink(object):
+    def write(self, img_paths: List[str], features: np.ndarray):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def abort(self):
+        """Release resources after a failed run without finishing or validating
+        the output."""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class NpyFeatureSink(FeatureSink):
+    """Write feature batches to an .npy matrix and a paths file as they arrive.
+
+    With num_rows known the .npy is preallocated memory-mapped and filled in
+    place; otherwise rows go to a raw float32 file that is turned into the
+    .npy on close with one sequential pass. With num_rows, writing more rows
+    or closing after fewer raises ValueError instead of leaving zero rows
+    that look like features. abort removes the partial output.
+    """
+    def __init__(self, output_path, num_rows=None, chunk_size=65536):
+        self.output_path = str(output_path)
+        self.paths_path = f"{os.path.splitext(self.output_path)[0]}_paths.txt"
+        self.num_rows = num_rows
+        self.chunk_size = chunk_size
+        self.rows_written = 0
+        self.feature_dim = None
+        self._memmap = None
+        self._raw_path = f"{self.output_path}.raw"
+        self._raw_fp = None
+        self._closed = False
+        self._paths_fp = open(self.paths_path, "w")
+
+    def write(self, img_paths, features):
+        features = np.asarray(features, dtype=np.float32)
+        if self.num_rows is not None and self.rows_written + len(features) > self.num_rows:
+            raise ValueError(f"{self.output_path} was declared with {self.num_rows} rows, "
+                             f"got at least {self.rows_written + len(features)}"
+                             )
+        if self.feature_dim is None:
+            self.feature_dim = features.shape[1]
+            if self.num_rows is not None:
+                self._memmap = np.lib.format.open_memmap(self.output_path, mode="w+", dtype=np.float32,
+                                                         shape=(self.num_rows, self.feature_dim)
+                                                         )
+            else:
+                self._raw_fp = open(self._raw_path, "wb")
+        if self._memmap is not None:
+            self._memmap[self.rows_written:self.rows_written + len(features)] = features
+        else:
+            self._raw_fp.write(features.tobytes())
+        self._paths_fp.writelines(f"{img_path}\n" for img_path in img_paths)
+        self.rows_written += len(features)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._paths_fp.close()
+        if self._memmap is not None:
+            self._memmap.flush()
+            self._memmap = None
+        elif self._raw_fp is not None:
+            self._raw_fp.close()
+            raw = np.memmap(self._raw_path, dtype=np.float32, mode="r",
+                            shape=(self.rows_written, self.feature_dim)
+                            )
+            output = np.lib.format.open_memmap(self.output_path, mode="w+", dtype=np.float32,
+                                               shape=raw.shape
+                                               )
+            for start in range(0, self.rows_written, self.chunk_size):
+                output[start:start + self.chunk_size] = raw[start:start + self.chunk_size]
+            output.flush()
+            del raw, output
+            os.remove(self._raw_path)
+            self._raw_fp = None
+        if self.num_rows is not None and self.rows_written != self.num_rows:
+            raise ValueError(f"{self.output_path} was declared with {self.num_rows} rows but only "
+                             f"{self.rows_written} were written; rows after that are not features"
+                             )
+        logger.info(f"Wrote {self.rows_written} feature rows to {self.output_path}")
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._paths_fp.close()
+        self._memmap = None
+        if self._raw_fp is not None:
+            self._raw_fp.close()
+            self._raw_fp = None
+        for path in (self.output_path, self.paths_path, self._raw_path):
+            if os.path.exists(path):
+                os.remove(path)
+        logger.info(f"Aborted {self.output_path} after {self.rows_written} feature rows")
+
+
+class StreamingClusterSink(FeatureSink):
+    """Feed feature batches to a streaming k-means as they arrive.
+
+    The first warmup_size rows are buffered to seed the centroids and, when
+    num_clusters is not given, to pick k by silhouette score.
+    """
+    def __init__(self, num_clusters=None, max_num_clusters=10, warmup_size=10000,
+                 batch_size=4096, seed=2024
+                 ):
+        self.num_clusters = num_clusters
+        self.max_num_clusters = max_num_clusters
+        self.warmup_size = warmup_size
+        self.batch_size = batch_size
+        self.seed = seed
+        self.kmeans_ = None
+        self._buffer: List[np.ndarray] = []
+        self._buffered_rows = 0
+
+    def _start(self):
+        from cluster_aware_splitter.clustering import MiniBatchKMeansBackend, make_streaming_kmeans
+        warmup = np.concatenate(self._buffer, axis=0)
+        self._buffer, self._buffered_rows = [], 0
+        if not self.num_clusters:
+            backend = MiniBatchKMeansBackend(max_num_clusters=self.max_num_clusters,
+                                             batch_size=self.batch_size, seed=self.seed
+                                             )
+            self.num_clusters = backend.select_num_clusters(warmup)
+        self.kmeans_ = make_streaming_kmeans(warmup, self.num_clusters,
+                                             batch_size=self.batch_size, seed=self.seed
+                                             )
+        self.kmeans_.partial_fit(warmup)
+
+    def write(self, img_paths, features):
+        features = np.asarray(features, dtype=np.float32)
+        if self.kmeans_ is None:
+            self._buffer.append(features)
+            self._buffered_rows += len(features)
+            if self._buffered_rows >= self.warmup_size:
+                self._start()
+        elif len(features):
+            self.kmeans_.partial_fit(features)
+
+    def close(self):
+        if self.kmeans_ is None and self._buffered_rows:
+            self._start()
+
+    def predict(self, features) -> np.ndarray:
+        return self.kmeans_.predict(np.asarray(features, dtype=np.float32))
+
+
+def consume_features(feature_batches: Iterable[Tuple[List[str], np.ndarray]],
+                     sinks: Iterable[FeatureSink]
+                     ) -> int:
+    """Write every (paths, features) batch to each sink, then close the sinks.
+
+    If a batch or a write fails, every sink is aborted and the original error
+    is re-raised. Every sink is closed even if an earlier close fails; the
+    first close error is raised after that.
+    """
+    sinks = list(sinks)
+    num_rows = 0
+    try:
+        for img_paths, features in feature_batches:
+            for sink in sinks:
+                sink.write(img_paths, features)
+            num_rows += len(img_paths)
+    except BaseException:
+        for sink in sinks:
+            try:
+                sink.abort()
+            except Exception:
+                logger.exception(f"Failed to abort {type(sink).__name__}")
+        raise
+    close_error = None
+    for sink in sinks:
+        try:
+            sink.close()
+        except Exception as error:
+            if close_error is None:
+                close_error = error
+            else:
+                logger.exception(f"Failed to close {type(sink).__name__}")
+    if close_error is not None:
+        raise close_error
+    return num_rows
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+from cluster_aware_splitter.ann_index import (IVFIndex, near_duplicate_graph,
+                                              near_duplicate_groups
+                                              )
+from cluster_aware_splitter.cluster_aware_splitter import ClusterAwareSplitter
+
+
+def _features_with_duplicates(num_items=2000, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    features = rng.normal(size=(num_items, dim)).astype(np.float32)
+    # rows 1..4 are near copies of row 0, row 11 of row 10
+    features[1:5] = features[0] + 1e-3 * rng.normal(size=(4, dim))
+    features[11] = features[10] + 1e-3 * rng.normal(size=dim)
+    return features
+
+
+def test_ivf_index_matches_brute_force_and_finds_duplicates():
+    features = _features_with_duplicates()
+    index = IVFIndex(num_lists=32, nprobe=32).build(features)
+    distances, indices = index.search(features[:50], k=5)
+    normalized = features / np.linalg.norm(features, axis=1, keepdims=True)
+    exact = np.argsort(((normalized[:50, None] - normalized[None]) ** 2).sum(-1), axis=1)[:, :5]
+    assert (np.sort(indices, axis=1) == np.sort(exact, axis=1)).all()
+    assert (np.diff(distances, axis=1) >= 0).all()
+
+    edges = near_duplicate_graph(IVFIndex(num_lists=32, nprobe=4).build(features), features,
+                                 threshold=0.01
+                                 )
+    groups = near_duplicate_groups(len(features), edges)
+    assert len(np.unique(groups[:5])) == 1
+    assert groups[10] == groups[11]
+    assert len(np.unique(groups)) == len(features) - 5
+
+
+def test_splitter_keeps_groups_together():
+    num_rows = 300
+    groups = np.arange(num_rows)
+    groups[1:20] = 0
+    groups[50:60] = 50
+    imgclust_df = pd.DataFrame({"image_names": [f"img_{i}.jpg" for i in range(num_rows)],
+                                "clusters": np.arange(num_rows) % 3, "group": groups
+                                })
+    splitter = ClusterAwareSplitter(imgclust_df, group_col="group")
+    split_df = splitter.split()
+    assert (split_df.groupby("group")["split"].nunique() == 1).all()
+    assert abs((split_df["split"] == "train").mean() - 0.7) < 0.1
+    for fold_df in (splitter.kfold(n_splits=3), splitter.group_kfold(n_splits=3)):
+        assert (fold_df.groupby("group")["fold"].nunique() == 1).all()
@@ -0,0 +1,121 @@
+import os
+import glob
+import importlib
+import subprocess
+import sys
+import pytest
+
+
+@pytest.fixture
+def anno_subproc(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("cluster_aware_splitter.anno_subproc")
+
+
+def test_import_does_not_configure_logging(tmp_path):
+    code = ("import logging, cluster_aware_splitter.anno_subproc; "
+            "assert not logging.getLogger().handlers"
+            )
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, check=True)
+    assert not (tmp_path / "annonymization.logs").exists()
+
+
+def _write_imgs(source_dir, num_imgs):
+    source_dir.mkdir()
+    for i in range(num_imgs):
+        (source_dir / f"img_{i}.jpg").write_bytes(bytes([i]))
+
+
+def test_stage_chunk_links_instead_of_copying(anno_subproc, tmp_path):
+    _write_imgs(tmp_path / "source", 2)
+    img_paths = sorted(str(path) for path in (tmp_path / "source").iterdir())
+    chunk_dir = anno_subproc.stage_chunk(img_paths, str(tmp_path / "chunk"))
+    staged = sorted(os.path.join(chunk_dir, name) for name in os.listdir(chunk_dir))
+    assert [os.path.samefile(a, b) for a, b in zip(staged, img_paths)] == [True, True]
+
+
+def test_annonymize_pipelined_with_in_process_anonymizer(anno_subproc, tmp_path):
+    _write_imgs(tmp_path / "source", 25)
+    calls, done = [], []
+
+    def anonymize_fn(img_paths, target_dir):
+        calls.append(list(img_paths))
+        for img_path in img_paths:
+            with open(os.path.join(target_dir, os.path.basename(img_path)), "wb") as fp:
+                fp.write(b"anonymized")
+
+    num_processed = anno_subproc.annonymize_pipelined(tmp_path / "source", str(tmp_path / "target"),
+                                                      chunk_size=10, anonymize_fn=anonymize_fn,
+                                                      num_workers=2, on_chunk_done=done.extend
+                                                      )
+    assert num_processed == 25
+    assert sorted(len(chunk) for chunk in calls) == [5, 10, 10]
+    assert sorted(done) == sorted(str(path) for path in (tmp_path / "source").iterdir())
+    assert len(os.listdir(tmp_path / "target")) == 25
+
+
+def test_annonymize_pipelined_raises_worker_errors(anno_subproc, tmp_path):
+    _write_imgs(tmp_path / "source", 5)
+
+    def anonymize_fn(img_paths, target_dir):
+        raise RuntimeError("model failed")
+
+    with pytest.raises(RuntimeError, match="model failed"):
+        anno_subproc.annonymize_pipelined(tmp_path / "source", str(tmp_path / "target"),
+                                          chunk_size=2, anonymize_fn=anonymize_fn
+                                          )
+
+
+def test_progress_journal_resumes_and_ignores_truncated_line(anno_subproc, tmp_path):
+    _write_imgs(tmp_path / "source", 6)
+    calls = []
+
+    def anonymize_fn(img_paths, target_dir):
+        calls.append(len(img_paths))
+        if sum(calls) > 4:
+            raise RuntimeError("interrupted")
+
+    with pytest.raises(RuntimeError):
+        anno_subproc.annonymize_pipelined(tmp_path / "source", str(tmp_path / "target"),
+                                          chunk_size=2, anonymize_fn=anonymize_fn,
+                                          journal_dir=str(tmp_path / "journal")
+                                          )
+    journal = anno_subproc.ProgressJournal(tmp_path / "source",
+                                           config={"target_dir": str(tmp_path / "target"),
+                                                   "model": None
+                                                   },
+                                           journal_dir=str(tmp_path / "journal")
+                                           )
+    assert len(journal) == 4
+    journal.close()
+    with open(journal.path, "a") as fp:
+        fp.write('{"image_paths": ["trunc')
+
+    calls.clear()
+    num_processed = anno_subproc.annonymize_pipelined(tmp_path / "source", str(tmp_path / "target"),
+                                                      chunk_size=2, anonymize_fn=lambda *args: None,
+                                                      journal_dir=str(tmp_path / "journal")
+                                                      )
+    assert num_processed == 2
+    with anno_subproc.ProgressJournal(tmp_path / "source",
+                                      config={"target_dir": str(tmp_path / "target"), "model": None},
+                                      journal_dir=str(tmp_path / "journal")
+                                      ) as resumed:
+        assert len(resumed) == 6
+
+
+def test_progress_journal_resumes_with_differently_written_source_dir(anno_subproc, tmp_path):
+    _write_imgs(tmp_path / "source", 4)
+    config = {"target_dir": str(tmp_path / "target"), "model": None}
+    # the fixture runs from tmp_path, so "source" and "./source/" name the same directory
+    with anno_subproc.ProgressJournal("source", config=config, journal_dir="journal") as journal:
+        journal.record(sorted(glob.glob("source/*"))[:3])
+
+    absolute_paths = sorted(glob.glob(f"{tmp_path}/source/*"))
+    with anno_subproc.ProgressJournal(str(tmp_path / "source"), config=config,
+                                      journal_dir="journal"
+                                      ) as journal:
+        assert journal.pending(absolute_paths) == absolute_paths[3:]
+        assert absolute_paths[0] in journal
+    with anno_subproc.ProgressJournal("./source/", config=config, journal_dir="journal") as journal:
+        assert journal.pending(sorted(glob.glob("./source/*"))) == ["./source/img_3.jpg"]
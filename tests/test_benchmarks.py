@@ -0,0 +1,37 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+import run_benchmarks
+from synthetic_data import make_synthetic_images
+
+
+def test_cluster_features_benchmark_smoke(tmp_path):
+    img_paths, coco_annotation_filepath = make_synthetic_images(str(tmp_path / "images"), num_images=4,
+                                                                width=64, height=48
+                                                                )
+    assert len(img_paths) == 4 and all(os.path.exists(img_path) for img_path in img_paths)
+    with open(coco_annotation_filepath, "r") as fp:
+        assert len(json.load(fp)["images"]) == 4
+
+    result = run_benchmarks.run_isolated("cluster_features", num_images=64, feature_dim=16,
+                                         clustering_backend="minibatch_kmeans"
+                                         )
+    assert "error" not in result
+    assert result["benchmark"] == "cluster_features"
+    assert result["num_images"] == 64
+    assert result["seconds"] > 0 and result["peak_rss_mb"] > 0
+
+
+def test_main_exits_non_zero_when_a_benchmark_fails(tmp_path, monkeypatch):
+    report = {"metadata": {}, "results": [{"benchmark": "cluster_features", "seconds": 0.1},
+                                          {"benchmark": "stage_latency", "error": "ImportError()"},
+                                          ]}
+    monkeypatch.setattr(run_benchmarks, "run_benchmarks", lambda **kwargs: report)
+    output_path = tmp_path / "bench_results.json"
+    assert run_benchmarks.main(["--output", str(output_path)]) == 1
+    assert json.loads(output_path.read_text()) == report
+
+    report["results"].pop()
+    assert run_benchmarks.main(["--output", str(output_path)]) == 0
@@ -1 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
 from cluster_aware_splitter import cluster_aware_splitter
+from cluster_aware_splitter.cluster_aware_splitter import ClusterAwareSplitter
+
+
+@pytest.fixture
+def imgclust_df():
+    clusters = np.repeat([0, 1, 2, 3], [100, 40, 20, 5])
+    return pd.DataFrame({"image_names": [f"img_{i}.jpg" for i in range(len(clusters))],
+                         "clusters": clusters
+                         })
+
+
+def test_split_is_stratified_and_deterministic(imgclust_df):
+    splitter = ClusterAwareSplitter(imgclust_df)
+    split_df = splitter.split(train_size=0.7, val_size=0.2, test_size=0.1)
+    counts = split_df.groupby(["clusters", "split"]).size().unstack(fill_value=0)
+    assert counts.loc[0, "train"] == 70
+    assert counts.loc[0, "val"] == 20
+    assert counts.loc[0, "test"] == 10
+    assert counts.loc[1].to_dict() == {"test": 4, "train": 28, "val": 8}
+    pd.testing.assert_frame_equal(split_df, ClusterAwareSplitter(imgclust_df).split(0.7, 0.2, 0.1))
+    assert not split_df.equals(ClusterAwareSplitter(imgclust_df, seed=1).split(0.7, 0.2, 0.1))
+
+
+def test_kfold_spreads_clusters(imgclust_df):
+    fold_df = ClusterAwareSplitter(imgclust_df).kfold(n_splits=5)
+    counts = fold_df.groupby(["clusters", "fold"]).size().unstack(fill_value=0)
+    assert (counts.loc[0] == 20).all()
+    assert (counts.loc[3] == 1).all()
+
+
+def test_group_kfold_keeps_clusters_together(imgclust_df):
+    fold_df = ClusterAwareSplitter(imgclust_df).group_kfold(n_splits=2)
+    assert (fold_df.groupby("clusters")["fold"].nunique() == 1).all()
+    assert sorted(fold_df["fold"].value_counts().tolist()) == [65, 100]
+
+
+def test_write_manifests(imgclust_df, tmp_path):
+    split_df = ClusterAwareSplitter(imgclust_df).split()
+    manifest_paths = ClusterAwareSplitter.write_manifests(split_df, tmp_path)
+    assert set(manifest_paths) == {"train", "val", "test"}
+    assert sum(len(pd.read_csv(path)) for path in manifest_paths.values()) == len(imgclust_df)
+
+
+@pytest.mark.parametrize("group_size,n_splits", [(2, 2), (5, 5), (3, 4)])
+def test_kfold_with_equal_size_groups_fills_every_fold(group_size, n_splits):
+    num_rows = 120
+    imgclust_df = pd.DataFrame({"image_names": [f"img_{i}.jpg" for i in range(num_rows)],
+                                "clusters": np.repeat([0, 1], num_rows // 2),
+                                "group": np.arange(num_rows) // group_size
+                                })
+    fold_df = ClusterAwareSplitter(imgclust_df, group_col="group").kfold(n_splits=n_splits)
+    assert (fold_df.groupby("group")["fold"].nunique() == 1).all()
+    fold_sizes = fold_df["fold"].value_counts()
+    assert len(fold_sizes) == n_splits
+    assert fold_sizes.max() - fold_sizes.min() <= 2 * group_size
+
+
+def test_missing_clusters_are_rejected(imgclust_df):
+    imgclust_df["clusters"] = imgclust_df["clusters"].astype(float)
+    imgclust_df.loc[3, "clusters"] = np.nan
+    with pytest.raises(ValueError, match="1 rows have no cluster"):
+        ClusterAwareSplitter(imgclust_df)
+
+
+def test_missing_groups_are_singletons():
+    num_rows = 200
+    groups = np.full(num_rows, np.nan)
+    groups[:10] = 7
+    imgclust_df = pd.DataFrame({"image_names": [f"img_{i}.jpg" for i in range(num_rows)],
+                                "clusters": np.arange(num_rows) % 2, "group": groups
+                                })
+    splitter = ClusterAwareSplitter(imgclust_df, group_col="group")
+    split_df = splitter.split(train_size=0.5, val_size=0.25, test_size=0.25)
+    assert split_df.loc[:9, "split"].nunique() == 1
+    ungrouped = split_df[split_df["group"].isna()]
+    assert ungrouped["split"].nunique() == 3
+    for cluster in (0, 1):
+        assert ungrouped.loc[ungrouped["clusters"] == cluster, "split"].nunique() == 3
+    fold_df = splitter.kfold(n_splits=4)
+    assert fold_df.loc[fold_df["group"].isna(), "fold"].nunique() == 4
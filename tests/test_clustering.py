@@ -0,0 +1,46 @@
+import numpy as np
+from cluster_aware_splitter.clustering import (ClusterModel, MiniBatchKMeansBackend,
+                                               get_clustering_backend
+                                               )
+
+
+def _blobs(num_per_cluster=200, num_clusters=3, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = np.eye(num_clusters, dim) * 50
+    features = np.concatenate([center + rng.normal(size=(num_per_cluster, dim))
+                               for center in centers
+                               ])
+    return features.astype(np.float32)
+
+
+def test_minibatch_kmeans_selects_num_clusters():
+    features = _blobs()
+    backend = MiniBatchKMeansBackend(max_num_clusters=6, chunk_size=128)
+    labels = backend.fit_predict(features)
+    assert backend.num_clusters_ == 3
+    assert labels.shape == (len(features),)
+    assert len(np.unique(labels[:200])) == 1
+
+
+def test_get_clustering_backend_honours_max_num_clusters():
+    backend = get_clustering_backend("minibatch_kmeans", max_num_clusters=4)
+    assert isinstance(backend, MiniBatchKMeansBackend)
+    assert backend.max_num_clusters == 4
+
+
+def test_cluster_model_assigns_new_images_and_detects_drift(tmp_path):
+    features = _blobs()
+    labels = MiniBatchKMeansBackend(num_clusters=3).fit_predict(features)
+    ClusterModel.from_labels(features, labels, config={"model_name": "EfficientNetB0"}).save(tmp_path)
+    cluster_model = ClusterModel.load(tmp_path)
+    assert cluster_model.config == {"model_name": "EfficientNetB0"}
+
+    new_features = _blobs(num_per_cluster=50, seed=1)
+    new_labels = cluster_model.assign_clusters(new_features, chunk_size=64)
+    expected = cluster_model.assign_clusters(features)[[0, 200, 400]]
+    np.testing.assert_array_equal(new_labels, np.repeat(expected, 50))
+    assert not cluster_model.detect_drift(new_features)["drifted"]
+
+    shifted = new_features + 10.0
+    assert cluster_model.detect_drift(shifted)["drifted"]
+    assert cluster_model.detect_drift(new_features[:50])["psi"] > 0.2
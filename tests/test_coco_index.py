@@ -0,0 +1,32 @@
+import json
+import pickle
+import pytest
+from cluster_aware_splitter.coco_index import get_ann_crop_boxes, load_coco_index
+
+
+def test_coco_index_lookups(tmp_path):
+    dataset = {"images": [{"id": 1, "file_name": "a.jpg", "height": 10, "width": 10},
+                          {"id": 2, "file_name": "b.jpg", "height": 10, "width": 10},
+                          ],
+               "annotations": [{"id": 7, "image_id": 1, "bbox": [0, 0, 2, 2]},
+                               {"id": 8, "image_id": 1, "bbox": [1, 1, 2, 2]},
+                               ],
+               }
+    annotation_filepath = tmp_path / "coco.json"
+    annotation_filepath.write_text(json.dumps(dataset))
+    coco_index = pickle.loads(pickle.dumps(load_coco_index(annotation_filepath)))
+    assert coco_index.get_img_id("b.jpg") == 2
+    assert [ann["id"] for ann in coco_index.get_anns("a.jpg")] == [7, 8]
+    assert coco_index.get_anns("b.jpg") == []
+    with pytest.raises(KeyError):
+        coco_index.get_img_id("missing.jpg")
+
+
+def test_get_ann_crop_boxes():
+    ann = {"bbox": [1.5, 2.0, 3.0, 4.0],
+           "segmentation": [[1, 1, 4, 1, 4, 5], [8, 8, 12, 9, 9, 12]],
+           }
+    assert get_ann_crop_boxes(ann, img_height=10, img_width=10) == [(1, 2, 5, 6)]
+    assert get_ann_crop_boxes(ann, 10, 10, crop_mode="polygon") == [(1, 1, 4, 5), (8, 8, 10, 10)]
+    rle_ann = {"bbox": [0, 0, 2, 2], "segmentation": {"counts": "abc", "size": [10, 10]}}
+    assert get_ann_crop_boxes(rle_ann, 10, 10, crop_mode="polygon") == [(0, 0, 2, 2)]
@@ -0,0 +1,48 @@
+import numpy as np
+from cluster_aware_splitter.compression import (IncrementalPCAReducer, dequantize_features,
+                                                quantize_features,
+                                                representation_agreement_report
+                                                )
+from cluster_aware_splitter.feature_store import FeatureStore, get_model_config
+
+
+def _blobs(num_per_cluster=300, num_clusters=4, dim=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=4.0, size=(num_clusters, dim))
+    features = np.concatenate([center + rng.normal(size=(num_per_cluster, dim))
+                               for center in centers
+                               ])
+    return features.astype(np.float32)
+
+
+def test_quantization_and_incremental_pca():
+    features = _blobs()
+    values, scales = quantize_features(features, "int8")
+    assert values.dtype == np.int8
+    np.testing.assert_allclose(dequantize_features(values, scales), features,
+                               atol=float(scales.max())
+                               )
+    reducer = IncrementalPCAReducer(n_components=16, chunk_size=500)
+    reduced = reducer.fit_transform(features)
+    assert reduced.shape == (len(features), 16)
+    assert reducer.explained_variance_ratio > 0.3
+
+
+def test_representation_agreement_report():
+    report = representation_agreement_report(_blobs(), clustering_backend="minibatch_kmeans",
+                                             max_num_clusters=6
+                                             )
+    assert report[0]["compression_ratio"] == 1.0
+    for entry in report[1:]:
+        assert entry["compression_ratio"] >= 2.0
+        assert entry["ari"] > 0.95
+
+
+def test_feature_store_int8(tmp_path):
+    img_path = tmp_path / "a.jpg"
+    img_path.write_bytes(b"a")
+    features = _blobs()[:1]
+    store = FeatureStore(tmp_path / "store", get_model_config(), feature_dtype="int8")
+    loaded = store.get_or_extract([str(img_path)], lambda paths: (paths, features))
+    assert store.features.dtype == np.int8
+    np.testing.assert_allclose(loaded, features, atol=float(np.abs(features).max() / 127))
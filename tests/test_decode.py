@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from PIL import Image
+from cluster_aware_splitter.decode import (block_mean_downsample, compare_reduced_decode,
+                                           open_image_reduced, read_tiff_reduced
+                                           )
+
+
+def test_reduced_jpeg_decode_matches_full_decode(tmp_path):
+    yy, xx = np.mgrid[0:2400, 0:3200]
+    pixels = np.stack([xx % 256, yy % 256, (xx + yy) // 32 % 256], axis=-1).astype(np.uint8)
+    img_path = str(tmp_path / "large.jpg")
+    Image.fromarray(pixels).save(img_path, quality=95)
+
+    img = open_image_reduced(img_path, 224, 224)
+    assert 224 <= min(img.size) < 600
+
+    def full_decode(path):
+        return np.asarray(Image.open(path).convert("RGB").resize((224, 224)), dtype=np.float32) / 255.0
+
+    def reduced_decode(path):
+        return np.asarray(open_image_reduced(path, 224, 224).convert("RGB").resize((224, 224)),
+                          dtype=np.float32) / 255.0
+
+    report = compare_reduced_decode([img_path], full_decode, reduced_decode,
+                                    feature_fn=lambda batch: batch.reshape(len(batch), -1)
+                                    )
+    assert report["passed"], report
+
+
+def _full_decode(path):
+    return np.asarray(Image.open(path).convert("RGB").resize((224, 224), Image.BOX),
+                      dtype=np.float32) / 255.0
+
+
+def test_block_mean_downsample_averages_blocks():
+    data = np.arange(7 * 9 * 3, dtype=np.uint8).reshape(7, 9, 3)
+    reduced = block_mean_downsample(data, 3, rows_per_chunk=1)
+    assert reduced.shape == (2, 3, 3) and reduced.dtype == np.uint8
+    expected = np.rint(data[:6].astype(np.float32).reshape(2, 3, 3, 3, 3).mean(axis=(1, 3)))
+    np.testing.assert_array_equal(reduced, expected)
+
+
+def test_reduced_tiff_read_matches_full_decode(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    yy, xx = np.mgrid[0:2300, 0:1800]
+    # one-pixel stripes alias badly under plain striding
+    pixels = np.stack([(xx % 2) * 255, yy % 256, (xx + yy) // 16 % 256], axis=-1).astype(np.uint8)
+    img_path = str(tmp_path / "large.tif")
+    tifffile.imwrite(img_path, pixels)
+
+    reduced = read_tiff_reduced(img_path, 224, 224)
+    assert reduced is not None and min(reduced.shape[:2]) >= 224
+
+    def reduced_decode(path):
+        data = read_tiff_reduced(path, 224, 224)
+        return np.asarray(Image.fromarray(data).resize((224, 224), Image.BOX), dtype=np.float32) / 255.0
+
+    report = compare_reduced_decode([img_path], _full_decode, reduced_decode)
+    assert report["passed"], report
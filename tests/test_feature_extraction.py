@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+from cluster_aware_splitter import feat
+from cluster_aware_splitter.feat import FeatureExtractor, get_model_registry_key
+
+MODEL_KWARGS = dict(img_resize_width=16, img_resize_height=16, model_family="stub",
+                    model_name="Stub", img_normalization_weight=None, seed=2024
+                    )
+COLORS = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [51, 102, 153], [255, 255, 0]],
+                  dtype=np.uint8
+                  )
+
+
+class _ChannelMeanModel(object):
+    output_shape = (None, 3)
+
+    def __call__(self, x, training=False):
+        return np.asarray(x, dtype=np.float32).mean(axis=(1, 2))
+
+
+@pytest.fixture
+def stub_model():
+    key = get_model_registry_key((16, 16, 3), "stub", "Stub", None)
+    feat._MODEL_REGISTRY[key] = feat.ModelPreprocessReturn(model=_ChannelMeanModel(),
+                                                           preprocess=lambda x: x
+                                                           )
+    yield feat._MODEL_REGISTRY[key]
+    feat._MODEL_REGISTRY.pop(key, None)
+
+
+@pytest.fixture
+def img_paths(tmp_path):
+    from PIL import Image
+    paths = []
+    for i, color in enumerate(COLORS):
+        path = str(tmp_path / f"img_{i}.png")
+        Image.fromarray(np.tile(color, (20, 24, 1))).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_registry_reuses_the_registered_extractor(stub_model, monkeypatch):
+    def _fail(**kwargs):
+        raise AssertionError("model should not be rebuilt")
+
+    monkeypatch.setattr(feat, "load_model_and_preprocess", _fail)
+    first = FeatureExtractor(**MODEL_KWARGS).get_cached_feature_extractor()
+    second = FeatureExtractor(**MODEL_KWARGS).get_cached_feature_extractor()
+    assert first is stub_model
+    assert second is stub_model
+
+
+def test_registry_keys_separate_models_and_backends():
+    key = get_model_registry_key((16, 16, 3), "stub", "Stub", None)
+    assert key != get_model_registry_key((32, 32, 3), "stub", "Stub", None)
+    assert key != get_model_registry_key((16, 16, 3), "stub", "Other", None)
+    assert key != get_model_registry_key((16, 16, 3), "stub", "Stub", "imagenet")
+    assert key != get_model_registry_key((16, 16, 3), "stub", "Stub", None, inference_backend="tflite")
+    assert (get_model_registry_key([16, 16, 3], "stub", "Stub", None, "tflite", {"b": 1, "a": 2})
+            == get_model_registry_key((16, 16, 3), "stub", "Stub", None, "tflite", {"a": 2, "b": 1})
+            )
+
+
+def test_registry_builds_each_model_once(monkeypatch):
+    tf = pytest.importorskip("tensorflow")
+    builds = []
+
+    def _load_model_and_preprocess(input_shape, model_family, model_name, weight):
+        builds.append(model_name)
+        inputs = tf.keras.Input(shape=input_shape)
+        model = tf.keras.Model(inputs, tf.keras.layers.Conv2D(4, 1)(inputs))
+        return feat.ModelPreprocessReturn(model=model, preprocess=lambda x: x)
+
+    monkeypatch.setattr(feat, "load_model_and_preprocess", _load_model_and_preprocess)
+    key = get_model_registry_key((8, 8, 3), "stub", "Tiny", None)
+    try:
+        first = feat.get_registered_feature_extractor((8, 8, 3), "stub", "Tiny", None)
+        second = feat.get_registered_feature_extractor((8, 8, 3), "stub", "Tiny", None)
+        assert builds == ["Tiny"]
+        assert first is second
+        assert first.model.output_shape == (None, 4)
+    finally:
+        feat._MODEL_REGISTRY.pop(key, None)
+
+
+def test_batched_features_match_per_image_features(stub_model, img_paths):
+    pytest.importorskip("tensorflow")
+    extractor = FeatureExtractor(**MODEL_KWARGS)
+    batched = extractor.extract_features_batch(img_paths, batch_size=2)
+    per_image = np.stack([np.asarray(extractor.extract_features(extractor.load_image_for_inference(img_path),
+                                                                *stub_model
+                                                                ))
+                          for img_path in img_paths
+                          ])
+    assert batched.shape == (5, 3)
+    assert batched.dtype == np.float32
+    np.testing.assert_allclose(batched, per_image, atol=1e-6)
+    np.testing.assert_allclose(batched, COLORS / 255.0, atol=1e-6)
+
+
+def test_tf_data_keeps_row_order(stub_model, img_paths):
+    pytest.importorskip("tensorflow")
+    pytest.importorskip("tensorflow_io")
+    extractor = FeatureExtractor(**MODEL_KWARGS)
+    features = extractor.extract_features_tf_data(img_paths[::-1], batch_size=2)
+    np.testing.assert_allclose(features, COLORS[::-1] / 255.0, atol=1e-6)
+
+
+def test_tf_data_raises_on_a_missing_file(stub_model, img_paths, tmp_path):
+    tf = pytest.importorskip("tensorflow")
+    pytest.importorskip("tensorflow_io")
+    extractor = FeatureExtractor(**MODEL_KWARGS)
+    with pytest.raises(tf.errors.NotFoundError):
+        extractor.extract_features_tf_data(img_paths + [str(tmp_path / "missing.png")], batch_size=2)
+
+
+def test_features_only_batch_decodes_each_image_once(stub_model, img_paths, monkeypatch):
+    tf = pytest.importorskip("tensorflow")
+    read_file = tf.io.read_file
+    reads = []
+
+    def _read_file(path):
+        reads.append(path)
+        return read_file(path)
+
+    def _fail(*args, **kwargs):
+        raise AssertionError("PIL should not decode images when return_imgs is False")
+
+    monkeypatch.setattr(tf.io, "read_file", _read_file)
+    monkeypatch.setattr(FeatureExtractor, "load_and_resize_image", _fail)
+    imgs, features, paths = feat.get_imgs_and_extract_features_batch(img_paths, batch_size=2,
+                                                                     return_imgs=False,
+                                                                     **MODEL_KWARGS
+                                                                     )
+    assert imgs is None
+    assert paths == img_paths
+    assert reads == img_paths
+    np.testing.assert_allclose(features, COLORS / 255.0, atol=1e-6)
@@ -0,0 +1,95 @@
+import json
+import pytest
+import numpy as np
+from cluster_aware_splitter.feature_store import FeatureStore, get_model_config
+
+
+def _write_imgs(tmp_path, names):
+    paths = []
+    for name in names:
+        path = tmp_path / name
+        path.write_bytes(name.encode())
+        paths.append(str(path))
+    return paths
+
+
+def test_feature_store_only_extracts_new_images(tmp_path):
+    img_paths = _write_imgs(tmp_path, ["a.jpg", "b.jpg", "c.jpg"])
+    store = FeatureStore(tmp_path / "store", get_model_config())
+    calls = []
+
+    def extract_fn(paths):
+        calls.append(list(paths))
+        return paths, np.stack([np.full(4, len(calls[-1]) + i, dtype=np.float32)
+                                for i, _ in enumerate(paths)
+                                ])
+
+    first = store.get_or_extract(img_paths[:2], extract_fn)
+    assert first.shape == (2, 4)
+    assert isinstance(first, np.memmap)
+
+    reopened = FeatureStore(tmp_path / "store", get_model_config())
+    features = reopened.get_or_extract(img_paths, extract_fn)
+    assert calls == [img_paths[:2], img_paths[2:]]
+    assert features.shape == (3, 4)
+    np.testing.assert_array_equal(features[:2], first)
+
+
+def test_feature_store_is_keyed_by_model_config(tmp_path):
+    img_paths = _write_imgs(tmp_path, ["a.jpg"])
+    store = FeatureStore(tmp_path / "store", get_model_config())
+    store.add(img_paths, np.ones((1, 4)))
+    other = FeatureStore(tmp_path / "store", get_model_config(model_name="EfficientNetB3"))
+    assert other.missing(img_paths) == img_paths
+    assert store.missing(img_paths) == []
+
+
+def test_feature_store_appends_chunks_without_rewriting(tmp_path):
+    img_paths = _write_imgs(tmp_path, ["a.jpg", "b.jpg", "c.jpg", "d.jpg"])
+    store = FeatureStore(tmp_path / "store", get_model_config())
+    features = np.arange(16, dtype=np.float32).reshape(4, 4)
+    store.add(img_paths[:2], features[:2])
+    first_chunk = store.get_chunk_path(0)
+    first_mtime = first_chunk.stat().st_mtime_ns
+    store.add(img_paths[2:], features[2:])
+    assert store.num_chunks == 2
+    assert first_chunk.stat().st_mtime_ns == first_mtime
+
+    reopened = FeatureStore(tmp_path / "store", get_model_config())
+    assert reopened.chunk_offsets == [0, 2, 4]
+    np.testing.assert_array_equal(reopened.load_features(img_paths[::-1]), features[::-1])
+    assert isinstance(reopened.load_features(img_paths[2:]), np.memmap)
+
+
+def test_feature_store_reads_single_file_layout(tmp_path):
+    img_paths = _write_imgs(tmp_path, ["a.jpg", "b.jpg"])
+    store = FeatureStore(tmp_path / "store", get_model_config())
+    store.add(img_paths, np.ones((2, 4)))
+    # rewrite the store the way it was laid out before chunk files
+    index = json.loads(store.index_path.read_text())
+    del index["chunk_offsets"]
+    store.index_path.write_text(json.dumps(index))
+    store.get_chunk_path(0).rename(store.store_dir / "features.npy")
+
+    reopened = FeatureStore(tmp_path / "store", get_model_config())
+    np.testing.assert_array_equal(reopened.load_features(img_paths), np.ones((2, 4)))
+
+
+def test_feature_store_rejects_a_different_model_config(tmp_path):
+    store = FeatureStore(tmp_path / "store", get_model_config())
+    store.check_model_config(get_model_config())
+    with pytest.raises(ValueError, match="model_name"):
+        store.check_model_config(get_model_config(model_name="EfficientNetB3"))
+
+
+def test_run_multiprocess_rejects_a_store_for_another_model(tmp_path):
+    from cluster_aware_splitter import feat
+    img_paths = _write_imgs(tmp_path, ["a.jpg", "b.jpg"])
+    img_property_set = feat.ImgPropertySetReturnType(img_names=img_paths, img_paths=img_paths,
+                                                     total_num_imgs=2, max_num_clusters=2
+                                                     )
+    store = FeatureStore(tmp_path / "store", get_model_config(img_resize_width=300,
+                                                              img_resize_height=300
+                                                              ))
+    with pytest.raises(ValueError, match="img_resize_width"):
+        feat.run_multiprocess(img_property_set, feature_store=store)
@@ -0,0 +1,34 @@
+import json
+import subprocess
+import sys
+import pytest
+
+HEAVY_MODULES = ("tensorflow", "tensorflow_io", "torch", "cv2", "pycocotools", "clusteval")
+
+# generous budgets so that CI noise does not fail the suite; the point is to
+# catch a heavy backend sneaking back into module-level imports
+IMPORT_TIME_BUDGETS = {"cluster_aware_splitter": 0.5,
+                       "cluster_aware_splitter.anno_subproc": 0.5,
+                       "cluster_aware_splitter.cluster_aware_splitter": 2.0,
+                       "cluster_aware_splitter.feat": 2.0,
+                       }
+
+
+def _measure_import(module_name, cwd):
+    code = ("import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            f"import {module_name}\n"
+            "elapsed = time.perf_counter() - start\n"
+            f"print(json.dumps({{'elapsed': elapsed, 'modules': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))\n"
+            )
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                            text=True, check=True, cwd=cwd
+                            ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize("module_name", sorted(IMPORT_TIME_BUDGETS))
+def test_import_does_not_load_heavy_backends(module_name, tmp_path):
+    result = _measure_import(module_name, cwd=tmp_path)
+    assert result["modules"] == []
+    assert result["elapsed"] < IMPORT_TIME_BUDGETS[module_name]
@@ -0,0 +1,72 @@
+import gc
+import os
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+from cluster_aware_splitter.inference_backends import (INFERENCE_BACKENDS, KerasBackend,
+                                                       build_inference_backend, check_parity,
+                                                       prepare_inference_backend,
+                                                       select_fastest_backend
+                                                       )
+
+INPUT_SHAPE = (32, 32, 3)
+
+
+@pytest.fixture
+def feature_extractor():
+    inputs = tf.keras.Input(shape=INPUT_SHAPE)
+    x = tf.keras.layers.Conv2D(8, 3, activation="relu")(inputs)
+    outputs = tf.keras.layers.GlobalAveragePooling2D()(x)
+    return tf.keras.Model(inputs=inputs, outputs=outputs, name="feature_extractor")
+
+
+@pytest.mark.parametrize("inference_backend", ["tf_function", "saved_model", "tflite"])
+def test_exported_backends_match_keras(feature_extractor, inference_backend, tmp_path):
+    backend = build_inference_backend(inference_backend, feature_extractor, INPUT_SHAPE,
+                                      export_dir=str(tmp_path)
+                                      )
+    x = np.random.default_rng(0).uniform(0, 255, size=(3,) + INPUT_SHAPE).astype(np.float32)
+    parity = check_parity(KerasBackend(feature_extractor), backend, x, atol=1e-3)
+    assert parity["passed"], parity
+    assert backend(x[:1], training=False).shape == (1, backend.output_shape[-1])
+
+
+def test_select_fastest_backend_reports_every_candidate(feature_extractor, tmp_path):
+    backend, report = select_fastest_backend(feature_extractor, INPUT_SHAPE, num_runs=2,
+                                             export_dir=str(tmp_path)
+                                             )
+    assert [entry["backend"] for entry in report] == ["keras", "tf_function", "tflite"]
+    assert backend.name in {entry["backend"] for entry in report if entry.get("passed")}
+
+
+def test_prepare_resolves_auto_and_exports_once(feature_extractor, tmp_path):
+    inference_backend = prepare_inference_backend("auto", feature_extractor, INPUT_SHAPE,
+                                                  export_dir=str(tmp_path)
+                                                  )
+    assert inference_backend in INFERENCE_BACKENDS and inference_backend != "auto"
+    assert prepare_inference_backend("tflite", feature_extractor, INPUT_SHAPE,
+                                     export_dir=str(tmp_path)
+                                     ) == "tflite"
+    exported = sorted(os.listdir(tmp_path))
+    build_inference_backend("tflite", feature_extractor, INPUT_SHAPE, export_dir=str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == exported
+
+
+def test_temporary_export_is_removed_with_backend(feature_extractor):
+    backend = build_inference_backend("tflite", feature_extractor, INPUT_SHAPE)
+    export_dir = os.path.dirname(backend.model_path)
+    assert os.path.isdir(export_dir)
+    del backend
+    gc.collect()
+    assert not os.path.exists(export_dir)
+
+
+def test_export_is_not_reused_for_a_different_model(feature_extractor, tmp_path):
+    first = build_inference_backend("tflite", feature_extractor, INPUT_SHAPE, export_dir=str(tmp_path))
+    feature_extractor.set_weights([weight * 2 for weight in feature_extractor.get_weights()])
+    second = build_inference_backend("tflite", feature_extractor, INPUT_SHAPE, export_dir=str(tmp_path))
+    assert first.model_path != second.model_path
+    x = np.random.default_rng(0).uniform(0, 255, size=(2,) + INPUT_SHAPE).astype(np.float32)
+    assert check_parity(KerasBackend(feature_extractor), second, x)["passed"]
+    assert not check_parity(KerasBackend(feature_extractor), first, x)["passed"]
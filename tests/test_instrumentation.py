@@ -0,0 +1,65 @@
+from cluster_aware_splitter.instrumentation import (NULL_INSTRUMENTATION, Instrumentation,
+                                                    get_instrumentation, set_instrumentation
+                                                    )
+
+
+def test_instrumentation_records_stages_and_counters(tmp_path):
+    observed = []
+    instrumentation = Instrumentation(callbacks=[lambda name, seconds: observed.append(name)])
+    with instrumentation.stage("decode"):
+        pass
+    instrumentation.observe("inference", 0.2)
+    instrumentation.increment("images_processed", 32)
+
+    worker = Instrumentation()
+    worker.observe("inference", 0.3)
+    instrumentation.merge(worker.pop_state())
+    assert worker.histograms == {}
+
+    summary = instrumentation.summary()
+    assert observed == ["decode", "inference"]
+    assert summary["stages"]["inference"]["count"] == 2
+    assert summary["counters"] == {"images_processed": 32}
+
+    metrics_path = tmp_path / "metrics.prom"
+    instrumentation.write_prometheus_textfile(metrics_path)
+    text = metrics_path.read_text()
+    assert 'cluster_aware_splitter_stage_duration_seconds_bucket{stage="inference",le="0.25"} 1' in text
+    assert 'cluster_aware_splitter_stage_duration_seconds_count{stage="inference"} 2' in text
+    assert "cluster_aware_splitter_images_processed_total 32" in text
+
+
+def test_null_instrumentation_is_default_and_inert():
+    assert get_instrumentation() is NULL_INSTRUMENTATION
+    with NULL_INSTRUMENTATION.stage("decode"):
+        NULL_INSTRUMENTATION.increment("images_processed")
+    assert NULL_INSTRUMENTATION.summary()["stages"] == {}
+    previous = set_instrumentation(Instrumentation())
+    assert get_instrumentation().enabled
+    set_instrumentation(previous)
+    assert get_instrumentation() is NULL_INSTRUMENTATION
+
+
+def test_run_multiprocess_keeps_active_instrumentation_and_honours_metrics_path(tmp_path, monkeypatch):
+    from cluster_aware_splitter import feat
+    seen = []
+
+    def _fake_run_multiprocess(img_property_set, **kwargs):
+        seen.append(get_instrumentation())
+        get_instrumentation().increment("images_processed", 3)
+
+    monkeypatch.setattr(feat, "_run_multiprocess", _fake_run_multiprocess)
+    active = Instrumentation()
+    previous = set_instrumentation(active)
+    try:
+        feat.run_multiprocess(None)
+        assert seen[-1] is active
+    finally:
+        set_instrumentation(previous)
+    assert active.counters["images_processed"] == 3
+
+    metrics_path = tmp_path / "metrics.prom"
+    feat.run_multiprocess(None, metrics_path=str(metrics_path))
+    assert seen[-1].enabled
+    assert "cluster_aware_splitter_images_processed_total 3" in metrics_path.read_text()
+    assert get_instrumentation() is NULL_INSTRUMENTATION
@@ -0,0 +1,29 @@
+import types
+import pytest
+from cluster_aware_splitter import feat
+from cluster_aware_splitter.lazy_import import lazy_import
+
+
+def test_failing_on_import_hook_runs_again_on_next_access():
+    calls = []
+
+    def _on_import(module):
+        calls.append(module.__name__)
+        if len(calls) == 1:
+            raise RuntimeError("hook failed")
+
+    lazy_json = lazy_import("json", on_import=_on_import)
+    with pytest.raises(RuntimeError, match="hook failed"):
+        lazy_json.dumps
+    assert lazy_json.dumps([1]) == "[1]"
+    assert lazy_json.loads("[1]") == [1]
+    assert calls == ["json", "json"]
+
+
+def test_hide_gpus_logs_when_devices_are_already_initialized(caplog):
+    def _set_visible_devices(devices, device_type):
+        raise RuntimeError("Visible devices cannot be modified after being initialized")
+
+    tf_module = types.SimpleNamespace(config=types.SimpleNamespace(set_visible_devices=_set_visible_devices))
+    feat._hide_gpus(tf_module)
+    assert "Could not hide GPUs" in caplog.text
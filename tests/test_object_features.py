@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from cluster_aware_splitter import feat
+from cluster_aware_splitter.feat import aggregate_object_features, get_object_features
+
+MODEL_KWARGS = dict(img_resize_width=16, img_resize_height=16, model_family="stub",
+                    model_name="Stub", img_normalization_weight=None, seed=2024
+                    )
+
+
+class _ChannelMeanModel(object):
+    output_shape = (None, 3)
+
+    def __call__(self, x, training=False):
+        return np.asarray(x, dtype=np.float32).mean(axis=(1, 2))
+
+
+@pytest.fixture
+def stub_model():
+    key = feat.get_model_registry_key((16, 16, 3), "stub", "Stub", None)
+    feat._MODEL_REGISTRY[key] = feat.ModelPreprocessReturn(model=_ChannelMeanModel(),
+                                                           preprocess=lambda x: x
+                                                           )
+    yield
+    feat._MODEL_REGISTRY.pop(key, None)
+
+
+def test_aggregate_object_features():
+    features = np.array([[1.0, 4.0], [3.0, 0.0]])
+    np.testing.assert_allclose(aggregate_object_features(features, "sum"), [4.0, 4.0])
+    np.testing.assert_allclose(aggregate_object_features(features, "mean"), [2.0, 2.0])
+    np.testing.assert_allclose(aggregate_object_features(features, "max"), [3.0, 4.0])
+    gem = aggregate_object_features(features, "gem")
+    assert np.all(gem >= aggregate_object_features(features, "mean") - 1e-6)
+    assert np.all(gem <= aggregate_object_features(features, "max") + 1e-6)
+    with pytest.raises(ValueError):
+        aggregate_object_features(features, "median")
+
+
+def test_invalid_options_fail_before_the_model_is_built(stub_model, monkeypatch):
+    def _fail(self):
+        raise AssertionError("model should not be built")
+
+    monkeypatch.setattr(feat.FeatureExtractor, "get_cached_feature_extractor", _fail)
+    crops = [np.zeros((4, 4, 3), dtype=np.uint8)]
+    with pytest.raises(ValueError, match="reduction"):
+        get_object_features(crops, reduction="median", **MODEL_KWARGS)
+    with pytest.raises(ValueError, match="empty_fallback"):
+        get_object_features([], empty_fallback="whole", img_path="img.jpg", **MODEL_KWARGS)
+    with pytest.raises(ValueError, match="No objects"):
+        get_object_features([], empty_fallback="raise", img_path="img.jpg", **MODEL_KWARGS)
+
+
+def test_zeros_fallback(stub_model):
+    features = get_object_features([], empty_fallback="zeros", img_path="img.jpg", **MODEL_KWARGS)
+    np.testing.assert_array_equal(features, np.zeros(3, dtype=np.float32))
+
+
+def test_image_fallback_needs_img_path(stub_model):
+    with pytest.raises(ValueError, match="img_path"):
+        get_object_features([], empty_fallback="image", **MODEL_KWARGS)
+    features = get_object_features([], empty_fallback="zeros", **MODEL_KWARGS)
+    np.testing.assert_array_equal(features, np.zeros(3, dtype=np.float32))
+
+
+def test_image_fallback_matches_object_rows(stub_model, tmp_path):
+    pytest.importorskip("tensorflow")
+    cv2 = pytest.importorskip("cv2")
+    image = np.zeros((16, 16, 3), dtype=np.uint8)
+    image[..., 2] = 200
+    img_path = str(tmp_path / "img.png")
+    cv2.imwrite(img_path, image)
+    fallback = get_object_features([], empty_fallback="image", img_path=img_path, **MODEL_KWARGS)
+    as_object = get_object_features([cv2.imread(img_path)], reduction="mean", **MODEL_KWARGS)
+    np.testing.assert_allclose(fallback, as_object)
+    np.testing.assert_allclose(fallback, [0.0, 0.0, 200.0])
@@ -0,0 +1,34 @@
+import json
+from cluster_aware_splitter.packing import (count_packed_images, get_packed_shard_paths,
+                                            iter_packed_images, pack_images
+                                            )
+
+
+def test_pack_and_stream_images_with_coco_annotations(tmp_path):
+    img_dir = tmp_path / "imgs"
+    img_dir.mkdir()
+    img_paths = []
+    for i in range(7):
+        img_path = img_dir / f"img_{i}.jpg"
+        img_path.write_bytes(bytes([i]) * (100 + i))
+        img_paths.append(str(img_path))
+    coco_path = tmp_path / "annotations.json"
+    coco_path.write_text(json.dumps({"images": [{"id": 1, "file_name": "img_2.jpg", "height": 4, "width": 4}],
+                                     "annotations": [{"id": 5, "image_id": 1, "category_id": 1,
+                                                      "bbox": [0, 0, 2, 2]
+                                                      }],
+                                     "categories": [{"id": 1, "name": "thing"}],
+                                     }))
+
+    shard_paths = pack_images(img_paths, str(tmp_path / "packed"), max_images_per_shard=3,
+                              coco_annotation_filepath=str(coco_path)
+                              )
+    assert len(shard_paths) == 3
+    assert get_packed_shard_paths(str(tmp_path / "packed")) == shard_paths
+    assert count_packed_images(str(tmp_path / "packed")) == 7
+
+    packed = list(iter_packed_images(shard_paths))
+    assert [metadata["path"] for metadata, _ in packed] == img_paths
+    assert [contents for _, contents in packed] == [bytes([i]) * (100 + i) for i in range(7)]
+    assert packed[2][0]["coco_annotations"][0]["id"] == 5
+    assert "coco_annotations" not in packed[0][0]
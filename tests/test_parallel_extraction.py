@@ -0,0 +1,86 @@
+import os
+import time
+import numpy as np
+import pytest
+from cluster_aware_splitter.parallel_extraction import (extract_features_shared_memory,
+                                                        get_feature_dim
+                                                        )
+from cluster_aware_splitter.scheduler import ExecutionPlan
+
+EXECUTION_PLAN = ExecutionPlan(num_processes=3, intra_op_threads=1, inter_op_threads=1,
+                               batch_size=2, task_size=4
+                               )
+
+
+def _index_of(img_path):
+    return int(os.path.splitext(img_path)[0].split("_")[-1])
+
+
+def _stub_extract(img_paths, batch_size):
+    indices = np.array([_index_of(img_path) for img_path in img_paths], dtype=np.float32)
+    # early tasks finish last, so imap_unordered returns them out of order
+    time.sleep(0.05 / (1 + float(indices[0])))
+    return np.stack([indices, indices * 2], axis=1)
+
+
+def _failing_extract(img_paths, batch_size):
+    raise RuntimeError("model failed")
+
+
+def _list_shared_memory():
+    # the pool's own semaphores also live here
+    return {name for name in os.listdir("/dev/shm") if not name.startswith("sem.")}
+
+
+def test_rows_follow_input_order():
+    img_paths = [f"imgs/img_{i}.jpg" for i in range(30)]
+    features = extract_features_shared_memory(img_paths, execution_plan=EXECUTION_PLAN,
+                                              feature_dim=2, extract_fn=_stub_extract
+                                              )
+    np.testing.assert_array_equal(features[:, 0], np.arange(30))
+    np.testing.assert_array_equal(features[:, 1], 2 * np.arange(30))
+
+
+def test_empty_input_and_known_feature_dim():
+    features = extract_features_shared_memory([], execution_plan=EXECUTION_PLAN,
+                                              feature_dim=2, extract_fn=_stub_extract
+                                              )
+    assert features.shape == (0, 2)
+    assert get_feature_dim(model_name="EfficientNetB0") == 1280
+    with pytest.raises(ValueError):
+        extract_features_shared_memory(["imgs/img_0.jpg"], extract_fn=_stub_extract)
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs /dev/shm to list shared memory")
+def test_shared_memory_is_removed_when_a_worker_raises():
+    before = _list_shared_memory()
+    with pytest.raises(RuntimeError, match="model failed"):
+        extract_features_shared_memory([f"imgs/img_{i}.jpg" for i in range(10)],
+                                       execution_plan=EXECUTION_PLAN, feature_dim=2,
+                                       extract_fn=_failing_extract
+                                       )
+    assert _list_shared_memory() <= before
+
+
+class _ProbeCalled(Exception):
+    pass
+
+
+def test_run_multiprocess_probe_calls_probe_batch_sizes(monkeypatch):
+    from cluster_aware_splitter import feat, parallel_extraction
+    calls = []
+
+    def _fake_probe(**kwargs):
+        calls.append(kwargs)
+        raise _ProbeCalled()
+
+    monkeypatch.setattr(parallel_extraction, "probe_batch_sizes", _fake_probe)
+    img_paths = [f"imgs/img_{i}.jpg" for i in range(4)]
+    img_property_set = feat.ImgPropertySetReturnType(img_names=img_paths, img_paths=img_paths,
+                                                     total_num_imgs=4, max_num_clusters=2
+                                                     )
+    with pytest.raises(_ProbeCalled):
+        feat.run_multiprocess(img_property_set, probe=True)
+    assert len(calls) == 1
+    with pytest.raises(ValueError, match="batch_size must be None"):
+        extract_features_shared_memory(img_paths, probe=True, batch_size=16)
@@ -0,0 +1,23 @@
+from cluster_aware_splitter.scheduler import plan_execution
+
+
+def test_plan_execution_avoids_oversubscription():
+    execution_plan = plan_execution(num_images=200000, num_cpus=64)
+    assert execution_plan.num_processes * execution_plan.intra_op_threads == 64
+    assert execution_plan.intra_op_threads > 1
+    assert execution_plan.task_size % execution_plan.batch_size == 0
+
+
+def test_plan_execution_uses_probe_and_caps_processes():
+    execution_plan = plan_execution(num_images=40, num_cpus=8,
+                                    probe_results={8: 10.0, 16: 25.0, 32: 20.0}
+                                    )
+    assert execution_plan.batch_size == 16
+    assert execution_plan.num_processes == 3
+    assert execution_plan.task_size == 16
+
+
+def test_plan_execution_respects_num_processes():
+    execution_plan = plan_execution(num_images=10000, num_cpus=32, num_processes=4)
+    assert execution_plan.num_processes == 4
+    assert execution_plan.intra_op_threads == 8
@@ -0,0 +1,43 @@
+import multiprocessing
+from functools import partial
+import numpy as np
+import pytest
+from cluster_aware_splitter.sharding import (extract_shard, merge_shards, parse_shard_spec,
+                                             select_shard
+                                             )
+
+
+def _fake_extract(img_paths):
+    features = np.array([[len(img_path), int(img_path.split("_")[-1].split(".")[0])]
+                         for img_path in img_paths], dtype=np.float32)
+    return img_paths, features
+
+
+def test_shards_partition_paths_and_parse_spec():
+    img_paths = [f"imgs/img_{i}.jpg" for i in range(1000)]
+    shards = [select_shard(img_paths, i, 4) for i in range(4)]
+    assert sorted(sum(shards, [])) == sorted(img_paths)
+    assert min(len(shard) for shard in shards) > 200
+    assert shards[1] == select_shard(img_paths, 1, 4)
+    assert parse_shard_spec("3/16") == (3, 16)
+    with pytest.raises(ValueError):
+        parse_shard_spec("16/16")
+
+
+def test_extract_shards_in_processes_and_merge(tmp_path):
+    img_paths = [f"imgs/img_{i}.jpg" for i in range(200)]
+    num_shards = 3
+    extract = partial(extract_shard, img_paths, num_shards=num_shards,
+                      output_dir=str(tmp_path), extract_fn=_fake_extract
+                      )
+    with multiprocessing.get_context("spawn").Pool(num_shards) as pool:
+        pool.map(extract, range(num_shards))
+
+    merged_paths, features = merge_shards(str(tmp_path), num_shards, img_paths=img_paths,
+                                          output_path=str(tmp_path / "features.npy")
+                                          )
+    assert merged_paths == img_paths
+    np.testing.assert_array_equal(features[:, 1], np.arange(200))
+    np.testing.assert_array_equal(np.load(tmp_path / "features.npy"), features)
+    with pytest.raises(ValueError):
+        merge_shards(str(tmp_path), 4)
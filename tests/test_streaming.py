@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from cluster_aware_splitter.streaming import (NpyFeatureSink, StreamingClusterSink,
+                                              consume_features
+                                              )
+
+
+def _feature_batches(num_batches=6, batch_size=50, dim=8):
+    rng = np.random.default_rng(0)
+    centers = np.eye(3, dim) * 50
+    for batch in range(num_batches):
+        labels = rng.integers(0, 3, size=batch_size)
+        paths = [f"img_{batch}_{i}.jpg" for i in range(batch_size)]
+        yield paths, (centers[labels] + rng.normal(size=(batch_size, dim))).astype(np.float32)
+
+
+@pytest.mark.parametrize("num_rows", [300, None])
+def test_npy_feature_sink_writes_incrementally(tmp_path, num_rows):
+    output_path = tmp_path / "features.npy"
+    batches = list(_feature_batches())
+    with NpyFeatureSink(output_path, num_rows=num_rows) as sink:
+        for paths, features in batches:
+            sink.write(paths, features)
+    written = np.load(output_path, mmap_mode="r")
+    np.testing.assert_array_equal(written, np.concatenate([features for _, features in batches]))
+    paths = (tmp_path / "features_paths.txt").read_text().splitlines()
+    assert paths == [path for batch_paths, _ in batches for path in batch_paths]
+    assert not (tmp_path / "features.npy.raw").exists()
+
+
+def test_streaming_cluster_sink_fits_online(tmp_path):
+    cluster_sink = StreamingClusterSink(max_num_clusters=5, warmup_size=100)
+    num_rows = consume_features(_feature_batches(), [cluster_sink])
+    assert num_rows == 300
+    assert cluster_sink.num_clusters == 3
+    labels = cluster_sink.predict(np.eye(3, 8) * 50)
+    assert len(set(labels)) == 3
+
+
+def test_npy_feature_sink_rejects_row_count_mismatch(tmp_path):
+    batches = list(_feature_batches(num_batches=2))
+    with pytest.raises(ValueError, match="only 100 were written"):
+        consume_features(batches, [NpyFeatureSink(tmp_path / "short.npy", num_rows=150)])
+    with pytest.raises(ValueError, match="declared with 60 rows, got at least 100"):
+        consume_features(batches, [NpyFeatureSink(tmp_path / "long.npy", num_rows=60)])
+
+
+class _FailingCloseSink(NpyFeatureSink):
+    def close(self):
+        super().close()
+        raise OSError("disk full")
+
+    def abort(self):
+        super().abort()
+        raise OSError("disk full")
+
+
+def test_consume_features_reraises_the_batch_error_and_aborts_every_sink(tmp_path):
+    def _batches():
+        yield from _feature_batches(num_batches=1)
+        raise RuntimeError("decode failed")
+
+    failing = _FailingCloseSink(tmp_path / "failing.npy", num_rows=300)
+    sink = NpyFeatureSink(tmp_path / "features.npy", num_rows=300)
+    with pytest.raises(RuntimeError, match="decode failed"):
+        consume_features(_batches(), [failing, sink])
+    assert sink._closed
+    assert not (tmp_path / "features.npy").exists()
+    assert not (tmp_path / "features_paths.txt").exists()
+
+
+def test_consume_features_closes_every_sink_when_one_close_fails(tmp_path):
+    failing = _FailingCloseSink(tmp_path / "failing.npy")
+    sink = NpyFeatureSink(tmp_path / "features.npy")
+    with pytest.raises(OSError, match="disk full"):
+        consume_features(_feature_batches(num_batches=2), [failing, sink])
+    assert np.load(tmp_path / "features.npy").shape == (100, 8)